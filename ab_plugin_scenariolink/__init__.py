@@ -1,21 +1,13 @@
-import activity_browser as ab
+"""
+ScenarioLink: an Activity Browser plugin to reproduce scenario-based LCA databases from `unfold` datapackages.
 
-from .layouts.tabs import RightTab
+The Activity Browser loads the `Plugin` class, which is only imported when it is asked for: modules that
+don't need the GUI, e.g. `python -m ab_plugin_scenariolink.cache_audit`, run without Qt and the Activity Browser.
+"""
 
-class Plugin(ab.Plugin):
 
-    def __init__(self):
-        infos = {
-            "name": "ScenarioLink",
-        }
-        ab.Plugin.__init__(self, infos)
-
-    def load(self):
-        self.rightTab = RightTab(self)
-        self.tabs = [self.rightTab]
-
-    def close(self):
-        return
-
-    def remove(self):
-        return
\ No newline at end of file
+def __getattr__(name: str):
+    if name == "Plugin":
+        from .plugin import Plugin
+        return Plugin
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
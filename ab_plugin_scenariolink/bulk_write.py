@@ -0,0 +1,245 @@
+"""
+Bulk database writing for the ScenarioLink plugin.
+This module provides a write mode that speeds up the brightway2 SQLite writes done by `unfold`.
+"""
+
+from contextlib import contextmanager, nullcontext
+import pickle
+from typing import List
+from logging import getLogger
+
+from unfold import Unfold
+
+from .journal import database_step
+
+log = getLogger(__name__)
+
+# number of rows sent to SQLite per `executemany` call
+BATCH_SIZE = 20000
+
+# pragmas applied to the brightway2 SQLite database while databases are written. The journal mode is left
+# as it is, the SQLite file holds all databases of the project and must survive a crash during the write
+IMPORT_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": "-262144",  # negative values are in KiB, so this is 256 MiB
+}
+# the indices brightway2 drops during large writes, see `restore_indices`
+INDICES = ("activitydataset_key", "exchangedataset_input", "exchangedataset_output")
+
+ACTIVITY_SQL = ('INSERT INTO "activitydataset" ("data", "code", "database", "location", "name", "product", "type") '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)')
+EXCHANGE_SQL = ('INSERT INTO "exchangedataset" ("data", "input_code", "input_database", '
+                '"output_code", "output_database", "type") VALUES (?, ?, ?, ?, ?, ?)')
+
+
+def _bulk_write_many_data(self, data, indices=True):
+    """Replacement for `SQLiteBackend._efficient_write_many_data`.
+
+    Writes all activities and exchanges of a database with batched `executemany` calls inside a single
+    transaction. Indices are not touched here, `bulk_write_mode` drops and rebuilds them once per block.
+    """
+    from bw2data.backends.peewee import sqlite3_lci_db
+    from bw2data.backends.peewee.schema import ActivityDataset, ExchangeDataset
+    from bw2data.errors import InvalidExchange, UntypedExchange
+    from .progress import progress
+
+    progress.start(f"Writing {self.name}", sum(len(ds.get("exchanges", [])) for ds in data.values()), "exchanges")
+    protocol = pickle.HIGHEST_PROTOCOL
+    with sqlite3_lci_db.db.atomic():
+        ActivityDataset.delete().where(ActivityDataset.database == self.name).execute()
+        ExchangeDataset.delete().where(ExchangeDataset.output_database == self.name).execute()
+
+        cursor = sqlite3_lci_db.db.cursor()
+        activities, exchanges = [], []
+        for key, ds in data.items():
+            for exchange in ds.get("exchanges", []):
+                if "input" not in exchange or "amount" not in exchange:
+                    raise InvalidExchange
+                if "type" not in exchange:
+                    raise UntypedExchange
+                exchange["output"] = key
+                exchanges.append((
+                    pickle.dumps(exchange, protocol=protocol),
+                    exchange["input"][1], exchange["input"][0],
+                    key[1], key[0],
+                    exchange["type"],
+                ))
+                if len(exchanges) >= BATCH_SIZE:
+                    cursor.executemany(EXCHANGE_SQL, exchanges)
+                    progress.advance(len(exchanges))
+                    exchanges = []
+
+            ds = {k: v for k, v in ds.items() if k != "exchanges"}
+            ds["database"] = key[0]
+            ds["code"] = key[1]
+            activities.append((
+                pickle.dumps(ds, protocol=protocol),
+                key[1], key[0],
+                ds.get("location"), ds.get("name"), ds.get("reference product"),
+                ds.get("type", "process"),
+            ))
+            if len(activities) >= BATCH_SIZE:
+                cursor.executemany(ACTIVITY_SQL, activities)
+                activities = []
+
+        if activities:
+            cursor.executemany(ACTIVITY_SQL, activities)
+        if exchanges:
+            cursor.executemany(EXCHANGE_SQL, exchanges)
+
+
+def _set_pragmas(db, pragmas: dict) -> dict:
+    """Apply `pragmas` to the peewee database `db` and return the values they replaced."""
+    previous = {}
+    for pragma, value in pragmas.items():
+        previous[pragma] = db.execute_sql(f"PRAGMA {pragma}").fetchone()[0]
+        db.execute_sql(f"PRAGMA {pragma} = {value}")
+    return previous
+
+
+def restore_indices() -> None:
+    """Add the SQLite indices of the current project if a write that dropped them was interrupted."""
+    try:
+        from bw2data.backends.peewee import sqlite3_lci_db, SQLiteBackend
+    except ImportError:
+        return
+    present = {name for (name,) in sqlite3_lci_db.db.execute_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()}
+    missing = [index for index in INDICES if index not in present]
+    if missing:
+        log.warning(f"Restoring the database indices {missing} of an interrupted write")
+        SQLiteBackend._add_indices(None)
+
+
+@contextmanager
+def bulk_write_mode(databases: List[str]):
+    """Write the brightway2 `databases` in bulk for the duration of the `with` block.
+
+    While active, for `databases` only:
+     - rows are inserted with batched `executemany` calls inside one transaction per database
+     - the SQLite indices, processing of the database and the search index are deferred,
+       they are rebuilt once for all databases written in the block when it exits
+    Writes of other databases, e.g. by the user in the Activity Browser, take the normal path.
+    The block should only hold the writes, not the computation before them: the SQLite synchronous pragma
+    is relaxed and the indices are dropped while it is active.
+
+    The data written is identical to the normal brightway2 path, only the order of the work differs.
+    If brightway2 does not expose the expected SQLite backend, the block runs without changes.
+    """
+    try:
+        import bw2data as bd
+        from bw2data.backends.peewee import sqlite3_lci_db, SQLiteBackend
+    except ImportError as e:
+        log.warning(f"Bulk write mode unavailable, using the default write path: {e}")
+        yield
+        return
+    if not all(hasattr(SQLiteBackend, attr) for attr in
+               ("_efficient_write_many_data", "_drop_indices", "_add_indices", "make_searchable", "process")):
+        log.warning("Bulk write mode unavailable for this brightway version, using the default write path.")
+        yield
+        return
+
+    names = set(databases)
+    deferred = []  # names of databases written in this block, in write order
+
+    def defer(self, *args, **kwargs):
+        if self.name not in deferred:
+            deferred.append(self.name)
+
+    replacements = {
+        "_efficient_write_many_data": _bulk_write_many_data,
+        "make_searchable": defer,
+        "process": defer,
+    }
+    originals = {attr: getattr(SQLiteBackend, attr) for attr in replacements}
+
+    def divert(attr):
+        def method(self, *args, **kwargs):
+            if self.name in names:
+                return replacements[attr](self, *args, **kwargs)
+            return originals[attr](self, *args, **kwargs)
+        return method
+
+    db = sqlite3_lci_db.db
+    previous_pragmas = _set_pragmas(db, IMPORT_PRAGMAS)
+    SQLiteBackend._drop_indices(None)
+    for attr in replacements:
+        setattr(SQLiteBackend, attr, divert(attr))
+    log.info(f"Bulk write mode enabled for {len(names)} database(s)")
+    try:
+        yield
+    finally:
+        for attr, method in originals.items():
+            setattr(SQLiteBackend, attr, method)
+        _set_pragmas(db, previous_pragmas)
+        from .progress import progress
+        progress.start("Rebuilding database indices")
+        SQLiteBackend._add_indices(None)
+
+        for name in deferred:
+            if name not in bd.databases:
+                # the write failed and unfold or brightway removed the database again
+                continue
+            progress.start(f"Processing and indexing database {name}")
+            database = bd.Database(name)
+            database.process()
+            database.make_searchable(reset=True)
+
+
+class BulkWriteUnfold(Unfold):
+    """`Unfold` that writes its databases in bulk (see `bulk_write_mode`), only while they are written.
+
+    With a `journal`, the start of every database write is recorded in it, together with the state of
+    a database of the same name that is replaced, see `journal.rollback_databases`. Once its rows are
+    committed a database is recorded as done, with `processed` False while bulk write mode defers its
+    processing, so a database finished before an interruption is kept and only processed on resume.
+    """
+
+    bulk_write = True
+    journal = None
+
+    def databases_to_write(self, superstructure: bool) -> List[str]:
+        """Return the names of the databases `write` writes."""
+        if superstructure:
+            return [self.name or self.package.descriptor["name"]]
+        return list(self.databases_to_export)
+
+    def begin_database(self, name: str) -> None:
+        """Record in the journal that the write of `name` begins."""
+        if self.journal is None:
+            return
+        import bw2data as bd
+        existed = name in bd.databases
+        self.journal.start(database_step(name), existed=existed,
+                           modified=bd.databases[name].get("modified") if existed else None)
+
+    def end_database(self, name: str) -> None:
+        """Record in the journal that the rows of `name` are written."""
+        if self.journal is None:
+            return
+        self.journal.done(database_step(name), processed=not self.bulk_write)
+
+    def write(self, superstructure: bool = False, export_dir: str = None):
+        names = self.databases_to_write(superstructure)
+        with bulk_write_mode(names) if self.bulk_write else nullcontext():
+            if superstructure:
+                self.begin_database(names[0])
+                super().write(superstructure=True, export_dir=export_dir)
+                self.end_database(names[0])
+            else:
+                # one database at a time, so each is journaled right before and after it is written
+                databases = self.databases_to_export
+                try:
+                    for name, data in databases.items():
+                        self.databases_to_export = {name: data}
+                        self.begin_database(name)
+                        super().write(superstructure=False, export_dir=export_dir)
+                        self.end_database(name)
+                finally:
+                    self.databases_to_export = databases
+        if self.journal is not None and self.bulk_write:
+            # bulk write mode processed the databases when it exited
+            for name in names:
+                if self.journal.is_done(database_step(name)):
+                    self.journal.done(database_step(name), processed=True)
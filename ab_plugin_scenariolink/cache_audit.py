@@ -0,0 +1,212 @@
+"""
+Datapackage cache audit for the ScenarioLink plugin.
+This module verifies the cached datapackages, moves damaged ones to a quarantine folder and fetches them again.
+
+Every `<record>.zip` in the cache is checked for a readable zip central directory, a valid descriptor whose
+resources are in the archive, and its stored checksum (`<record>.zip.md5`, written when it was cached).
+Packages cached before checksums were stored have the CRC of every member checked instead.
+
+Run `python -m ab_plugin_scenariolink.cache_audit` to audit the cache from the command line.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import os
+import posixpath
+import zipfile
+from typing import Callable, List, Optional
+from logging import getLogger
+
+import appdirs
+
+from .cache_lock import cache_lock, record_of
+from .mirrors import read_checksum, file_checksum
+
+log = getLogger(__name__)
+
+OK = "ok"
+IN_USE = "in use"
+DAMAGED = "damaged"
+
+
+def cache_folder() -> str:
+    return appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser")
+
+
+def quarantine_folder() -> str:
+    folder = os.path.join(cache_folder(), "quarantine")
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+
+def cached_packages() -> List[str]:
+    """Return the paths of the datapackages in the cache."""
+    if not os.path.exists(cache_folder()):
+        return []
+    return sorted(os.path.join(cache_folder(), f) for f in os.listdir(cache_folder()) if f.endswith(".zip"))
+
+
+def _check_descriptor(archive: zipfile.ZipFile) -> Optional[str]:
+    """Return what is wrong with the descriptor of a datapackage archive, None if it is valid."""
+    names = archive.namelist()
+    descriptors = [n for n in names if posixpath.basename(n) == "datapackage.json"]
+    if not descriptors:
+        return "no datapackage.json"
+    descriptor_name = min(descriptors, key=len)
+    try:
+        descriptor = json.loads(archive.read(descriptor_name).decode("utf-8"))
+    except (ValueError, UnicodeDecodeError) as e:
+        return f"unreadable datapackage.json: {e}"
+    for key in ("resources", "scenarios"):
+        if not isinstance(descriptor.get(key), list) or not descriptor[key]:
+            return f"datapackage.json has no {key}"
+    root = posixpath.dirname(descriptor_name)
+    for resource in descriptor["resources"]:
+        path = resource.get("path")
+        if isinstance(path, str) and posixpath.normpath(posixpath.join(root, path)) not in names:
+            return f"resource {resource.get('name', path)} is missing"
+
+
+def check_archive(path: str, expected: Optional[str] = None) -> Optional[str]:
+    """Return what is wrong with the datapackage archive at `path`, None if it is intact.
+
+    With the `expected` checksum the file is hashed, otherwise the CRC of every member is checked.
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            problem = _check_descriptor(archive)
+            if problem is None and expected is None:
+                bad = archive.testzip()
+                if bad is not None:
+                    problem = f"member {bad} is corrupt"
+    except (zipfile.BadZipFile, OSError, EOFError) as e:
+        problem = f"unreadable zip: {e}"
+    if problem is None and expected is not None and file_checksum(path) != expected:
+        problem = "checksum does not match"
+    return problem
+
+
+def check_package(path: str) -> dict:
+    """
+    Verify the cached datapackage at `path`.
+
+    Returns:
+        dict: {"path", "record", "status" (OK, IN_USE or DAMAGED), "problem" (str or None), "checksum" (bool)}
+    """
+    record = record_of(path)
+    result = {"path": path, "record": record, "status": OK, "problem": None, "checksum": False}
+    try:
+        # a download or import that holds the lock is not interrupted, its file is checked next time
+        with cache_lock(record, shared=True, blocking=False):
+            try:
+                with open(path + ".md5", "r", encoding="utf-8") as f:
+                    expected = read_checksum(f.read())
+            except OSError:
+                # no stored checksum, check_archive checks the CRC of every member instead
+                expected = None
+            result["checksum"] = expected is not None
+            problem = check_archive(path, expected)
+    except TimeoutError:
+        result["status"] = IN_USE
+        return result
+
+    if problem is not None:
+        result["status"], result["problem"] = DAMAGED, problem
+    return result
+
+
+def audit_cache(paths: Optional[List[str]] = None, workers: Optional[int] = None,
+                callback: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """
+    Verify the cached datapackages in parallel.
+
+    Threads are used rather than processes: hashing and decompressing release the GIL, so the checks of
+    different packages run on several cores without starting new interpreters.
+
+    Parameters:
+        paths (list, optional): The packages to check, default every package in the cache.
+        workers (int, optional): The number of parallel checks, default the number of cores.
+        callback (callable, optional): Called with the result of each package as soon as it is checked.
+
+    Returns:
+        list: The results of `check_package`, in the order of `paths`.
+    """
+    paths = cached_packages() if paths is None else paths
+    results = []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for result in pool.map(check_package, paths):
+            if result["status"] == DAMAGED:
+                log.warning(f"Cached datapackage {result['record']} is damaged: {result['problem']}")
+            if callback is not None:
+                callback(result)
+            results.append(result)
+    return results
+
+
+def quarantine(result: dict) -> Optional[str]:
+    """Move a damaged package and its checksum out of the cache, returns its path in the quarantine folder."""
+    path = result["path"]
+    target = os.path.join(quarantine_folder(),
+                          f"{os.path.basename(path)}.{datetime.now().strftime('%Y%m%d%H%M%S')}")
+    try:
+        with cache_lock(result["record"], blocking=False):
+            os.replace(path, target)
+            if os.path.exists(path + ".md5"):
+                os.replace(path + ".md5", target + ".md5")
+    except TimeoutError:
+        log.info(f"Not moving {path}, it is in use")
+        return
+    log.info(f"Moved damaged datapackage {result['record']} to {target}")
+    return target
+
+
+def repair_cache(results: List[dict], refetch: Optional[Callable[[str], object]] = None) -> List[str]:
+    """
+    Quarantine the damaged packages of an audit and fetch them again with `refetch`.
+
+    Parameters:
+        results (list): The results of `audit_cache`.
+        refetch (callable, optional): Called with the record ID of each quarantined package,
+            e.g. `download_files_from_zenodo`. Without it packages are only quarantined.
+
+    Returns:
+        list: The record IDs that were quarantined.
+    """
+    quarantined = [r["record"] for r in results if r["status"] == DAMAGED and quarantine(r)]
+    if refetch is not None:
+        for record in quarantined:
+            try:
+                refetch(record)
+            except Exception as e:
+                log.error(f"Failed to fetch {record} again: {e}")
+    return quarantined
+
+
+def main(argv: Optional[list] = None) -> int:
+    import argparse
+    import logging
+    from .mirrors import fetch_from_mirrors
+
+    parser = argparse.ArgumentParser(description="Verify the ScenarioLink datapackage cache.")
+    parser.add_argument("--repair", action="store_true",
+                        help="quarantine damaged packages and fetch them again from the configured mirrors")
+    parser.add_argument("--workers", type=int, default=None, help="number of parallel checks")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    results = audit_cache(workers=args.workers, callback=lambda r: print(
+        f"{r['record']:>12}  {r['status']:<8}  {r['problem'] or ('checksum' if r['checksum'] else 'zip CRC')}"))
+    damaged = [r for r in results if r["status"] == DAMAGED]
+    print(f"{len(results)} package(s) checked, {len(damaged)} damaged")
+    if args.repair and damaged:
+        def refetch(record):
+            if not fetch_from_mirrors(record, os.path.join(cache_folder(), f"{record}.zip")):
+                print(f"{record} is not on a mirror, open it in the Activity Browser to download it again")
+        repair_cache(results, refetch)
+    return 1 if damaged and not args.repair else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+"""
+Cache locking for the ScenarioLink plugin.
+This module coordinates access to the datapackage cache between Activity Browser instances and scripts
+that share it, with one lock file per record.
+
+Writers (downloading a record) take an exclusive lock, readers (opening a cached record) a shared one.
+A request that waits for another process downloading the same record finds it cached once it gets the lock,
+so concurrent requests share one download. Within a process, locks are re-entrant: a process that
+holds the exclusive lock of a record can also open it.
+"""
+
+from contextlib import contextmanager
+import os
+import threading
+import time
+from typing import Callable, Optional
+from logging import getLogger
+
+import appdirs
+
+log = getLogger(__name__)
+
+# seconds between attempts while another process holds a lock
+POLL_INTERVAL = 0.5
+# seconds between attempts when a `poll` callable keeps e.g. the GUI responsive meanwhile
+POLL_CALLBACK_INTERVAL = 0.05
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, which only has exclusive locks
+    fcntl = None
+    import msvcrt
+
+
+def lock_folder() -> str:
+    folder = os.path.join(appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser"), "locks")
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+
+def _try_lock(fd: int, shared: bool) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class _HeldLock:
+    """The lock file of one record in this process, shared by the threads of the process."""
+
+    def __init__(self):
+        self.thread_lock = threading.RLock()
+        self.fd = None
+        self.shared = None
+        self.depth = 0
+
+
+_held = {}
+_held_guard = threading.Lock()
+
+
+@contextmanager
+def cache_lock(record: str, shared: bool = False, timeout: float = None, blocking: bool = True,
+               poll: Optional[Callable[[], None]] = None):
+    """
+    Hold the lock of `record` in the cache for the duration of the `with` block.
+
+    Parameters:
+        record (str): The record ID, or the file name of the datapackage without '.zip'.
+        shared (bool): Take a shared (read) lock instead of an exclusive (write) lock.
+        timeout (float, optional): Seconds to wait for the lock, default forever.
+        blocking (bool): Wait for the lock, with False a `TimeoutError` is raised at once if it is taken.
+        poll (callable, optional): Called between attempts while another process holds the lock,
+            e.g. to process GUI events. An exception it raises stops waiting and is passed on.
+    """
+    with _held_guard:
+        held = _held.setdefault(record, _HeldLock())
+
+    # threads of this process take turns, the lock file coordinates between processes
+    if not held.thread_lock.acquire(blocking, -1 if timeout is None or not blocking else timeout):
+        raise TimeoutError(f"Timed out waiting for the cache lock of {record}")
+    try:
+        if held.depth == 0:
+            fd = os.open(os.path.join(lock_folder(), f"{record}.lock"), os.O_RDWR | os.O_CREAT)
+            start, waiting = time.time(), False
+            while not _try_lock(fd, shared):
+                if not blocking or (timeout is not None and time.time() - start > timeout):
+                    os.close(fd)
+                    raise TimeoutError(f"Timed out waiting for the cache lock of {record}")
+                if not waiting:
+                    log.info(f"Waiting for another process using {record}")
+                    waiting = True
+                if poll is not None:
+                    try:
+                        poll()
+                    except BaseException:
+                        os.close(fd)
+                        raise
+                time.sleep(POLL_INTERVAL if poll is None else POLL_CALLBACK_INTERVAL)
+            held.fd, held.shared = fd, shared
+        elif held.shared and not shared:
+            # upgrading could deadlock with another process doing the same
+            raise RuntimeError(f"Can't take the exclusive cache lock of {record} while holding a shared one")
+
+        held.depth += 1
+        try:
+            yield
+        finally:
+            held.depth -= 1
+            if held.depth == 0:
+                _unlock(held.fd)
+                os.close(held.fd)
+                held.fd = None
+    finally:
+        held.thread_lock.release()
+
+
+def record_of(path: str) -> str:
+    """Return the lock name of the datapackage at `path`, also for its '.zip.partial' and '.zip.md5' files."""
+    name = os.path.basename(path)
+    if name.endswith(".partial"):
+        name = name[:-len(".partial")]
+    if ".zip." in name:
+        name = name[:name.index(".zip.") + len(".zip")]
+    return os.path.splitext(name)[0]
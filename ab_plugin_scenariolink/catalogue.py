@@ -0,0 +1,221 @@
+"""
+Scenario catalogue for the ScenarioLink plugin.
+This module keeps a typed copy of the catalogue of datapackages (`scenarios list/list.csv`) in the Activity
+Browser data folder, and updates it by fetching and parsing only the rows added since it was last fetched.
+
+The catalogue is append-only: new datapackages are added as new lines. An update sends the ETag of the known
+catalogue, so an unchanged catalogue costs a single `304 Not Modified`. Otherwise the server sends the bytes
+after the known length (an HTTP range request), starting a little earlier so the overlap confirms the end
+of the known rows, and only those bytes are parsed. The catalogue is fetched and parsed whole when it changed
+but did not grow, when the overlap differs, or when the server ignores the range. An edit before the overlap
+that comes together with new rows can't be seen in the range, so the whole catalogue is also fetched once
+every `FULL_CHECK_INTERVAL`.
+
+Set the `SCENARIOLINK_CATALOGUE` environment variable to use another catalogue, e.g. the raw URL of a commit
+to pin the catalogue to that version.
+"""
+
+import ast
+import io
+import os
+import time
+from typing import Optional, Tuple
+from logging import getLogger
+
+import appdirs
+import pandas as pd
+import requests
+
+log = getLogger(__name__)
+
+CATALOGUE_ENV = "SCENARIOLINK_CATALOGUE"
+CATALOGUE_URL = "https://raw.githubusercontent.com/polca/ScenarioLink/main/ab_plugin_scenariolink/scenarios%20list/list.csv"
+# the catalogue shipped with the plugin, used when there is no network and nothing cached yet
+BUNDLED_CATALOGUE = os.path.join(os.path.dirname(__file__), "scenarios list", "list.csv")
+# bumped when the cached format changes, older caches are then fetched again
+CATALOGUE_FORMAT = 3
+# the number of known bytes fetched again to confirm the end of the known rows is unchanged
+OVERLAP = 512
+# seconds between fetches of the whole catalogue, which confirm that none of the known rows changed
+FULL_CHECK_INTERVAL = 7 * 24 * 3600
+
+CATEGORY_COLUMNS = ["generator", "scope", "model", "scenario", "source database"]
+VERSION_COLUMN = "generator version"
+DATE_COLUMN = "creation date"
+RECORD_COLUMN = "Zenodo record ID"
+
+
+def catalogue_url() -> str:
+    return os.environ.get(CATALOGUE_ENV) or CATALOGUE_URL
+
+
+def catalogue_path() -> str:
+    # not in the cache folder, clearing the datapackage cache would throw it away
+    return os.path.join(appdirs.user_data_dir("ActivityBrowser", "ActivityBrowser"), "scenariolink_catalogue.pickle.gz")
+
+
+def version_key(version: str) -> tuple:
+    """Return a sortable key for a generator version like '(2, 2, 3)' or '2.2.3', unparseable versions sort first."""
+    try:
+        parsed = ast.literal_eval(version)
+        parsed = parsed if isinstance(parsed, tuple) else (parsed,)
+    except (ValueError, SyntaxError):
+        parsed = tuple(version.replace("-", ".").split("."))
+    try:
+        return (1,) + tuple(int(part) for part in parsed)
+    except (TypeError, ValueError):
+        return (0, str(version))
+
+
+def parse_catalogue(content: bytes, columns: Optional[list] = None) -> pd.DataFrame:
+    """
+    Parse catalogue CSV `content` into a typed dataframe.
+
+    Parameters:
+        content (bytes): Semicolon separated rows, with a header unless `columns` is given.
+        columns (list, optional): The column names, for rows without a header.
+
+    Returns:
+        pd.DataFrame: A row per datapackage, with categorical 'generator', 'scope', 'model', 'scenario' and
+            'source database' columns, 'generator version' as a categorical ordered by version and
+            'creation date' as datetime. Other columns, like the record ID, stay strings.
+    """
+    dataframe = pd.read_csv(io.BytesIO(content), sep=";", dtype=str, header=None if columns else 0,
+                            names=columns, skip_blank_lines=True)
+    for column in CATEGORY_COLUMNS:
+        if column in dataframe:
+            dataframe[column] = dataframe[column].astype("category")
+    if VERSION_COLUMN in dataframe:
+        versions = dataframe[VERSION_COLUMN].dropna().unique().tolist()
+        dataframe[VERSION_COLUMN] = pd.Categorical(
+            dataframe[VERSION_COLUMN], categories=sorted(versions, key=version_key), ordered=True)
+    if DATE_COLUMN in dataframe:
+        dataframe[DATE_COLUMN] = pd.to_datetime(dataframe[DATE_COLUMN], errors="coerce")
+    return dataframe
+
+
+def append_rows(catalogue: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    """Append parsed `rows` to `catalogue`, merging the categories of their categorical columns."""
+    combined = pd.concat([catalogue, rows], ignore_index=True)
+    # concat falls back to object columns when the categories differ
+    for column in CATEGORY_COLUMNS:
+        if column in combined:
+            combined[column] = combined[column].astype("category")
+    if VERSION_COLUMN in combined:
+        versions = combined[VERSION_COLUMN].dropna().unique().tolist()
+        combined[VERSION_COLUMN] = pd.Categorical(
+            combined[VERSION_COLUMN].astype(object), categories=sorted(versions, key=version_key), ordered=True)
+    return combined
+
+
+def load_cached_catalogue() -> Optional[dict]:
+    """Return the cached catalogue as {"format", "url", "etag", "length", "tail", "checked", "catalogue"}, None if there is none."""
+    try:
+        cached = pd.read_pickle(catalogue_path())
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        log.warning(f"Could not read the cached catalogue {catalogue_path()}: {e}")
+        return
+    if not isinstance(cached, dict) or cached.get("format") != CATALOGUE_FORMAT or cached.get("url") != catalogue_url():
+        return
+    return cached
+
+
+def _store(length: int, tail: bytes, etag: Optional[str], checked: float, catalogue: pd.DataFrame) -> dict:
+    cached = {"format": CATALOGUE_FORMAT, "url": catalogue_url(), "etag": etag, "length": length, "tail": tail,
+              "checked": checked, "catalogue": catalogue}
+    os.makedirs(os.path.dirname(catalogue_path()), exist_ok=True)
+    pd.to_pickle(cached, catalogue_path() + ".tmp", compression="gzip")
+    os.replace(catalogue_path() + ".tmp", catalogue_path())
+    return cached
+
+
+def _get(session, headers: Optional[dict] = None) -> requests.Response:
+    """Request the catalogue past any cache between us and the server, like the former `?nocache` did."""
+    url = catalogue_url()
+    headers = {"Cache-Control": "no-cache", "Pragma": "no-cache", **(headers or {})}
+    return session.get(url + ("&" if "?" in url else "?") + "nocache", headers=headers, timeout=30)
+
+
+def _store_whole(response: requests.Response) -> dict:
+    response.raise_for_status()
+    content = response.content
+    catalogue = parse_catalogue(content)
+    log.info(f"Fetched the catalogue, {len(catalogue)} datapackage(s)")
+    return _store(len(content), content[-OVERLAP:], response.headers.get("ETag"), time.time(), catalogue)
+
+
+def _fetch_whole(session, cached: Optional[dict] = None) -> dict:
+    """Fetch and parse the whole catalogue, unless it is the same as `cached`."""
+    response = _get(session, {"If-None-Match": cached["etag"]} if cached and cached["etag"] else None)
+    if response.status_code == 304:
+        return _store(cached["length"], cached["tail"], cached["etag"], time.time(), cached["catalogue"])
+    return _store_whole(response)
+
+
+def _range_start(response: requests.Response) -> Optional[int]:
+    """Return the first byte of a `206 Partial Content` response (`Content-Range: bytes <start>-<end>/<size>`)."""
+    try:
+        return int(response.headers["Content-Range"].split()[1].split("-")[0])
+    except (KeyError, IndexError, ValueError):
+        return
+
+
+def _fetch_update(cached: dict, session) -> dict:
+    if time.time() - cached["checked"] > FULL_CHECK_INTERVAL:
+        return _fetch_whole(session, cached)
+
+    start = cached["length"] - len(cached["tail"])
+    headers = {"Range": f"bytes={start}-", "Accept-Encoding": "identity"}
+    if cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    response = _get(session, headers)
+
+    if response.status_code == 304:
+        return cached
+    if response.status_code == 200:
+        # the server ignored the range and sent the whole catalogue
+        return _store_whole(response)
+    if response.status_code != 206 or _range_start(response) != start \
+            or not response.content.startswith(cached["tail"]):
+        # the catalogue got shorter (416), or the end of the known rows changed
+        log.info("The catalogue was edited, fetching it whole")
+        return _fetch_whole(session)
+
+    added = response.content[len(cached["tail"]):]
+    if not added.strip() or not cached["tail"].endswith(b"\n"):
+        # it changed without growing, so a known row was edited, or the last known row was completed
+        log.info("The catalogue was edited, fetching it whole")
+        return _fetch_whole(session)
+    rows = parse_catalogue(added, columns=cached["catalogue"].columns.tolist())
+    catalogue = append_rows(cached["catalogue"], rows)
+    log.info(f"{len(rows)} new datapackage(s) in the catalogue")
+    return _store(cached["length"] + len(added), (cached["tail"] + added)[-OVERLAP:],
+                  response.headers.get("ETag"), cached["checked"], catalogue)
+
+
+def fetch_catalogue(session=None) -> Tuple[pd.DataFrame, int]:
+    """
+    Return the up-to-date catalogue and its content version.
+
+    The content version is the number of rows, as the catalogue is append-only, rows added after version `v`
+    are `catalogue.iloc[v:]`. Without a network connection, the cached or the bundled catalogue is returned.
+
+    Parameters:
+        session (requests.Session, optional): The session to fetch the catalogue with, default `requests`.
+
+    Returns:
+        tuple: (pd.DataFrame from `parse_catalogue`, int version)
+    """
+    session = session or requests
+    cached = load_cached_catalogue()
+    try:
+        cached = _fetch_update(cached, session) if cached else _fetch_whole(session)
+    except (requests.RequestException, OSError) as e:
+        log.error(f"Failed to update the catalogue: {e}")
+        if cached is None:
+            with open(BUNDLED_CATALOGUE, "rb") as f:
+                catalogue = parse_catalogue(f.read())
+            return catalogue, len(catalogue)
+    return cached["catalogue"], len(cached["catalogue"])
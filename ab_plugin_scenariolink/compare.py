@@ -0,0 +1,258 @@
+"""
+Scenario LCA comparison for the ScenarioLink plugin.
+This module calculates LCA scores of many scenarios and impact categories, building the LCA matrices once
+and reusing the factorization of the technosphere matrix between scenarios and methods.
+"""
+
+from typing import List, Optional
+from logging import getLogger
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, gmres, spsolve
+
+import bw2data as bd
+from bw2calc import LCA
+from bw2data.backends.peewee import ActivityDataset
+
+from .progress import progress
+from .scenario_store import load_delta_store
+
+log = getLogger(__name__)
+
+# relative tolerance of the iterative solver, scenarios that don't converge are solved directly
+SOLVER_TOLERANCE = 1e-10
+
+
+def method_label(method: tuple) -> str:
+    return " | ".join(method)
+
+
+def activity_label(key: tuple) -> str:
+    activity = bd.get_activity(key)
+    return f"{activity['name']} | {activity.get('reference product', '')} | {activity.get('location', '')}"
+
+
+def match_activity(key: tuple, database: str) -> Optional[tuple]:
+    """Return the key of the activity in `database` with the same name, product and location as `key`."""
+    if key[0] == database:
+        return key
+    activity = bd.get_activity(key)
+    match = (ActivityDataset.select(ActivityDataset.code)
+             .where((ActivityDataset.database == database)
+                    & (ActivityDataset.name == activity["name"])
+                    & (ActivityDataset.product == activity.get("reference product"))
+                    & (ActivityDataset.location == activity.get("location")))
+             .first())
+    if match is None:
+        return
+    return database, match.code
+
+
+def characterization_vectors(lca: LCA, methods: List[tuple]) -> sparse.csr_matrix:
+    """Return the (methods x biosphere flows) matrix of characterization factors."""
+    vectors = []
+    for method in methods:
+        lca.switch_method(method)
+        vectors.append(sparse.csr_matrix(lca.characterization_matrix.diagonal()))
+    return sparse.vstack(vectors).tocsr()
+
+
+def warm_solve(matrix: sparse.spmatrix, demand: np.ndarray, preconditioner: LinearOperator,
+               x0: np.ndarray) -> np.ndarray:
+    """Solve `matrix` x = `demand` with GMRES, starting from `x0` and preconditioned with the base matrix.
+
+    Scenario matrices differ from the base matrix in few entries, so this converges in a few iterations.
+    Falls back to a direct solve if it doesn't converge.
+    """
+    try:
+        x, info = gmres(matrix, demand, x0=x0, M=preconditioner, rtol=SOLVER_TOLERANCE, atol=0)
+    except TypeError:
+        # scipy < 1.12 names `rtol` `tol`
+        x, info = gmres(matrix, demand, x0=x0, M=preconditioner, tol=SOLVER_TOLERANCE, atol=0)
+    if info != 0:
+        log.debug("Iterative solver did not converge, solving directly")
+        x = spsolve(matrix.tocsc(), demand)
+    return x
+
+
+def results_dataframe(rows: list, results: list, methods: List[tuple]) -> pd.DataFrame:
+    """Return the scores as a dataframe with a (functional unit, scenario) index and a column per method."""
+    columns = [method_label(m) for m in methods]
+    if not rows:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame(
+        results,
+        index=pd.MultiIndex.from_tuples(rows, names=["functional unit", "scenario"]),
+        columns=columns,
+    ).sort_index(level=0, sort_remaining=False)
+
+
+def replace_entries(matrix: sparse.spmatrix, rows: list, cols: list, values: list) -> sparse.csr_matrix:
+    """Return a copy of `matrix` with the entries at (`rows`, `cols`) set to `values`, the last value wins.
+
+    Returns `matrix` itself if no entry changes.
+    """
+    if not rows:
+        return matrix
+    rows, cols, values = np.array(rows), np.array(cols), np.array(values, dtype=np.float64)
+    cells = rows.astype(np.int64) * matrix.shape[1] + cols
+    _, last = np.unique(cells[::-1], return_index=True)
+    keep = len(cells) - 1 - last
+    rows, cols, values = rows[keep], cols[keep], values[keep]
+    current = np.asarray(matrix[rows, cols]).ravel()
+    changed = values != current
+    if not changed.any():
+        return matrix
+    delta = sparse.csr_matrix((values[changed] - current[changed], (rows[changed], cols[changed])), shape=matrix.shape)
+    return (matrix + delta).tocsr()
+
+
+def flow_positions(lca: LCA, store) -> tuple:
+    """Return where the flows of `store` are in the matrices of `lca`.
+
+    Returns (flow indices, rows, columns, signs) for the technosphere and for the biosphere matrix,
+    flows of activities that are not in the matrices are left out.
+    """
+    technosphere, biosphere = ([], [], [], []), ([], [], [], [])
+    for i, (from_key, to_key, flow_type) in enumerate(
+            store.flows[["from key", "to key", "flow type"]].itertuples(index=False, name=None)):
+        if to_key not in lca.activity_dict:
+            continue
+        column = lca.activity_dict[to_key]
+        if flow_type == "biosphere":
+            if from_key in lca.biosphere_dict:
+                for positions, value in zip(biosphere, (i, lca.biosphere_dict[from_key], column, 1.0)):
+                    positions.append(value)
+        elif from_key in lca.product_dict:
+            # technosphere inputs are negative in the technosphere matrix
+            sign = 1.0 if flow_type in ("production", "substitution") else -1.0
+            for positions, value in zip(technosphere, (i, lca.product_dict[from_key], column, sign)):
+                positions.append(value)
+    return (tuple(np.array(p) for p in technosphere), tuple(np.array(p) for p in biosphere))
+
+
+def scenario_matrices(lca: LCA, store, scenario: str, positions: Optional[tuple] = None) -> tuple:
+    """Return the technosphere and biosphere matrices of `lca` with the values of `scenario` from `store`.
+
+    All flows of the scenario are written, not only those that differ from the first scenario: the
+    superstructure database holds the amounts of the source database, not those of any scenario.
+    """
+    positions = positions or flow_positions(lca, store)
+    values = store.scenario_values(scenario)
+    matrices = []
+    for matrix, (flows, rows, columns, signs) in zip((lca.technosphere_matrix, lca.biosphere_matrix), positions):
+        if len(flows) == 0:
+            matrices.append(matrix)
+            continue
+        flow_values = values[flows]
+        known = ~np.isnan(flow_values)
+        matrices.append(replace_entries(matrix, rows[known].tolist(), columns[known].tolist(),
+                                        (flow_values[known] * signs[known]).tolist()))
+    return tuple(matrices)
+
+
+def compare_superstructure(database: str, functional_units: List[dict], methods: List[tuple],
+                           scenarios: Optional[list] = None) -> pd.DataFrame:
+    """
+    Compare the scenarios of a superstructure database with a compact scenario store.
+
+    The matrices of the superstructure are built and factorized once. Every scenario replaces the changed
+    entries and is solved with the base factorization as preconditioner and the base solution as start.
+    The inventory of every scenario is characterized for all methods at once.
+
+    Parameters:
+        database (str): The superstructure database, it must have a scenario store (see `scenario_store`).
+        functional_units (list): {activity key: amount} dicts, activities are matched to `database`
+            by name, reference product and location.
+        methods (list): The impact assessment methods.
+        scenarios (list, optional): Scenario names to compare, default all.
+
+    Returns:
+        pd.DataFrame: Scores with a (functional unit, scenario) index and a column per method.
+    """
+    store = load_delta_store(database)
+    if store is None:
+        raise ValueError(f"Database {database} has no scenario store.")
+    scenarios = scenarios or store.scenarios
+
+    demands = []
+    for fu in functional_units:
+        demand = {match_activity(key, database): amount for key, amount in fu.items()}
+        if None in demand:
+            log.warning(f"Skipping functional unit {fu}, it is not in {database}")
+            continue
+        demands.append(demand)
+    if not demands:
+        return results_dataframe([], [], methods)
+
+    # all functional units are in the same database, so one set of matrices serves all of them
+    lca = LCA(demands[0], methods[0])
+    lca.lci(factorize=True)
+    characterization = characterization_vectors(lca, methods)
+    size = lca.technosphere_matrix.shape[0]
+    preconditioner = LinearOperator((size, size), matvec=lca.solver)
+    base = []
+    for demand in demands:
+        lca.build_demand_array(demand)
+        base.append((" + ".join(activity_label(key) for key in demand), lca.demand_array, lca.solver(lca.demand_array)))
+
+    positions = flow_positions(lca, store)
+    rows, results = [], []
+    progress.start(f"Comparing {len(scenarios)} scenarios", len(scenarios), "scenarios")
+    for scenario in scenarios:
+        technosphere, biosphere = scenario_matrices(lca, store, scenario, positions)
+        for label, demand_array, base_supply in base:
+            if technosphere is lca.technosphere_matrix:
+                supply = base_supply
+            else:
+                supply = warm_solve(technosphere, demand_array, preconditioner, base_supply)
+            rows.append((label, scenario))
+            results.append(characterization @ (biosphere @ supply))
+        progress.advance()
+    return results_dataframe(rows, results, methods)
+
+
+def compare_databases(databases: List[str], functional_units: List[dict], methods: List[tuple]) -> pd.DataFrame:
+    """
+    Compare scenario databases, e.g. those written by `unfold_databases`.
+
+    Every database is factorized once and its inventory characterized for all methods at once.
+
+    Parameters:
+        databases (list): The scenario databases.
+        functional_units (list): {activity key: amount} dicts, activities are matched to each database
+            by name, reference product and location.
+        methods (list): The impact assessment methods.
+
+    Returns:
+        pd.DataFrame: Scores with a (functional unit, scenario) index and a column per method.
+    """
+    rows, results = [], []
+    characterization, biosphere_dict = None, None
+    progress.start(f"Comparing {len(databases)} databases", len(databases), "databases")
+    for database in databases:
+        demands = []
+        for fu in functional_units:
+            demand = {match_activity(key, database): amount for key, amount in fu.items()}
+            if None in demand:
+                log.warning(f"Skipping functional unit {fu} for {database}, it is not in the database")
+                continue
+            demands.append((" + ".join(activity_label(key) for key in fu), demand))
+        if not demands:
+            continue
+
+        # one factorization per database serves all functional units
+        lca = LCA(demands[0][1], methods[0])
+        lca.lci(factorize=True)
+        if lca.biosphere_dict != biosphere_dict:
+            # biosphere flows are the same for all scenario databases, so this is normally built once
+            characterization = characterization_vectors(lca, methods)
+            biosphere_dict = lca.biosphere_dict
+        for label, demand in demands:
+            lca.build_demand_array(demand)
+            rows.append((label, database))
+            results.append(characterization @ (lca.biosphere_matrix @ lca.solver(lca.demand_array)))
+        progress.advance()
+    return results_dataframe(rows, results, methods)
@@ -0,0 +1,97 @@
+"""
+Datapackage descriptor parsing for the ScenarioLink plugin.
+This module turns the scenario list of a datapackage descriptor into a typed dataframe, with the model,
+pathway and year of each scenario in their own columns.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Optional
+from logging import getLogger
+
+import pandas as pd
+
+log = getLogger(__name__)
+
+# columns that are always present, other keys of the scenario descriptors are added after these
+SCENARIO_COLUMNS = ["name", "description", "model", "pathway", "year"]
+# scenario names are formatted as '<model> - <pathway> - <year>', e.g. 'remind - SSP2-Base - 2050'
+NAME_PATTERN = r"^(?P<base>.*?)\s+-\s+(?P<year>\d{4})$"
+# the number of parsed descriptors kept in memory
+CACHE_SIZE = 16
+
+_cache = OrderedDict()
+
+
+def descriptor_checksum(scenarios: list) -> str:
+    """Return a checksum of the scenario list of a descriptor."""
+    return hashlib.md5(json.dumps(scenarios, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _parse(scenarios: list) -> pd.DataFrame:
+    # `from_records` aligns the scenarios on their keys, missing keys become missing values
+    dataframe = pd.DataFrame.from_records(scenarios)
+    for column in ("name", "description"):
+        if column not in dataframe:
+            dataframe[column] = None
+    names = dataframe["name"].astype("string")
+
+    parts = names.str.extract(NAME_PATTERN)
+    # names without a year are kept whole as the base
+    base = parts["base"].fillna(names)
+    model_pathway = base.str.split(" - ", n=1, expand=True).reindex(columns=[0, 1]).astype("string")
+    dataframe["name"] = names
+    dataframe["description"] = dataframe["description"].astype("string")
+    dataframe["model"] = model_pathway[0].str.strip().astype("category")
+    dataframe["pathway"] = model_pathway[1].str.strip().astype("category")
+    dataframe["year"] = pd.to_numeric(parts["year"]).astype("Int64")
+    dataframe["base"] = base.astype("category")
+
+    other = [c for c in dataframe.columns if c not in SCENARIO_COLUMNS and c != "base"]
+    return dataframe[SCENARIO_COLUMNS + ["base"] + other]
+
+
+def parse_scenarios(scenarios: list) -> pd.DataFrame:
+    """
+    Parse the `scenarios` list of a datapackage descriptor into a dataframe.
+
+    Rows are in the order of the descriptor, so the row position is the scenario index used by unfold.
+    The 'model', 'pathway' and 'year' columns are derived from the scenario names, 'base' is the name
+    without the year. Results are cached per checksum of the scenario list.
+
+    Parameters:
+        scenarios (list): The `scenarios` of a datapackage descriptor.
+
+    Returns:
+        pd.DataFrame: A row per scenario, with categorical 'model', 'pathway' and 'base' columns and
+            a nullable integer 'year' column.
+    """
+    checksum = descriptor_checksum(scenarios)
+    if checksum in _cache:
+        _cache.move_to_end(checksum)
+        return _cache[checksum].copy()
+
+    dataframe = _parse(scenarios)
+    _cache[checksum] = dataframe
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return dataframe.copy()
+
+
+def scenarios_name(dataframe: pd.DataFrame, selected: Optional[list] = None) -> Optional[str]:
+    """Return a name describing the `selected` rows of a `parse_scenarios` dataframe.
+
+    This is the shared '<model> - <pathway>' of the scenarios if there is one, otherwise the models
+    and pathways joined, None if no scenario is selected.
+    """
+    rows = dataframe if selected is None else dataframe.iloc[selected]
+    bases = rows["base"].dropna().unique()
+    if len(bases) == 0:
+        return
+    if len(bases) == 1:
+        return str(bases[0])
+    return " - ".join([
+        ", ".join(str(m) for m in rows["model"].dropna().unique()),
+        ", ".join(str(p) for p in rows["pathway"].dropna().unique()),
+    ]).strip(" -")
@@ -0,0 +1,245 @@
+"""
+Multi-project installation for the ScenarioLink plugin.
+This module installs the scenarios of one datapackage into several brightway projects,
+computing the scenario databases once for every set of projects that share the same source databases.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, wait
+import copy
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+from typing import Dict, List, Optional
+from logging import getLogger
+
+import bw2data
+
+from .bulk_write import BulkWriteUnfold
+from .cache_lock import cache_lock, record_of
+from .progress import progress, Cancelled, UPDATE_INTERVAL
+from .journal import ImportJournal, database_step, rollback_databases
+from .utils import package_filepath, wait_for_record
+
+log = getLogger(__name__)
+
+
+class CapturingUnfold(BulkWriteUnfold):
+    """`Unfold` that computes the scenario databases but leaves writing them to `write_to`."""
+
+    def write(self, superstructure: bool = False, export_dir: str = None):
+        self._write_args = {"superstructure": superstructure, "export_dir": export_dir}
+
+    def write_to(self, project: str, bulk_write: bool = True, last: bool = True) -> None:
+        """Write the computed databases into `project`.
+
+        Writing renames and relinks the databases in place, so unless this is the `last` project
+        they are written from a copy and the next project gets them as computed.
+        """
+        bw2data.projects.set_current(project)
+        self.bulk_write = bulk_write
+        attr = "database" if self._write_args["superstructure"] else "databases_to_export"
+        computed = getattr(self, attr)
+        if not last:
+            setattr(self, attr, copy.deepcopy(computed))
+        try:
+            BulkWriteUnfold.write(self, **self._write_args)
+        finally:
+            setattr(self, attr, computed)
+
+
+def dependencies_fingerprint(dependencies: dict) -> tuple:
+    """Return a fingerprint of the dependency databases in the current project.
+
+    Projects with the same fingerprint have the same source databases, so unfold produces the same
+    scenario databases for them.
+    """
+    from bw2data.backends.peewee import ActivityDataset
+
+    fingerprint = []
+    for name, source in sorted(dependencies.items()):
+        codes = sorted(code for (code,) in ActivityDataset.select(ActivityDataset.code)
+                       .where(ActivityDataset.database == source).tuples())
+        fingerprint.append((name, source, hashlib.md5("\n".join(codes).encode("utf-8")).hexdigest()))
+    return tuple(fingerprint)
+
+
+def project_databases(project: str) -> List[str]:
+    """Return the names of the databases in `project`."""
+    current = bw2data.projects.current
+    try:
+        bw2data.projects.set_current(project)
+        return sorted(bw2data.databases)
+    finally:
+        bw2data.projects.set_current(current)
+
+
+def group_projects(project_dependencies: Dict[str, dict]) -> List[List[tuple]]:
+    """Group (project, dependencies) pairs by the fingerprint of their dependency databases."""
+    current = bw2data.projects.current
+    groups = {}
+    try:
+        for project, dependencies in project_dependencies.items():
+            bw2data.projects.set_current(project)
+            missing = [db for db in dependencies.values() if db not in bw2data.databases]
+            if missing:
+                log.error(f"Skipping project {project}, it misses the databases {missing}")
+                continue
+            groups.setdefault(dependencies_fingerprint(dependencies), []).append((project, dependencies))
+    finally:
+        bw2data.projects.set_current(current)
+    return list(groups.values())
+
+
+def unfold_group(filepath: str, projects: List[tuple], scenarios: list, superstructure: bool,
+                 superstructure_db_name: Optional[str], superstructure_sdf_location: Optional[str],
+                 bulk_write: bool = True) -> List[str]:
+    """Compute the scenario databases once and write them into every project of `projects`.
+
+    All projects must have the same dependency databases, see `group_projects`.
+    Returns the projects the databases were written to.
+    """
+    first_project, dependencies = projects[0]
+    bw2data.projects.set_current(first_project)
+    with cache_lock(record_of(filepath), shared=True, poll=wait_for_record(record_of(filepath))):
+        unfold = CapturingUnfold(filepath)
+    unfold.unfold(
+        dependencies=dependencies,
+        scenarios=scenarios,
+        superstructure=superstructure,
+        name=superstructure_db_name,
+        export_dir=superstructure_sdf_location,
+    )
+    if superstructure:
+        planned = [superstructure_db_name or unfold.package.descriptor["name"]]
+    else:
+        planned = [s["name"] for s in unfold.scenarios]
+
+    # one journal per group, groups may run in parallel processes
+    job_id = "-".join([os.path.splitext(os.path.basename(filepath))[0],
+                       hashlib.md5(first_project.encode("utf-8")).hexdigest()[:8]])
+    journal = ImportJournal(job_id)
+    unfold.journal = journal
+    written = []
+    for i, (project, _) in enumerate(projects):
+        try:
+            bw2data.projects.set_current(project)
+            rollback_databases(journal)
+            log.info(f"Writing {len(planned)} database(s) into project {project}")
+            unfold.write_to(project, bulk_write=bulk_write, last=i == len(projects) - 1)
+            for name in planned:
+                journal.done(database_step(name))
+            written.append(project)
+        except Cancelled:
+            rollback_databases(journal)
+            raise
+        except Exception as e:
+            log.error(f"Failed to write databases into project {project}: {e}")
+            rollback_databases(journal)
+    if len(written) == len(projects):
+        journal.remove()
+    return written
+
+
+def _init_worker(states, cancel) -> None:
+    """Forward the progress of a worker process to the `states` queue, and cancel it when `cancel` is set."""
+    progress.forward = states.put
+
+    def watch_cancel():
+        cancel.wait()
+        progress.cancelled = True
+
+    threading.Thread(target=watch_cancel, daemon=True).start()
+
+
+def _follow_workers(states) -> None:
+    """Show the latest progress state the worker processes forwarded."""
+    state = None
+    while True:
+        try:
+            state = states.get_nowait()
+        except queue.Empty:
+            break
+    if state is not None:
+        progress.follow(state)
+
+
+def unfold_into_projects(
+        file: str,
+        scenarios: list,
+        project_dependencies: Dict[str, dict],
+        superstructure: bool,
+        superstructure_db_name: Optional[str],
+        superstructure_sdf_location: Optional[str],
+        processes: int = 1,
+        bulk_write: bool = True) -> List[str]:
+    """
+    Install the scenarios of one datapackage into several brightway projects.
+
+    Projects are grouped by their dependency databases: the package is parsed and the scenario databases are
+    computed once per group, and then written to each project of the group.
+    With `processes` > 1 groups are handled in parallel processes.
+
+    Parameters:
+        file (str): Either a path or a recordID
+        scenarios (list): The list of scenarios to unfold.
+        project_dependencies (dict): {project name: dependencies} with the dependencies dict per project
+            as used by `unfold_databases`.
+        superstructure (bool): Flag to indicate if a superstructure should be unfolded.
+        superstructure_db_name Optional[str]: name of the database.
+        superstructure_sdf_location Optional[str]: folder path to export the SDF file to.
+        processes (int): The maximum number of processes to use.
+        bulk_write (bool): Write the databases with batched inserts and rebuild indices once at the end.
+
+    Returns:
+        list: The projects the databases were written to.
+    """
+    filepath = package_filepath(file)
+    current = bw2data.projects.current
+    groups = group_projects(project_dependencies)
+    log.info(f"Installing into {sum(len(g) for g in groups)} project(s), computing {len(groups)} time(s)")
+
+    args = (scenarios, superstructure, superstructure_db_name, superstructure_sdf_location, bulk_write)
+    written = []
+    try:
+        if processes > 1 and len(groups) > 1:
+            # spawn, so the workers don't inherit the (Qt) state of the Activity Browser process
+            context = multiprocessing.get_context("spawn")
+            states, cancel = context.Queue(), context.Event()
+            with ProcessPoolExecutor(max_workers=min(processes, len(groups)), mp_context=context,
+                                     initializer=_init_worker, initargs=(states, cancel)) as pool:
+                pending = {pool.submit(unfold_group, filepath, group, *args) for group in groups}
+                try:
+                    # poll the workers, so the Activity Browser shows their progress and can cancel them
+                    while pending:
+                        finished, pending = wait(pending, timeout=UPDATE_INTERVAL)
+                        for future in finished:
+                            try:
+                                written.extend(future.result())
+                            except Cancelled:
+                                pass
+                            except Exception as e:
+                                log.error(f"Failed to unfold database: {e}")
+                        _follow_workers(states)
+                        progress.check()
+                except Cancelled:
+                    log.info("Installing into other projects cancelled, waiting for the workers to roll back")
+                    cancel.set()
+                    for future in pending:
+                        future.cancel()
+                    for future in wait(pending).done:
+                        if not future.cancelled() and future.exception() is None:
+                            written.extend(future.result())
+        else:
+            for group in groups:
+                try:
+                    written.extend(unfold_group(filepath, group, *args))
+                except Cancelled:
+                    log.info("Installing into other projects cancelled")
+                    break
+                except Exception as e:
+                    log.error(f"Failed to unfold database: {e}")
+    finally:
+        bw2data.projects.set_current(current)
+    return written
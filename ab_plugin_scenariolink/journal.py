@@ -0,0 +1,185 @@
+"""
+Import job journal for the ScenarioLink plugin.
+This module records the steps of an import on disk, so an interrupted import can resume where it stopped.
+"""
+
+from datetime import datetime
+import json
+import os
+import shutil
+from typing import Optional
+from logging import getLogger
+
+import appdirs
+
+from .cache_lock import cache_lock, record_of
+
+log = getLogger(__name__)
+
+
+def journal_folder() -> str:
+    """Return the folder the import journals are stored in."""
+    folder = os.path.join(appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser"), "journal")
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+
+def work_folder(job_id: str) -> str:
+    """Return the folder the temporary files of `job_id` are stored in, replacing throwaway temp dirs."""
+    folder = os.path.join(appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser"), "partial", job_id)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+
+class ImportJournal:
+    """
+    On-disk journal of the steps of one import job.
+
+    A job is identified by the Zenodo record ID or the datapackage file name. Steps are free-form strings
+    (e.g. 'downloaded:<file>', 'repacked', 'database:<project>:<name>') with a status of 'started' or 'done'.
+    Every change is written to disk immediately, so the journal survives a crash of the Activity Browser.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.path = os.path.join(journal_folder(), f"{job_id}.json")
+        self.steps = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.steps = json.load(f)["steps"]
+            except (ValueError, KeyError, OSError) as e:
+                log.warning(f"Ignoring unreadable import journal {self.path}: {e}")
+
+    def save(self) -> None:
+        """Write the journal to disk through a temporary file, so a crash never leaves half a journal."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"job": self.job_id, "steps": self.steps}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def start(self, step: str, **info) -> None:
+        self.steps[step] = {"status": "started", "time": datetime.now().isoformat(), **info}
+        self.save()
+
+    def done(self, step: str, **info) -> None:
+        entry = self.steps.get(step, {})
+        entry.update({"status": "done", "time": datetime.now().isoformat(), **info})
+        self.steps[step] = entry
+        self.save()
+
+    def is_done(self, step: str) -> bool:
+        return self.steps.get(step, {}).get("status") == "done"
+
+    def info(self, step: str) -> Optional[dict]:
+        return self.steps.get(step)
+
+    def unfinished(self, prefix: str = "") -> list:
+        """Return the started but not finished steps starting with `prefix`."""
+        return [step for step, entry in self.steps.items()
+                if step.startswith(prefix) and entry.get("status") != "done"]
+
+    def forget(self, prefix: str) -> None:
+        """Remove all steps starting with `prefix`."""
+        self.steps = {step: entry for step, entry in self.steps.items() if not step.startswith(prefix)}
+        self.save()
+
+    def remove(self) -> None:
+        """The job is finished, remove the journal and the temporary files of the job.
+
+        Unfinished database writes in other projects are kept, so they are still rolled back when the job
+        runs in those projects again.
+        """
+        databases = self.unfinished("database:")
+        current = database_step("") if databases else None
+        self.steps = {step: self.steps[step] for step in databases if not step.startswith(current)}
+        if self.steps:
+            self.save()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        shutil.rmtree(os.path.join(os.path.dirname(journal_folder()), "partial", self.job_id), ignore_errors=True)
+
+
+def database_step(database: str) -> str:
+    """Return the journal step name for writing `database` in the current brightway project."""
+    import bw2data as bd
+    return f"database:{bd.projects.current}:{database}"
+
+
+def rollback_databases(journal: ImportJournal) -> list:
+    """Remove databases in the current project of which the write was started but never finished.
+
+    A database counts as finished when the journal recorded that its rows were written. Finished databases
+    of which bulk write mode deferred the processing (`processed` False) are processed and indexed here.
+    A database that existed before the write started is only removed when it changed since, otherwise
+    the write never reached it and it still holds the data of the user.
+    Returns the names of the databases that were finished, they can be skipped by the import.
+    """
+    import bw2data as bd
+
+    for step in journal.unfinished(database_step("")):
+        name = step[len(database_step("")):]
+        info = journal.info(step)
+        if name in bd.databases and (info.get("existed") is None
+                                       or info["existed"] and bd.databases[name].get("modified") == info["modified"]):
+            # the write did not replace the database yet, or the journal does not know its state before
+            log.warning(f"Keeping database {name}, the interrupted import did not change it")
+            journal.forget(step)
+        elif name in bd.databases:
+            log.warning(f"Removing half-written database {name} of an interrupted import")
+            del bd.databases[name]
+            journal.forget(step)
+        else:
+            journal.forget(step)
+    finished = []
+    for step in list(journal.steps):
+        if step.startswith(database_step("")) and journal.is_done(step):
+            name = step[len(database_step("")):]
+            if name not in bd.databases:
+                continue
+            if journal.info(step).get("processed") is False:
+                _process_database(name)
+                journal.done(step, processed=True)
+            finished.append(name)
+    return finished
+
+
+def _process_database(name: str) -> None:
+    """Do the processing and indexing of database `name` that an interrupted bulk write deferred."""
+    import bw2data as bd
+    from .bulk_write import restore_indices
+    from .progress import progress
+
+    log.warning(f"Processing database {name}, an interrupted import wrote it without processing it")
+    restore_indices()
+    progress.start(f"Processing and indexing database {name}")
+    database = bd.Database(name)
+    database.process()
+    database.make_searchable(reset=True)
+
+
+def clean_orphaned_temp_data() -> None:
+    """Remove temporary import files that no journal refers to.
+
+    This covers files of jobs that finished and files left by earlier versions of the plugin.
+    """
+    cache_folder = appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser")
+    partial_folder = os.path.join(cache_folder, "partial")
+    if os.path.exists(partial_folder):
+        for job_id in os.listdir(partial_folder):
+            if not os.path.exists(os.path.join(journal_folder(), f"{job_id}.json")):
+                log.info(f"Removing orphaned temporary data of {job_id}")
+                shutil.rmtree(os.path.join(partial_folder, job_id), ignore_errors=True)
+    for filename in os.listdir(cache_folder):
+        record = record_of(filename)
+        if not filename.endswith(".partial") or os.path.exists(os.path.join(journal_folder(), f"{record}.json")):
+            continue
+        try:
+            # a download or mirror transfer of the record in another process is still writing it
+            with cache_lock(record, blocking=False):
+                log.info(f"Removing orphaned partial file {filename}")
+                os.remove(os.path.join(cache_folder, filename))
+        except TimeoutError:
+            pass
@@ -0,0 +1,978 @@
+import os
+from PySide2 import QtCore, QtWidgets
+from PySide2.QtCore import Qt
+import brightway2 as bw
+from typing import List, Optional, Tuple
+from unfold.unfold import clear_cache
+from logging import getLogger
+
+from activity_browser.ui.style import horizontal_line
+from activity_browser.ui.widgets.dialog import DatabaseLinkingDialog
+from activity_browser.signals import signals as ab_signals
+
+from ...tables.tables import FoldsTable, DataPackageTable, ScenarioDiffTable, ComparisonTable
+from ...signals import signals
+from ...utils import unfold_databases, clear_sl_datapackage_cache, download_files_from_zenodo, UpdateManager
+from ...preflight import estimate_unfold
+from ...fanout import unfold_into_projects, project_databases
+from ...scenario_diff import GROUPINGS, ADDED_VIEW
+from ...progress import progress, describe, Cancelled
+from ...selection import apply_rules, load_presets, save_preset
+from ...scenario_store import delta_store_path, load_delta_store
+from ...snapshot import export_snapshot, import_snapshot, DependencyMismatch, SNAPSHOT_EXTENSION
+from ...cache_audit import audit_cache, repair_cache, DAMAGED
+from ...bulk_write import restore_indices
+
+log = getLogger(__name__)
+
+class ScenarioLinkPanel(QtWidgets.QWidget):
+    """The content of the ScenarioLink tab, built by `RightTab` when the tab is first shown."""
+
+    def __init__(self, parent=None):
+        super(ScenarioLinkPanel, self).__init__(parent)
+
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.setContentsMargins(0, 0, 0, 0)
+
+        self.fold_chooser = FoldChooserWidget()
+        self.scenario_chooser = ScenarioChooserWidget()
+
+        self.progress_dialog = ProgressDialog(self)
+        self.version_label = QtWidgets.QLabel("")
+        self.compare_b = QtWidgets.QPushButton("Compare scenarios")
+        self.compare_b.setToolTip("Calculate a calculation setup for several scenario databases,\n"
+                                  "or for all scenarios of a superstructure with a compact scenario store")
+        self.export_snapshot_b = QtWidgets.QPushButton("Export snapshot...")
+        self.export_snapshot_b.setToolTip("Export databases into a snapshot file that can be imported\n"
+                                          "in another project without unfolding again")
+        self.import_snapshot_b = QtWidgets.QPushButton("Import snapshot...")
+        self.import_snapshot_b.setToolTip("Import the databases of a snapshot file into this project")
+        self.export_sdf_b = QtWidgets.QPushButton("Export scenario file...")
+        self.export_sdf_b.setToolTip("Export the scenario store of a superstructure database as a scenario\n"
+                                     "difference file, to load it in the calculation setup")
+
+        self.construct_layout()
+        # the version check needs the network, let the panel render first
+        QtCore.QTimer.singleShot(0, self.version_check)
+        self._connect_signals()
+        # a write interrupted by a crash may have left the project without its indices
+        restore_indices()
+
+    def _connect_signals(self):
+        signals.generate_db.connect(self.generate_database)
+        ab_signals.project_selected.connect(restore_indices)
+        signals.record_ready.connect(self.record_selected)
+        self.compare_b.clicked.connect(self.open_comparison)
+        signals.progress_updated.connect(self.job_running)
+        signals.progress_finished.connect(self.job_finished)
+        self.export_snapshot_b.clicked.connect(self.export_snapshot)
+        self.import_snapshot_b.clicked.connect(self.import_snapshot)
+        self.export_sdf_b.clicked.connect(self.export_scenario_file)
+
+    def construct_layout(self) -> None:
+        """Construct the panel layout"""
+        self.layout.setAlignment(QtCore.Qt.AlignTop)
+
+        # Folds chooser
+        self.layout.addWidget(self.fold_chooser)
+
+        # Scenario Chooser
+        self.layout.addWidget(self.scenario_chooser)
+        self.scenario_chooser.setVisible(False)
+
+        self.tools_layout = QtWidgets.QHBoxLayout()
+        self.tools_layout.setContentsMargins(0, 0, 0, 0)
+        self.tools_layout.addWidget(self.compare_b)
+        self.tools_layout.addWidget(self.export_snapshot_b)
+        self.tools_layout.addWidget(self.import_snapshot_b)
+        self.tools_layout.addWidget(self.export_sdf_b)
+        self.tools_layout.addStretch()
+        self.tools_widget = QtWidgets.QWidget()
+        self.tools_widget.setLayout(self.tools_layout)
+        self.layout.addWidget(self.tools_widget)
+
+        self.layout.addStretch()
+        self.layout.addWidget(self.version_label)
+        self.setLayout(self.layout)
+
+    def record_selected(self, state):
+        """A record was selected by user, show the scenario chooser."""
+        self.scenario_chooser.setVisible(state)
+
+    def generate_database(self, include_scenarios, dependencies, as_superstructure,
+                          superstructure_db_name, superstructure_sdf_location, compact_scenarios,
+                          extra_projects, processes, keep_snapshot):
+        """Start the database generation with the selected scenarios & SDF info."""
+
+        # get the file from the fold chooser
+        if self.fold_chooser.use_table:
+            file = self.fold_chooser.folds_table.model.selected_record
+        else:
+            file = self.fold_chooser.custom_package_path
+
+        # generate
+        QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            with progress.job():
+                if extra_projects:
+                    # install into the current and the other projects, sharing the computation where possible
+                    if compact_scenarios:
+                        log.warning("The compact scenario store is not available when installing into several "
+                                    "projects, an SDF file is exported instead.")
+                    project_dependencies = {bw.projects.current: dependencies}
+                    project_dependencies.update(extra_projects)
+                    unfold_into_projects(file, include_scenarios, project_dependencies, as_superstructure,
+                                         superstructure_db_name, superstructure_sdf_location, processes=processes)
+                else:
+                    unfold_databases(file, include_scenarios, dependencies, as_superstructure,
+                                     superstructure_db_name, superstructure_sdf_location,
+                                     compact_scenarios=compact_scenarios, keep_snapshot=keep_snapshot)
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+    def job_running(self, state: dict) -> None:
+        """Show the progress of the running job, and block starting other jobs meanwhile."""
+        for widget in (self.fold_chooser, self.scenario_chooser, self.tools_widget):
+            widget.setEnabled(False)
+        self.progress_dialog.update_progress(state)
+
+    def job_finished(self) -> None:
+        for widget in (self.fold_chooser, self.scenario_chooser, self.tools_widget):
+            widget.setEnabled(True)
+        self.progress_dialog.hide()
+
+    def open_comparison(self) -> None:
+        """Open the scenario comparison dialog."""
+        CompareDialog(self).exec_()
+
+    def export_snapshot(self) -> None:
+        """Export the databases chosen by the user into a snapshot file."""
+        dialog = DatabasesDialog(sorted(bw.databases), self)
+        if dialog.exec_() != DatabasesDialog.Accepted or not dialog.selected_databases():
+            return
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            caption="Export snapshot", filter=f"ScenarioLink snapshot (*{SNAPSHOT_EXTENSION})")
+        if not path:
+            return
+        if not path.endswith(SNAPSHOT_EXTENSION):
+            path += SNAPSHOT_EXTENSION
+        QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            with progress.job():
+                export_snapshot(dialog.selected_databases(), path)
+        except Cancelled:
+            log.info("Snapshot export cancelled")
+        except Exception as e:
+            log.error(f"Failed to export snapshot: {e}")
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+    def import_snapshot(self) -> None:
+        """Import the databases of a snapshot file chosen by the user into the current project."""
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            caption="Import snapshot", filter=f"ScenarioLink snapshot (*{SNAPSHOT_EXTENSION})")
+        if not path:
+            return
+        remap = None
+        while True:
+            QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                with progress.job():
+                    databases = import_snapshot(path, remap=remap)
+                log.info(f"Imported {len(databases)} database(s) from {path}")
+                return
+            except DependencyMismatch as e:
+                error = e
+            except Cancelled:
+                log.info("Snapshot import cancelled, the databases imported so far are kept")
+                return
+            except Exception as e:
+                log.error(f"Failed to import snapshot: {e}")
+                return
+            finally:
+                QtWidgets.QApplication.restoreOverrideCursor()
+            if not error.dependencies:
+                QtWidgets.QMessageBox.warning(self, "Import snapshot", str(error))
+                return
+            # let the user link the snapshot to the matching databases of this project
+            remap = self.scenario_chooser.relink_database(error.dependencies)
+            if not remap:
+                return
+
+    def export_scenario_file(self) -> None:
+        """Export the scenario store of a superstructure database chosen by the user as a scenario difference file."""
+        databases = [db for db in sorted(bw.databases) if os.path.exists(delta_store_path(db))]
+        if not databases:
+            QtWidgets.QMessageBox.information(
+                self, "Export scenario file",
+                "No database in this project has a scenario store.\n"
+                "Import a superstructure with 'Compact scenario store' to create one.")
+            return
+        database, ok = QtWidgets.QInputDialog.getItem(
+            self, "Export scenario file", "Superstructure database", databases, 0, False)
+        if not ok:
+            return
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            caption="Export scenario file", dir=f"{database}.csv", filter="Scenario difference file (*.csv)")
+        if not path:
+            return
+        if not path.endswith(".csv"):
+            path += ".csv"
+        QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            with progress.job():
+                progress.start(f"Exporting the scenarios of {database}")
+                load_delta_store(database).export_sdf(path)
+        except Exception as e:
+            log.error(f"Failed to export scenario file: {e}")
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+    def version_check(self) -> None:
+        newer, current, latest = UpdateManager.get_versions()
+        if newer:
+            label = (f"A newer version of ScenarioLink is available (your version: {current}, "
+                     f"the newest version: {latest})")
+            self.version_label.setText(label)
+
+
+class FoldChooserWidget(QtWidgets.QWidget):
+    def __init__(self):
+        super(FoldChooserWidget, self).__init__()
+
+        self.layout = QtWidgets.QVBoxLayout()
+        self.custom_package_path = None
+
+        # label
+        self.label = QtWidgets.QLabel("Select the datapackage you want to use")
+        self.layout.addWidget(self.label)
+
+        # Radio buttons to choose where to get Fold from
+        self.radio_default = QtWidgets.QRadioButton("Online datapackages")
+        self.radio_default.setChecked(True)
+        self.radio_custom = QtWidgets.QRadioButton("Local datapackages")
+        self.clear_datapackage_cache = QtWidgets.QPushButton("Clear datapackage cache")
+        self.clear_datapackage_cache.setToolTip(
+            "ScenarioLink caches the downloaded datapackages, though sometimes\n"
+            "these may be updated and you need to clear the cache."
+        )
+        self.audit_datapackage_cache = QtWidgets.QPushButton("Audit cache")
+        self.audit_datapackage_cache.setToolTip(
+            "Verify the cached datapackages, damaged ones are moved aside\n"
+            "and can be downloaded again."
+        )
+        self.audit_thread = None
+        self.radio_layout = QtWidgets.QHBoxLayout()
+        self.radio_layout.addWidget(self.radio_default)
+        self.radio_layout.addWidget(self.radio_custom)
+        self.radio_layout.addStretch()
+        self.radio_layout.addWidget(self.audit_datapackage_cache)
+        self.radio_layout.addWidget(self.clear_datapackage_cache)
+        self.radio_widget = QtWidgets.QWidget()
+        self.radio_widget.setLayout(self.radio_layout)
+        self.layout.addWidget(self.radio_widget)
+
+        # Folds table
+        self.table_label = QtWidgets.QLabel("Doubleclick to open a datapackage (if not present locally, it will be downloaded - this may take a while).")
+        self.layout.addWidget(self.table_label)
+
+        self.folds_table = FoldsTable(self)
+        self.use_table = True  # bool to see if we need to read this table or instead read the local import
+        if self.folds_table.model.df_columns.get("link", False):
+            self.folds_table.setToolTip("Doubleclick to open a datapackage\n"
+                                        "Right click to open a dashboard with more information")
+        else:
+            self.folds_table.setToolTip("Doubleclick to open a datapackage")
+        self.layout.addWidget(self.folds_table)
+
+        # Fold custom importer
+        self.custom_layout = QtWidgets.QHBoxLayout()
+        self.custom = QtWidgets.QPushButton("Browse computer")
+        self.custom.setVisible(False)
+        self.custom_layout.addWidget(self.custom)
+        self.custom_layout.addStretch()
+        self.custom_widg = QtWidgets.QWidget()
+        self.custom_widg.setLayout(self.custom_layout)
+        self.layout.addWidget(self.custom_widg)
+
+        self.layout.addWidget(horizontal_line())
+        self.setLayout(self.layout)
+
+        # signals
+        self.radio_custom.toggled.connect(self.radio_toggled)
+        self.custom.clicked.connect(self.get_datapackage_custom_path)
+        self.clear_datapackage_cache.clicked.connect(self.do_clear_cache)
+        self.audit_datapackage_cache.clicked.connect(self.audit_cache)
+
+    def radio_toggled(self, toggled: bool) -> None:
+        self.use_table = not toggled
+        self.folds_table.setVisible(not toggled)
+        self.clear_datapackage_cache.setVisible(not toggled)
+        self.audit_datapackage_cache.setVisible(not toggled)
+        self.table_label.setVisible(not toggled)
+
+        self.custom.setVisible(toggled)
+        signals.record_ready.emit(False)
+
+    def get_datapackage_custom_path(self) -> None:
+        """"Start a dialog to retrieve a datapackage from disk."""
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(
+            caption="Select datapackage zip file",
+            filter="*.zip"
+        )
+        log.info(f"file selected from path: {path}")
+        self.custom_package_path = path
+        signals.get_datapackage_from_disk.emit(path)
+
+    def do_clear_cache(self) -> None:
+        log.info("Clearing the datapackage cache")
+        clear_sl_datapackage_cache()
+        self.folds_table.model.sync()
+
+    def audit_cache(self) -> None:
+        """Verify the datapackage cache in the background, see `repair_cache` for what happens next."""
+        log.info("Auditing the datapackage cache")
+        self.audit_datapackage_cache.setEnabled(False)
+        self.audit_datapackage_cache.setText("Auditing cache...")
+        self.audit_thread = AuditThread(self)
+        self.audit_thread.audited.connect(self.repair_cache)
+        self.audit_thread.start()
+
+    def repair_cache(self, results: list) -> None:
+        """Quarantine the damaged datapackages of an audit and offer to download them again."""
+        self.audit_datapackage_cache.setEnabled(True)
+        self.audit_datapackage_cache.setText("Audit cache")
+        damaged = [r for r in results if r["status"] == DAMAGED]
+        if not damaged:
+            QtWidgets.QMessageBox.information(self, "Cache audit",
+                                              f"All {len(results)} cached datapackage(s) are intact.")
+            return
+        quarantined = repair_cache(damaged)
+        details = "\n".join(f"{r['record']}: {r['problem']}" for r in damaged)
+        if quarantined:
+            choice = QtWidgets.QMessageBox.warning(
+                self, "Cache audit",
+                f"{len(damaged)} of {len(results)} cached datapackage(s) are damaged:\n{details}\n\n"
+                f"Download the {len(quarantined)} damaged datapackage(s) again?",
+                QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No, QtWidgets.QMessageBox.Yes)
+            if choice == QtWidgets.QMessageBox.Yes:
+                for record in quarantined:
+                    download_files_from_zenodo(record)
+        else:
+            QtWidgets.QMessageBox.warning(
+                self, "Cache audit", f"{len(damaged)} cached datapackage(s) are damaged but in use:\n{details}")
+        self.folds_table.model.sync()
+
+
+class AuditThread(QtCore.QThread):
+    """Runs `audit_cache` outside the GUI thread."""
+    audited = QtCore.Signal(list)
+
+    def run(self) -> None:
+        try:
+            results = audit_cache()
+        except Exception as e:
+            log.error(f"Cache audit failed: {e}")
+            results = []
+        self.audited.emit(results)
+
+
+class ScenarioChooserWidget(QtWidgets.QWidget):
+    def __init__(self):
+        super(ScenarioChooserWidget, self).__init__()
+
+        self.layout = QtWidgets.QVBoxLayout()
+        self.sdf_path = None
+        self.extra_projects = []
+        self.processes = 1
+
+        # Label
+        self.label = QtWidgets.QLabel("Choose the scenarios you want to install")
+        self.layout.addWidget(self.label)
+
+        # Datapackage table
+        self.data_package_table = DataPackageTable(self)
+        self.layout.addWidget(self.data_package_table)
+
+        # Rule based selection
+        self.rules_field = QtWidgets.QLineEdit()
+        self.rules_field.setPlaceholderText("Select by rule, e.g. pathway=SSP2* year=2030-2050")
+        self.rules_field.setToolTip("Rules select scenarios by model, pathway, year, name or description.\n"
+                                    "Values may use * wildcards, years may be ranges like 2030-2050.\n"
+                                    "Separate rules with ';', a rule starting with '-' deselects.")
+        self.apply_rules_b = QtWidgets.QPushButton("Apply")
+        self.presets = QtWidgets.QComboBox()
+        self.presets.setToolTip("Saved selections, they can also be used for imports without the interface")
+        self.save_preset_b = QtWidgets.QPushButton("Save preset")
+        self.rules_layout = QtWidgets.QHBoxLayout()
+        self.rules_layout.addWidget(self.rules_field)
+        self.rules_layout.addWidget(self.apply_rules_b)
+        self.rules_layout.addWidget(self.presets)
+        self.rules_layout.addWidget(self.save_preset_b)
+        self.layout.addLayout(self.rules_layout)
+        self.update_presets()
+
+        # Scenario difference preview
+        self.preview_b = QtWidgets.QPushButton("Preview changes")
+        self.preview_b.setCheckable(True)
+        self.preview_b.setToolTip("Show what the selected scenarios change compared to the source database,\n"
+                                  "without importing anything")
+        self.preview_layout = QtWidgets.QHBoxLayout()
+        self.preview_layout.addWidget(self.preview_b)
+        self.preview_layout.addStretch()
+        self.layout.addLayout(self.preview_layout)
+        self.diff_widget = ScenarioDiffWidget(self)
+        self.diff_widget.setVisible(False)
+        self.layout.addWidget(self.diff_widget)
+
+        # SDF checker
+        self.sdf_check = QtWidgets.QCheckBox("Produce Superstructure database")
+        self.sdf_check.setChecked(False)
+        self.sdf_check.setEnabled(False)
+        self.sdf_name_field = QtWidgets.QLineEdit()
+        self.sdf_name_field.setPlaceholderText("Superstructure database name (optional)")
+        self.sdf_name_field.setEnabled(False)
+        self.sdf_file_loc = QtWidgets.QPushButton("SDF location")
+        self.sdf_file_loc.setToolTip("Choose a folder to export the SDF scenario file to")
+        self.sdf_file_loc.setEnabled(False)
+        self.sdf_compact_check = QtWidgets.QCheckBox("Compact scenario store")
+        self.sdf_compact_check.setToolTip("Store the scenarios as sparse differences in the project\n"
+                                          "instead of exporting an SDF file, this uses far less disk space.\n"
+                                          "Use 'Export scenario file...' to load the scenarios in a calculation")
+        self.sdf_compact_check.setChecked(False)
+        self.sdf_compact_check.setEnabled(False)
+
+        self.sdf_layout = QtWidgets.QHBoxLayout()
+        self.sdf_layout.addWidget(self.sdf_check)
+        self.sdf_layout.addWidget(self.sdf_name_field)
+        self.sdf_layout.addWidget(self.sdf_file_loc)
+        self.sdf_layout.addWidget(self.sdf_compact_check)
+        self.sdf_layout.addStretch()
+        self.sdf_widget = QtWidgets.QWidget()
+        self.sdf_widget.setToolTip("Instead of writing multiple databases per scenario,\n"
+                                   "write one database and an SDF scenario difference file")
+        self.sdf_widget.setLayout(self.sdf_layout)
+        self.layout.addWidget(self.sdf_widget)
+
+        # Resource estimate
+        self.estimate_label = QtWidgets.QLabel("")
+        self.estimate_label.setToolTip("Estimate of the resources the import needs,\n"
+                                       "based on earlier imports on this computer")
+        self.layout.addWidget(self.estimate_label)
+
+        # Import button
+        self.import_b = QtWidgets.QPushButton("Import")
+        self.import_b.setEnabled(False)
+        self.import_layout = QtWidgets.QHBoxLayout()
+        self.import_layout.addWidget(self.import_b)
+        self.projects_b = QtWidgets.QPushButton("Also install in...")
+        self.projects_b.setToolTip("Choose other projects to install the scenarios in as well,\n"
+                                   "the databases are computed once and written to every project")
+        self.import_layout.addWidget(self.projects_b)
+        self.projects_label = QtWidgets.QLabel("")
+        self.import_layout.addWidget(self.projects_label)
+        self.snapshot_check = QtWidgets.QCheckBox("Keep snapshot")
+        self.snapshot_check.setToolTip("Keep a snapshot of the new databases, importing the same scenarios\n"
+                                       "with the same databases again then skips unfolding")
+        self.import_layout.addWidget(self.snapshot_check)
+        self.import_layout.addStretch()
+        self.clear_unfold_cache = QtWidgets.QPushButton("Clear unfold cache")
+        self.clear_unfold_cache.setToolTip("Unfold caches some data to work faster, though sometimes this can store old data\n"
+                                    "that should be renewed, clearing the cache allows new data to be cached.")
+        self.import_layout.addWidget(self.clear_unfold_cache)
+        self.import_b_widg = QtWidgets.QWidget()
+        self.import_b_widg.setLayout(self.import_layout)
+        self.layout.addWidget(self.import_b_widg)
+        self.import_b.clicked.connect(self.import_state)
+        self.projects_b.clicked.connect(self.choose_extra_projects)
+        self.clear_unfold_cache.clicked.connect(self.do_clear_cache)
+
+        self.layout.addWidget(horizontal_line())
+        self.setLayout(self.layout)
+
+        # signals
+        signals.no_or_1_scenario_selected.connect(self.manage_sdf_state)
+        signals.no_scenario_selected.connect(self.manage_import_button_state)
+        self.sdf_file_loc.clicked.connect(self.choose_sdf_location)
+        self.data_package_table.model.updated.connect(self.update_estimate)
+        self.data_package_table.model.updated.connect(self.update_preview)
+        self.preview_b.toggled.connect(self.diff_widget.setVisible)
+        self.preview_b.toggled.connect(self.update_preview)
+        self.sdf_check.toggled.connect(self.update_estimate)
+        self.rules_field.returnPressed.connect(self.apply_rules)
+        self.apply_rules_b.clicked.connect(self.apply_rules)
+        self.presets.activated[str].connect(self.apply_preset)
+        self.save_preset_b.clicked.connect(self.save_preset)
+
+    def do_clear_cache(self):
+        log.info("Clearing the unfold cache")
+        clear_cache()
+
+    def estimate(self):
+        """Return the resource estimate of importing the selected scenarios, None if nothing is selected."""
+        model = self.data_package_table.model
+        n_scenarios = sum(bool(state) for state in (model.include or []))
+        if not model.data_package or n_scenarios == 0:
+            return
+        return estimate_unfold(model.data_package, n_scenarios, self.sdf_check.isChecked())
+
+    def update_preview(self) -> None:
+        """Show the changes of the selected scenarios in the preview, if it is open."""
+        if not self.preview_b.isChecked():
+            return
+        model = self.data_package_table.model
+        if not model.data_package:
+            return
+        scenarios = [s["name"] for s, state in zip(model.data_package.descriptor["scenarios"], model.include or [])
+                     if state]
+        QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            self.diff_widget.show_scenarios(model.data_package, scenarios)
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+    def rules(self) -> List[str]:
+        return [rule.strip() for rule in self.rules_field.text().split(";") if rule.strip()]
+
+    def apply_rules(self, replace: bool = False) -> None:
+        """Apply the rules in the rule field on top of the current selection, or to an empty one with `replace`."""
+        model = self.data_package_table.model
+        if model.scenarios is None or not self.rules():
+            return
+        try:
+            include = apply_rules(model.scenarios, self.rules(), None if replace else model.include)
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(self, "Invalid selection rule", str(e))
+            return
+        model.set_include(include)
+
+    def apply_preset(self, name: str) -> None:
+        """Replace the selection with the one of the saved preset `name`."""
+        rules = load_presets().get(name)
+        if not rules:
+            return
+        self.rules_field.setText("; ".join(rules))
+        self.apply_rules(replace=True)
+
+    def save_preset(self) -> None:
+        """Save the rules in the rule field as a preset."""
+        if not self.rules():
+            return
+        name, ok = QtWidgets.QInputDialog.getText(self, "Save preset", "Preset name")
+        if not ok or not name:
+            return
+        try:
+            save_preset(name, self.rules())
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(self, "Invalid selection rule", str(e))
+            return
+        self.update_presets()
+        self.presets.setCurrentText(name)
+
+    def update_presets(self) -> None:
+        self.presets.clear()
+        self.presets.addItem("")
+        self.presets.addItems(sorted(load_presets()))
+
+    def update_estimate(self) -> None:
+        estimate = self.estimate()
+        self.estimate_label.setText(estimate.summary() if estimate else "")
+
+    def import_state(self):
+
+        # convert the binary list to a list of indices that were selected
+        include_scenarios = [i for i, state in enumerate(self.data_package_table.model.include) if state]
+
+        # refuse or warn up front if the import is likely to run out of resources
+        estimate = self.estimate()
+        if estimate and estimate.blocking:
+            QtWidgets.QMessageBox.critical(self, "Not enough resources", "\n".join(estimate.blocking))
+            return
+        if estimate and estimate.warnings:
+            choice = QtWidgets.QMessageBox.warning(self, "Resources may be insufficient",
+                                                   "\n".join(estimate.warnings + ["Import anyway?"]),
+                                                   QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                                   QtWidgets.QMessageBox.No)
+            if choice != QtWidgets.QMessageBox.Yes:
+                return
+
+        # match the dependencies (databases) of the scenarios to the correct databases in AB
+        dependencies = []
+        for dependency in self.data_package_table.model.data_package.descriptor["dependencies"]:
+            dependencies.append(dependency["name"])
+        depends = dependencies
+        dependencies = self.relink_database(depends)
+        if not dependencies:
+            return
+        # every other project gets its own mapping, its databases may have other names
+        extra_projects = {}
+        for project in self.extra_projects:
+            extra_projects[project] = self.relink_database(depends, project)
+            if not extra_projects[project]:
+                return
+
+        # read/set the correct data for SDF
+        as_sdf = self.sdf_check.isChecked()
+        sdf_db = self.sdf_name_field.text()
+        if sdf_db == "" and not as_sdf:
+            sdf_db = None
+        elif sdf_db == "" and as_sdf:
+            # no name was chosen for the superstructure, generate a descriptive name
+            db = [db for db in dependencies.values() if db != "biosphere3"][0]  # get db name
+            scn = self.data_package_table.model.scenario_name
+            sdf_db = " - ".join([db, scn]) if scn else db
+        sdf_loc = self.sdf_file_loc
+        if sdf_loc == "":
+            sdf_loc = None
+        compact = as_sdf and self.sdf_compact_check.isChecked()
+
+        # start database generation
+        signals.generate_db.emit(
+            include_scenarios,  # List of scenario indices to include
+            dependencies,  # dict of dependency names (translated between datapackage and current bw project
+            as_sdf,  # whether to make this into superstructure format (bool)
+            sdf_db,  # superstructure database name (str or None)
+            sdf_loc,  # superstructure SDF file location (str or None)
+            compact,  # store the scenarios as sparse deltas instead of an SDF file (bool)
+            extra_projects,  # other projects to install into, with their dependency names (dict)
+            self.processes,  # max number of processes to use for the other projects (int)
+            self.snapshot_check.isChecked()  # keep a snapshot of the new databases (bool)
+        )
+        self.sdf_file_loc = None
+
+    def relink_database(self, depends: list, project: Optional[str] = None) -> dict:
+        """Relink technosphere exchanges within the given Fold, to the databases of `project` (default: current)."""
+        if project is None:
+            options = [(depend, bw.databases.list) for depend in depends]
+            dialog = RelinkDialog.relink_scenario_link(options)
+        else:
+            options = [(depend, project_databases(project)) for depend in depends]
+            dialog = RelinkDialog.relink_scenario_link(
+                options, label=f"Choose the ScenarioLink databases in project '{project}'.")
+        relinked = {}
+        if dialog.exec_() == RelinkDialog.Accepted:
+            for old, new in dialog.relink.items():
+                # Add the relinks
+                relinked[old] = new
+            for dep in depends:
+                # Add any remaining DBs with the same name
+                if dep not in relinked.keys():
+                    relinked[dep] = dep
+            return relinked
+
+    def manage_sdf_state(self, state: bool) -> None:
+        """Change SDF UI elements depending on whether >1 scenarios are selected."""
+        if state:
+            # block the SDF state
+            self.sdf_check.setChecked(False)
+        self.sdf_check.setEnabled(not state)
+        self.sdf_name_field.setEnabled(not state)
+        self.sdf_file_loc.setEnabled(not state)
+        self.sdf_compact_check.setEnabled(not state)
+
+    def manage_import_button_state(self, state: bool) -> None:
+        """Change import button UI elements depending on whether >=1 scenarios are selected."""
+        self.import_b.setEnabled(not state)
+
+    def choose_extra_projects(self) -> None:
+        """Start dialog so user can choose other projects to install the scenarios in."""
+        projects = sorted(p.name for p in bw.projects if p.name != bw.projects.current)
+        dialog = ProjectsDialog(projects, self.extra_projects, self.processes, self)
+        if dialog.exec_() == ProjectsDialog.Accepted:
+            self.extra_projects = dialog.selected_projects()
+            self.processes = dialog.processes.value()
+            self.projects_label.setText(f"+ {len(self.extra_projects)} project(s)" if self.extra_projects else "")
+            # snapshots are only kept for an import into the current project
+            if self.extra_projects:
+                self.snapshot_check.setChecked(False)
+            self.snapshot_check.setEnabled(not self.extra_projects)
+
+    def choose_sdf_location(self) -> None:
+        """Start dialog so user can choose location for SDF file export."""
+        path = QtWidgets.QFileDialog.getExistingDirectory(
+            caption="Select location to export SDF file to",
+        )
+        self.sdf_file_loc = path
+
+
+class ScenarioDiffWidget(QtWidgets.QWidget):
+    """Preview of the exchanges changed by the selected scenarios, read directly from the datapackage."""
+
+    def __init__(self, parent=None):
+        super(ScenarioDiffWidget, self).__init__(parent)
+        self.package = None
+
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.setContentsMargins(0, 0, 0, 0)
+
+        self.view = QtWidgets.QComboBox()
+        self.view.addItems(["Largest changes", ADDED_VIEW] + list(GROUPINGS.keys()))
+        self.view.setToolTip("Show the exchanges that change most, the amounts of the exchanges of datasets\n"
+                             "the package adds, or the changes aggregated per group")
+        self.previous_b = QtWidgets.QPushButton("<")
+        self.next_b = QtWidgets.QPushButton(">")
+        self.page_label = QtWidgets.QLabel("")
+        self.controls = QtWidgets.QHBoxLayout()
+        self.controls.addWidget(self.view)
+        self.controls.addStretch()
+        self.controls.addWidget(self.previous_b)
+        self.controls.addWidget(self.page_label)
+        self.controls.addWidget(self.next_b)
+        self.layout.addLayout(self.controls)
+
+        self.table = ScenarioDiffTable(self)
+        self.layout.addWidget(self.table)
+        self.setLayout(self.layout)
+
+        self.view.currentTextChanged.connect(self.change_view)
+        self.previous_b.clicked.connect(lambda: self.change_page(-1))
+        self.next_b.clicked.connect(lambda: self.change_page(1))
+        self.table.model.updated.connect(self.update_page_label)
+
+    def show_scenarios(self, package, scenarios: list) -> None:
+        model = self.table.model
+        if package is not self.package:
+            self.package = package
+            model.set_package(package)
+        model.scenarios = scenarios
+        model.page = 0
+        model.sync()
+
+    def change_view(self, text: str) -> None:
+        model = self.table.model
+        model.grouping = GROUPINGS.get(text)
+        model.show_added = text == ADDED_VIEW
+        model.page = 0
+        model.sync()
+
+    def change_page(self, step: int) -> None:
+        model = self.table.model
+        page = min(max(model.page + step, 0), model.n_pages - 1)
+        if page != model.page:
+            model.page = page
+            model.sync()
+
+    def update_page_label(self) -> None:
+        model = self.table.model
+        if model.show_added:
+            rows = "added exchanges"
+        else:
+            rows = "changed exchanges" if model.grouping is None else "groups"
+        self.page_label.setText(f"page {model.page + 1}/{model.n_pages} ({model.n_rows} {rows})")
+        self.previous_b.setEnabled(model.page > 0)
+        self.next_b.setEnabled(model.page < model.n_pages - 1)
+
+
+class ProgressDialog(QtWidgets.QDialog):
+    """Progress of the running job, with its throughput, remaining time and a cancel button.
+
+    The dialog is application modal: jobs process GUI events while they run, and nothing else in the
+    Activity Browser should start another job or change the project meanwhile.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("ScenarioLink")
+        self.setWindowModality(Qt.ApplicationModal)
+        self.setWindowFlags(self.windowFlags() & ~Qt.WindowCloseButtonHint & ~Qt.WindowContextHelpButtonHint)
+        self.setMinimumWidth(450)
+        self.stage_label = QtWidgets.QLabel("")
+        self.bar = QtWidgets.QProgressBar()
+        self.details_label = QtWidgets.QLabel("")
+        self.cancel_b = QtWidgets.QPushButton("Cancel")
+        self.cancel_b.setToolTip("Stop the running job, downloads resume where they stopped\n"
+                                 "and databases that were not finished are removed")
+
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addWidget(self.stage_label)
+        self.layout.addWidget(self.bar)
+        self.layout.addWidget(self.details_label)
+        cancel_layout = QtWidgets.QHBoxLayout()
+        cancel_layout.addStretch()
+        cancel_layout.addWidget(self.cancel_b)
+        self.layout.addLayout(cancel_layout)
+        self.setLayout(self.layout)
+
+        self.cancel_b.clicked.connect(self.cancel)
+
+    def update_progress(self, state: dict) -> None:
+        if not self.isVisible():
+            self.show()
+        self.stage_label.setText(state["stage"] or "")
+        if state["total"]:
+            self.bar.setRange(0, 1000)
+            self.bar.setValue(int(1000 * min(state["done"] / state["total"], 1)))
+        else:
+            # a busy indicator for stages of unknown size
+            self.bar.setRange(0, 0)
+        self.details_label.setText(describe(state))
+        self.cancel_b.setEnabled(not progress.cancelled)
+
+    def cancel(self) -> None:
+        progress.cancel()
+        self.cancel_b.setEnabled(False)
+        self.stage_label.setText(f"Cancelling {self.stage_label.text().lower()}...")
+
+    def reject(self) -> None:
+        # Escape cancels the job, the dialog closes when the job has stopped
+        if self.cancel_b.isEnabled():
+            self.cancel()
+
+
+class CompareDialog(QtWidgets.QDialog):
+    """Dialog to compare the LCA scores of scenarios for a calculation setup."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Compare scenarios")
+        self.resize(900, 600)
+
+        self.layout = QtWidgets.QVBoxLayout()
+
+        self.setup = QtWidgets.QComboBox()
+        self.setup.addItems(sorted(bw.calculation_setups.keys()))
+        setup_layout = QtWidgets.QHBoxLayout()
+        setup_layout.addWidget(QtWidgets.QLabel("Calculation setup"))
+        setup_layout.addWidget(self.setup)
+        setup_layout.addStretch()
+        self.layout.addLayout(setup_layout)
+
+        self.layout.addWidget(QtWidgets.QLabel(
+            "Choose the scenario databases to compare, or one superstructure database with a scenario store.\n"
+            "Functional units are matched to each database by name, reference product and location."
+        ))
+        self.database_list = QtWidgets.QListWidget()
+        for db in sorted(bw.databases):
+            has_store = os.path.exists(delta_store_path(db))
+            item = QtWidgets.QListWidgetItem(f"{db} (scenario store)" if has_store else db)
+            item.setData(Qt.UserRole, (db, has_store))
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Unchecked)
+            self.database_list.addItem(item)
+        self.layout.addWidget(self.database_list)
+
+        self.calculate_b = QtWidgets.QPushButton("Calculate")
+        calculate_layout = QtWidgets.QHBoxLayout()
+        calculate_layout.addWidget(self.calculate_b)
+        calculate_layout.addStretch()
+        self.layout.addLayout(calculate_layout)
+
+        self.table = ComparisonTable(self)
+        self.layout.addWidget(self.table)
+        self.setLayout(self.layout)
+
+        self.calculate_b.clicked.connect(self.calculate)
+
+    def calculate(self) -> None:
+        from ...compare import compare_superstructure, compare_databases
+
+        if not self.setup.currentText():
+            return
+        setup = bw.calculation_setups[self.setup.currentText()]
+        functional_units = [{tuple(key): amount for key, amount in fu.items()} for fu in setup["inv"]]
+        methods = [tuple(method) for method in setup["ia"]]
+        checked = [self.database_list.item(i).data(Qt.UserRole) for i in range(self.database_list.count())
+                   if self.database_list.item(i).checkState() == Qt.Checked]
+        if not checked or not functional_units or not methods:
+            return
+
+        QtWidgets.QApplication.setOverrideCursor(Qt.WaitCursor)
+        self.calculate_b.setEnabled(False)
+        try:
+            with progress.job():
+                if len(checked) == 1 and checked[0][1]:
+                    results = compare_superstructure(checked[0][0], functional_units, methods)
+                else:
+                    results = compare_databases([db for db, _ in checked], functional_units, methods)
+        except Cancelled:
+            log.info("Scenario comparison cancelled")
+            return
+        except Exception as e:
+            log.error(f"Scenario comparison failed: {e}")
+            return
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+            self.calculate_b.setEnabled(True)
+        self.table.model.results = results
+        self.table.model.sync()
+
+
+class RelinkDialog(DatabaseLinkingDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+    @classmethod
+    def relink_scenario_link(cls, options: List[Tuple[str, List[str]]],
+                     parent=None, label: str = "Choose the ScenarioLink databases.") -> "RelinkDialog":
+        label = f"{label}\nBy clicking 'OK', you start the import."
+        return cls.construct_dialog(label, options, parent)
+
+
+class DatabasesDialog(QtWidgets.QDialog):
+    """Dialog to choose the databases to export into a snapshot."""
+
+    def __init__(self, databases: List[str], parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Export snapshot")
+
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addWidget(QtWidgets.QLabel("Choose the databases to export."))
+        self.database_list = QtWidgets.QListWidget()
+        for database in databases:
+            item = QtWidgets.QListWidgetItem(database)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Unchecked)
+            self.database_list.addItem(item)
+        self.layout.addWidget(self.database_list)
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        self.layout.addWidget(buttons)
+        self.setLayout(self.layout)
+
+    def selected_databases(self) -> List[str]:
+        return [self.database_list.item(i).text() for i in range(self.database_list.count())
+                if self.database_list.item(i).checkState() == Qt.Checked]
+
+
+class ProjectsDialog(QtWidgets.QDialog):
+    """Dialog to choose the other projects to install the scenarios in."""
+
+    def __init__(self, projects: List[str], selected: List[str], processes: int, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Install in other projects")
+
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addWidget(QtWidgets.QLabel(
+            "Choose the projects to install the scenarios in as well.\n"
+            "When importing, you choose the databases to link to in each of these projects."
+        ))
+        self.project_list = QtWidgets.QListWidget()
+        for project in projects:
+            item = QtWidgets.QListWidgetItem(project)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if project in selected else Qt.Unchecked)
+            self.project_list.addItem(item)
+        self.layout.addWidget(self.project_list)
+
+        self.processes = QtWidgets.QSpinBox()
+        self.processes.setRange(1, 8)
+        self.processes.setValue(processes)
+        self.processes.setToolTip("Projects with different source databases can be computed in parallel,\n"
+                                  "each process needs as much memory as a single import")
+        processes_layout = QtWidgets.QHBoxLayout()
+        processes_layout.addWidget(QtWidgets.QLabel("Parallel processes"))
+        processes_layout.addWidget(self.processes)
+        processes_layout.addStretch()
+        self.layout.addLayout(processes_layout)
+
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        self.layout.addWidget(buttons)
+        self.setLayout(self.layout)
+
+    def selected_projects(self) -> List[str]:
+        return [self.project_list.item(i).text() for i in range(self.project_list.count())
+                if self.project_list.item(i).checkState() == Qt.Checked]
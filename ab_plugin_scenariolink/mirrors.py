@@ -0,0 +1,283 @@
+"""
+Datapackage mirrors for the ScenarioLink plugin.
+This module fetches datapackages from shared directories and HTTP mirrors before falling back to Zenodo,
+so one download can serve a whole team.
+
+A mirror holds the repacked datapackage of a record as `<record_id>.zip`, next to `<record_id>.zip.md5`
+with its MD5 checksum. Mirrors are configured in `scenariolink_mirrors.json` in the Activity Browser data
+folder, or in the `SCENARIOLINK_MIRRORS` environment variable (mirrors separated by `os.pathsep`, or `;`
+between URLs), for example:
+
+    {
+        "mirrors": ["//fileserver/lca/scenariolink", "http://mirror.example.org/scenariolink"],
+        "publish": true,
+        "zenodo": "https://zenodo.org"
+    }
+
+With `publish`, records downloaded from Zenodo are copied to the writable directory mirrors.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Iterable, List, Optional
+from logging import getLogger
+
+import appdirs
+import requests
+
+from .progress import progress
+
+log = getLogger(__name__)
+
+# bytes read or downloaded at a time
+CHUNK_SIZE = 1024 ** 2
+
+MIRRORS_ENV = "SCENARIOLINK_MIRRORS"
+ZENODO_URL = "https://zenodo.org"
+DEFAULT_CONFIG = {"mirrors": [], "publish": False, "zenodo": ZENODO_URL}
+
+
+def config_path() -> str:
+    return os.path.join(appdirs.user_data_dir("ActivityBrowser", "ActivityBrowser"), "scenariolink_mirrors.json")
+
+
+def load_config() -> dict:
+    """Return the mirror configuration, the environment variable replaces the configured mirrors."""
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(config_path(), "r", encoding="utf-8") as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        log.warning(f"Could not read mirror configuration {config_path()}: {e}")
+    if os.environ.get(MIRRORS_ENV):
+        value = os.environ[MIRRORS_ENV]
+        # `os.pathsep` is ':' on posix, which also separates the scheme of a URL
+        separator = ";" if "://" in value else os.pathsep
+        config["mirrors"] = [m for m in value.split(separator) if m]
+    return config
+
+
+def zenodo_files_url(record_id: str) -> str:
+    return f"{load_config()['zenodo'].rstrip('/')}/api/records/{record_id}/files"
+
+
+def file_checksum(path: str) -> str:
+    file_hash = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+# checksums computed by `package_checksum`, by (path, size, modification time)
+_checksums = {}
+
+
+def package_checksum(path: str) -> str:
+    """Return the MD5 checksum of the package at `path`.
+
+    The checksum file written with a cached package is used while it is newer than the package,
+    other packages are hashed once per size and modification time.
+    """
+    stat = os.stat(path)
+    try:
+        if os.path.getmtime(path + ".md5") >= stat.st_mtime:
+            with open(path + ".md5", "r", encoding="utf-8") as f:
+                checksum = read_checksum(f.read())
+            if checksum:
+                return checksum
+    except OSError:
+        pass
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _checksums:
+        _checksums[key] = file_checksum(path)
+    return _checksums[key]
+
+
+def read_checksum(text: str) -> str:
+    """Return the checksum of a checksum file, which may be followed by the file name (`md5sum` format)."""
+    return text.split()[0].lower() if text.strip() else ""
+
+
+def write_checksum_file(path: str, checksum: Optional[str] = None) -> None:
+    """Write the checksum of the file at `path` next to it as `<path>.md5`, computed if not given."""
+    checksum = checksum or file_checksum(path)
+    with open(path + ".md5.partial", "w", encoding="utf-8") as f:
+        f.write(f"{checksum}  {os.path.basename(path)}\n")
+    os.replace(path + ".md5.partial", path + ".md5")
+
+
+def _temp_path(target: str) -> str:
+    """Return a new temporary file next to `target`, unique so concurrent writers never share one."""
+    fd, path = tempfile.mkstemp(dir=os.path.dirname(target) or ".", prefix=f"{os.path.basename(target)}.",
+                                suffix=".partial")
+    os.close(fd)
+    return path
+
+
+def _read_chunks(path: str) -> Iterable[bytes]:
+    with open(path, "rb") as f:
+        yield from iter(lambda: f.read(CHUNK_SIZE), b"")
+
+
+def _write_chunks(chunks: Iterable[bytes], path: Optional[str]) -> str:
+    """Write `chunks` to `path` (only hash them if None) and return their MD5 checksum, advancing the progress."""
+    file_hash = hashlib.md5()
+    with open(path, "wb") if path else open(os.devnull, "wb") as f:
+        for chunk in chunks:
+            file_hash.update(chunk)
+            f.write(chunk)
+            progress.advance(len(chunk))
+    return file_hash.hexdigest()
+
+
+def _place(source: str, target: str, link: bool, expected: Optional[str] = None) -> Optional[str]:
+    """Put `source` at `target` through a temporary name, hard-linked if possible, copied otherwise.
+
+    The data is hashed while it is copied or linked, so it is read once. Returns its MD5 checksum,
+    or None if it does not match `expected`, then `target` is left as it was.
+    """
+    partial = _temp_path(target)
+    try:
+        progress.start(f"Copying {os.path.basename(source)}", os.path.getsize(source), "B")
+        linked = False
+        if link:
+            try:
+                os.remove(partial)
+                os.link(source, partial)
+                linked = True
+            except OSError:
+                # another volume, or a filesystem without hard links
+                pass
+        # a hard link shares the data of `source`, hashing it verifies both
+        checksum = _write_chunks(_read_chunks(partial), None) if linked else _write_chunks(_read_chunks(source), partial)
+        if expected is not None and checksum != expected:
+            return
+        os.replace(partial, target)
+        return checksum
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+class DirectoryMirror:
+    """A mirror on a (shared network) filesystem."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def fetch(self, record_id: str, target: str) -> bool:
+        """Put the package of `record_id` at `target`, return False if the mirror doesn't have a valid one."""
+        source = os.path.join(self.path, f"{record_id}.zip")
+        try:
+            with open(source + ".md5", "r", encoding="utf-8") as f:
+                expected = read_checksum(f.read())
+        except OSError:
+            return False
+        if not os.path.exists(source):
+            return False
+        if _place(source, target, link=True, expected=expected) is None:
+            log.warning(f"Checksum of {source} does not match, skipping mirror {self.path}")
+            return False
+        write_checksum_file(target, expected)
+        return True
+
+    def publish(self, record_id: str, path: str) -> None:
+        """Copy the package at `path` to this mirror, with its checksum file."""
+        if not os.path.isdir(self.path) or not os.access(self.path, os.W_OK):
+            return
+        target = os.path.join(self.path, f"{record_id}.zip")
+        if os.path.exists(target):
+            return
+        # a copy, not a link, so clearing the local cache never touches the mirror
+        write_checksum_file(target, _place(path, target, link=False))
+        log.info(f"Published {record_id} to mirror {self.path}")
+
+
+class HttpMirror:
+    """A mirror served over HTTP(S)."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+
+    def __str__(self):
+        return self.url
+
+    def fetch(self, record_id: str, target: str) -> bool:
+        """Download the package of `record_id` to `target`, return False if the mirror doesn't have a valid one."""
+        url = f"{self.url}/{record_id}.zip"
+        partial = _temp_path(target)
+        try:
+            response = requests.get(url + ".md5", timeout=10)
+            if response.status_code != 200:
+                return False
+            expected = read_checksum(response.text)
+            with requests.get(url, stream=True, timeout=100) as response:
+                response.raise_for_status()
+                size = int(response.headers.get("content-length", 0)) or None
+                progress.start(f"Downloading {record_id} from {self.url}", size, "B")
+                checksum = _write_chunks(response.iter_content(CHUNK_SIZE), partial)
+            if checksum != expected:
+                log.warning(f"Checksum of {url} does not match, skipping mirror {self.url}")
+                return False
+            os.replace(partial, target)
+        except requests.RequestException as e:
+            log.debug(f"Mirror {self.url} unavailable: {e}")
+            return False
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        write_checksum_file(target, expected)
+        return True
+
+    def publish(self, record_id: str, path: str) -> None:
+        # HTTP mirrors are read-only
+        pass
+
+
+def configured_mirrors() -> List[object]:
+    """Return the configured mirrors in the order they are tried."""
+    mirrors = []
+    for mirror in load_config()["mirrors"]:
+        if mirror.startswith(("http://", "https://")):
+            mirrors.append(HttpMirror(mirror))
+        else:
+            mirrors.append(DirectoryMirror(os.path.expanduser(mirror)))
+    return mirrors
+
+
+def fetch_from_mirrors(record_id: str, target: str) -> Optional[str]:
+    """Put the package of `record_id` at `target` from the first mirror that has it.
+
+    Run it inside `progress.job()` to show the progress of the transfer and let the user cancel it.
+    Returns the mirror the package came from, None if no mirror has it.
+    """
+    for mirror in configured_mirrors():
+        try:
+            if mirror.fetch(record_id, target):
+                log.info(f"Fetched {record_id} from mirror {mirror}")
+                return str(mirror)
+        except OSError as e:
+            log.warning(f"Could not fetch {record_id} from mirror {mirror}: {e}")
+    return
+
+
+def publish_to_mirrors(record_id: str, path: str) -> None:
+    """Copy a package downloaded from Zenodo to the writable mirrors, if publishing is enabled.
+
+    Run it inside `progress.job()` to show the progress of the copies and let the user cancel them.
+    """
+    if not load_config()["publish"]:
+        return
+    for mirror in configured_mirrors():
+        try:
+            mirror.publish(record_id, path)
+        except OSError as e:
+            log.warning(f"Could not publish {record_id} to mirror {mirror}: {e}")
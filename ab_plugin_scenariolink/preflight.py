@@ -0,0 +1,248 @@
+"""
+Resource preflight checks for the ScenarioLink plugin.
+This module estimates the disk space, memory and time a download or unfold needs before it starts,
+based on the sizes of the datapackage and the measurements of earlier runs.
+"""
+
+from datetime import datetime
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from statistics import median
+from typing import Optional
+from logging import getLogger
+
+import appdirs
+import requests
+
+from .mirrors import zenodo_files_url
+
+log = getLogger(__name__)
+
+GB = 1024 ** 3
+
+# used as long as there is no history of earlier runs, measured on ecoinvent-sized databases
+DEFAULT_RATES = {
+    "download": {"disk_per_byte": 3.0, "seconds_per_byte": 1 / (5 * 1024 ** 2)},  # download, extract and repack
+    "unfold": {"disk_per_scenario": 1.0 * GB, "memory_per_scenario": 2.0 * GB, "seconds_per_scenario": 300.0},
+    # one database with the exchanges of all scenarios and the scenario difference file
+    "superstructure": {"disk_per_scenario": 0.3 * GB, "memory_per_scenario": 1.0 * GB, "seconds_per_scenario": 120.0},
+}
+# unfold always loads the source database in memory, whatever the number of scenarios
+MIN_UNFOLD_MEMORY = 3.0 * GB
+# the number of runs that is kept in the history, per kind of run
+HISTORY_LENGTH = 50
+
+
+def history_path() -> str:
+    # not in the cache folder, clearing the datapackage cache should not lose the measurements
+    folder = appdirs.user_data_dir("ActivityBrowser", "ActivityBrowser")
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return os.path.join(folder, "scenariolink_runs.json")
+
+
+def load_history() -> dict:
+    """Return the measurements of earlier runs as {kind: [run, ...]}."""
+    try:
+        with open(history_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_run(kind: str, **measures) -> None:
+    """Add the measurements of a finished run of `kind` ('download', 'unfold' or 'superstructure') to the history."""
+    history = load_history()
+    runs = history.setdefault(kind, [])
+    runs.append({"time": datetime.now().isoformat(), **measures})
+    history[kind] = runs[-HISTORY_LENGTH:]
+    try:
+        with open(history_path(), "w", encoding="utf-8") as f:
+            json.dump(history, f, indent=1)
+    except OSError as e:
+        log.debug(f"Could not store run history: {e}")
+
+
+def rate(kind: str, name: str, numerator: str, denominator: str) -> float:
+    """Return the median of `numerator / denominator` over earlier runs of `kind`, or the default rate."""
+    values = [run[numerator] / run[denominator] for run in load_history().get(kind, [])
+              if run.get(numerator) is not None and run.get(denominator)]
+    if values:
+        return median(values)
+    return DEFAULT_RATES[kind][name]
+
+
+def available_memory() -> Optional[int]:
+    """Return the available memory in bytes, None if it can't be determined."""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return
+
+
+def current_memory() -> Optional[int]:
+    """Return the memory (resident set size) this process uses in bytes, None if it can't be determined."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return
+
+
+class MemorySampler(threading.Thread):
+    """Samples the memory use of this process in the background, to measure how much a run adds to it."""
+
+    def __init__(self, interval: float = 0.25):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.baseline = current_memory()
+        self.peak = self.baseline
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        memory = current_memory()
+        if memory is not None and self.peak is not None:
+            self.peak = max(self.peak, memory)
+
+    def increase(self) -> Optional[int]:
+        """Stop sampling and return the peak increase of the memory use over the baseline."""
+        self.stopped.set()
+        self.join()
+        self.sample()
+        if self.baseline is None:
+            return
+        return self.peak - self.baseline
+
+
+def free_disk(path: str) -> int:
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+
+class Estimate:
+    """Estimated resources of a run, with the problems found comparing them to what is available."""
+
+    def __init__(self, disk: float, memory: float, seconds: float, disk_free: int,
+                 memory_free: Optional[int]):
+        self.disk = disk
+        self.memory = memory
+        self.seconds = seconds
+        self.disk_free = disk_free
+        self.memory_free = memory_free
+
+    @property
+    def blocking(self) -> list:
+        """Problems that make the run fail, it should not be started."""
+        if self.disk > self.disk_free:
+            return [f"Not enough disk space: {self.disk / GB:.1f} GB needed, {self.disk_free / GB:.1f} GB free."]
+        return []
+
+    @property
+    def warnings(self) -> list:
+        """Problems that may make the run fail or be very slow."""
+        warnings = []
+        if self.disk_free > self.disk > 0.8 * self.disk_free:
+            warnings.append(f"Low disk space: {self.disk / GB:.1f} GB needed, {self.disk_free / GB:.1f} GB free.")
+        if self.memory_free is not None and self.memory > self.memory_free:
+            warnings.append(f"Not enough free memory: about {self.memory / GB:.1f} GB needed, "
+                            f"{self.memory_free / GB:.1f} GB available.")
+        return warnings
+
+    def summary(self) -> str:
+        minutes = max(1, round(self.seconds / 60))
+        text = (f"Estimated: {self.disk / GB:.1f} GB disk, {self.memory / GB:.1f} GB memory, "
+                f"~{minutes} min")
+        return " ".join([text] + self.blocking + self.warnings)
+
+
+def estimate_download(record_id: str) -> Optional[Estimate]:
+    """Estimate the resources to download and repack a Zenodo record, None if the sizes can't be fetched."""
+    url = zenodo_files_url(record_id)
+    try:
+        entries = requests.get(url, timeout=10).json()["entries"]
+    except Exception as e:
+        log.debug(f"Could not fetch file sizes of record {record_id}: {e}")
+        return
+    size = sum(entry.get("size", 0) for entry in entries)
+    cache_folder = appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser")
+    return Estimate(
+        disk=size * rate("download", "disk_per_byte", "disk", "bytes"),
+        memory=0,
+        seconds=size * rate("download", "seconds_per_byte", "seconds", "bytes"),
+        disk_free=free_disk(cache_folder),
+        memory_free=available_memory(),
+    )
+
+
+def package_size(package) -> int:
+    """Return the size in bytes of the data resources of a datapackage."""
+    size = 0
+    for resource in package.resources:
+        source = resource.source
+        if isinstance(source, str) and os.path.exists(source):
+            size += os.path.getsize(source)
+        else:
+            size += resource.descriptor.get("bytes", 0)
+    return size
+
+
+def estimate_unfold(package, n_scenarios: int, superstructure: bool) -> Estimate:
+    """Estimate the resources to unfold `n_scenarios` scenarios of `package` in the current project.
+
+    Superstructure runs have their own history, their cost grows with the number of scenarios
+    but much slower than writing a database per scenario.
+    """
+    import bw2data as bd
+    kind, per = ("superstructure", "scenarios") if superstructure else ("unfold", "databases")
+    disk = n_scenarios * rate(kind, "disk_per_scenario", "disk", per)
+    if superstructure:
+        # the scenario difference file is about as large as the scenario data of the package
+        disk = max(disk, package_size(package))
+    return Estimate(
+        disk=disk,
+        memory=max(MIN_UNFOLD_MEMORY, n_scenarios * rate(kind, "memory_per_scenario", "memory", per)),
+        seconds=n_scenarios * rate(kind, "seconds_per_scenario", "seconds", per),
+        disk_free=free_disk(bd.projects.dir),
+        memory_free=available_memory(),
+    )
+
+
+@contextmanager
+def measure_run(kind: str, path: str, **measures):
+    """Measure the time, disk use (on the volume of `path`) and memory increase of the `with` block.
+
+    The measurements are only recorded when the block finishes without an exception.
+    """
+    start, disk_start = time.time(), free_disk(path)
+    sampler = MemorySampler()
+    sampler.start()
+    try:
+        yield
+    finally:
+        memory = sampler.increase()
+    record_run(
+        kind,
+        seconds=time.time() - start,
+        disk=max(disk_start - free_disk(path), 0),
+        memory=memory,
+        **measures
+    )
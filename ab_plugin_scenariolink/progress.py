@@ -0,0 +1,180 @@
+"""
+Progress reporting for the ScenarioLink plugin.
+This module tracks the progress of the stages of a job (downloading, verifying, repacking, unfolding, writing)
+with their throughput and remaining time, and publishes it through `signals`.
+
+Jobs run in the GUI thread, so publishing also processes pending GUI events. This is throttled to
+`UPDATE_INTERVAL`, which keeps the overhead of `advance` low when it is called for every block of data,
+and lets the user cancel the job: the next `advance` then raises `Cancelled`.
+Outside a job nothing is published, so code that reports progress also runs without the GUI.
+"""
+
+from contextlib import contextmanager
+import time
+from typing import Optional
+from logging import getLogger
+
+log = getLogger(__name__)
+
+# minimum number of seconds between two published updates
+UPDATE_INTERVAL = 0.25
+# weight of the latest measurement in the smoothed throughput
+SMOOTHING = 0.3
+
+
+class Cancelled(Exception):
+    """The user cancelled the job."""
+
+
+class Progress:
+    """Progress of a job, one stage at a time."""
+
+    def __init__(self):
+        self.cancelled = False
+        self.depth = 0  # the number of nested `job` blocks
+        self.stage = None
+        self.unit = None
+        self.total = None
+        self.done = 0
+        self._start = self._last_time = self._last_publish = 0.0
+        self._last_done = 0
+        self.rate = None  # smoothed throughput in units per second
+        self.forward = None  # in a worker process, sends the state to the parent process instead of publishing it
+
+    @contextmanager
+    def job(self):
+        """Track a job for the duration of the `with` block, jobs started inside it are part of it."""
+        if self.depth == 0:
+            self.cancelled = False
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.finish()
+
+    @property
+    def active(self) -> bool:
+        return self.depth > 0
+
+    def start(self, stage: str, total: Optional[float] = None, unit: str = "") -> None:
+        """Start the next stage, `total` is None if the amount of work is unknown."""
+        log.info(f"{stage}...")
+        self.stage, self.total, self.unit, self.done = stage, total, unit, 0
+        self._start = self._last_time = time.monotonic()
+        self._last_done, self.rate = 0, None
+        self.publish(force=True)
+
+    def advance(self, amount: float = 1) -> None:
+        """Add `amount` of work done in the current stage, raises `Cancelled` if the user cancelled."""
+        self.done += amount
+        now = time.monotonic()
+        if now - self._last_publish >= UPDATE_INTERVAL:
+            elapsed = now - self._last_time
+            if elapsed > 0:
+                rate = (self.done - self._last_done) / elapsed
+                self.rate = rate if self.rate is None else SMOOTHING * rate + (1 - SMOOTHING) * self.rate
+                self._last_time, self._last_done = now, self.done
+            self.publish()
+        if self.cancelled:
+            raise Cancelled(f"Cancelled during {self.stage}")
+
+    def check(self) -> None:
+        """Raise `Cancelled` if the user cancelled, for stages without measurable work."""
+        self.publish()
+        if self.cancelled:
+            raise Cancelled(f"Cancelled during {self.stage}")
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Seconds until the current stage is done, None if unknown."""
+        if not self.total or not self.rate:
+            return
+        return max(self.total - self.done, 0) / self.rate
+
+    def state(self) -> dict:
+        return {
+            "stage": self.stage,
+            "unit": self.unit,
+            "done": self.done,
+            "total": self.total,
+            "rate": self.rate,
+            "eta": self.eta,
+            "elapsed": time.monotonic() - self._start,
+        }
+
+    def follow(self, state: dict) -> None:
+        """Publish the `state` of a stage that runs in a worker process, see `forward`."""
+        if state["stage"] != self.stage:
+            self.start(state["stage"], state["total"], state["unit"])
+        self.done, self.rate = state["done"], state["rate"]
+        self.publish()
+
+    def publish(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_publish < UPDATE_INTERVAL:
+            return
+        self._last_publish = now
+        if self.forward is not None:
+            self.forward(self.state())
+            return
+        if not self.active:
+            # nothing shows the progress outside a job, e.g. in scripts and the command line cache audit
+            return
+        from .signals import signals
+        signals.progress_updated.emit(self.state())
+        _process_events()
+
+    def finish(self) -> None:
+        from .signals import signals
+        # a cancel only stops the job it was asked for
+        self.stage, self.cancelled = None, False
+        signals.progress_finished.emit()
+
+    def cancel(self) -> None:
+        if self.active:
+            log.info(f"Cancelling {self.stage}")
+            self.cancelled = True
+
+
+def _process_events() -> None:
+    from PySide2.QtCore import QCoreApplication
+    if QCoreApplication.instance() is not None:
+        QCoreApplication.processEvents()
+
+
+def format_amount(amount: float, unit: str) -> str:
+    if unit == "B":
+        for prefix in ("", "K", "M", "G"):
+            if abs(amount) < 1024 or prefix == "G":
+                return f"{amount:.1f} {prefix}B" if prefix else f"{amount:.0f} B"
+            amount /= 1024
+    return f"{amount:,.0f} {unit}".strip()
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+def describe(state: dict) -> str:
+    """Return a one line description of a progress state, e.g. '1.2 GB of 3.4 GB, 25.0 MB/s, 1 min left'."""
+    parts = []
+    if state["total"]:
+        parts.append(f"{format_amount(state['done'], state['unit'])} of {format_amount(state['total'], state['unit'])}")
+    elif state["done"]:
+        parts.append(format_amount(state["done"], state["unit"]))
+    if state["rate"]:
+        parts.append(f"{format_amount(state['rate'], state['unit'])}/s")
+    if state["eta"] is not None:
+        parts.append(f"{format_seconds(state['eta'])} left")
+    else:
+        parts.append(f"{format_seconds(state['elapsed'])} elapsed")
+    return ", ".join(parts)
+
+
+progress = Progress()
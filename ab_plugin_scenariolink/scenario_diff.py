@@ -0,0 +1,189 @@
+"""
+Scenario difference previews for the ScenarioLink plugin.
+This module reads the scenario data of a datapackage column by column, to show what scenarios change
+without unfolding any database.
+"""
+
+import csv
+from typing import List, Set, Tuple
+from logging import getLogger
+
+import numpy as np
+import pandas as pd
+
+log = getLogger(__name__)
+
+# columns describing an exchange in the `scenario_data` resource of a datapackage
+FLOW_COLUMNS = [
+    "from activity name",
+    "from reference product",
+    "from location",
+    "to activity name",
+    "to reference product",
+    "to location",
+    "flow type",
+]
+# the view listing the exchanges of datasets the package adds, with their amounts
+ADDED_VIEW = "Added exchanges"
+# the ways changes can be aggregated, {label: column}
+GROUPINGS = {
+    "Consumer activity": "to activity name",
+    "Consumer product": "to reference product",
+    "Supplier activity": "from activity name",
+    "Flow type": "flow type",
+}
+
+
+class ScenarioDiff:
+    """
+    Lazy, column-wise reader of the scenario data of a datapackage.
+
+    The scenario data holds a scaling factor per exchange and scenario (1 means unchanged). Exchanges that
+    are not in the source database, those of and with the datasets the package adds, hold the amount
+    instead: they are listed separately (see `added`) and left out of the relative changes.
+    The flow description columns are read once, scenario columns are only read when first requested,
+    so previewing a few scenarios of a large package only parses those columns.
+    """
+
+    def __init__(self, package):
+        self.path = package.get_resource("scenario_data").source.replace("\\", "/")
+        inventories = package.get_resource("inventories")
+        self.inventories_path = inventories.source.replace("\\", "/") if inventories else None
+        self.scenarios = [s["name"] for s in package.descriptor["scenarios"]]
+        self._flows = None
+        self._added = None
+        self._values = {}
+
+    @property
+    def flows(self) -> pd.DataFrame:
+        if self._flows is None:
+            flows = pd.read_csv(self.path, usecols=FLOW_COLUMNS, encoding="utf-8-sig",
+                                keep_default_na=False, na_values="", dtype=str)
+            self._flows = flows.astype("category")
+        return self._flows
+
+    @property
+    def added(self) -> np.ndarray:
+        """Return a boolean per flow, True for the exchanges of or with a dataset the package adds.
+
+        Their values are amounts, not factors. Exchanges the scenarios add between datasets of the source
+        database can't be told apart without the source database, they show as relative changes.
+        """
+        if self._added is None:
+            datasets = _added_datasets(self.inventories_path) if self.inventories_path else set()
+            flows = self.flows.astype(object).where(self.flows.notna(), None)
+            self._added = np.array([
+                (supplier in datasets) or (consumer in datasets) for supplier, consumer in zip(
+                    zip(flows["from activity name"], flows["from reference product"], flows["from location"]),
+                    zip(flows["to activity name"], flows["to reference product"], flows["to location"]))
+            ], dtype=bool)
+        return self._added
+
+    def values(self, scenarios: List[str]) -> np.ndarray:
+        """Return the (flows x scenarios) values of `scenarios`, reading the columns not read before.
+
+        Cells that are not numbers are read as missing values.
+        """
+        missing = [s for s in scenarios if s not in self._values]
+        if missing:
+            read = pd.read_csv(self.path, usecols=missing, encoding="utf-8-sig", dtype=str)
+            for scenario in missing:
+                values = pd.to_numeric(read[scenario], errors="coerce")
+                invalid = int((values.isna() & read[scenario].notna()).sum())
+                if invalid:
+                    log.warning(f"Ignoring {invalid} value(s) of scenario {scenario} that are not numbers")
+                self._values[scenario] = values.to_numpy(dtype=np.float32)
+        return np.column_stack([self._values[s] for s in scenarios])
+
+    def deltas(self, scenarios: List[str]) -> np.ndarray:
+        """Return the relative changes (factor - 1) of `scenarios`.
+
+        Missing values count as no change, as do the added exchanges (see `added`), they have no factor.
+        """
+        deltas = np.nan_to_num(self.values(scenarios).astype(np.float64) - 1.0, nan=0.0)
+        deltas[self.added] = 0.0
+        return deltas
+
+    def top_changes(self, scenarios: List[str], page: int = 0, page_size: int = 50) -> pd.DataFrame:
+        """Return one page of the exchanges that change most in any of `scenarios`, largest first."""
+        if not scenarios:
+            return pd.DataFrame(columns=FLOW_COLUMNS)
+        deltas = self.deltas(scenarios)
+        magnitude = np.abs(deltas).max(axis=1)
+        end = min((page + 1) * page_size, len(magnitude))
+        start = min(page * page_size, end)
+        # only sort the part of the array that is needed up to this page
+        top = np.argpartition(-magnitude, end - 1)[:end] if end < len(magnitude) else np.arange(end)
+        top = top[np.argsort(-magnitude[top], kind="stable")][start:end]
+
+        page_df = self.flows.iloc[top].astype(object).fillna("").reset_index(drop=True)
+        for i, scenario in enumerate(scenarios):
+            page_df[f"{scenario} (%)"] = np.round(deltas[top, i] * 100, 2)
+        return page_df
+
+    def added_exchanges(self, scenarios: List[str], page: int = 0, page_size: int = 50) -> pd.DataFrame:
+        """Return one page of the added exchanges (see `added`) with their amounts in `scenarios`, largest first."""
+        if not scenarios:
+            return pd.DataFrame(columns=FLOW_COLUMNS)
+        rows = np.flatnonzero(self.added)
+        amounts = self.values(scenarios)[rows].astype(np.float64)
+        magnitude = np.nan_to_num(np.abs(amounts), nan=0.0).max(axis=1)
+        top = np.argsort(-magnitude, kind="stable")[page * page_size:(page + 1) * page_size]
+
+        page_df = self.flows.iloc[rows[top]].astype(object).fillna("").reset_index(drop=True)
+        for i, scenario in enumerate(scenarios):
+            page_df[f"{scenario} (amount)"] = amounts[top, i]
+        return page_df
+
+    def n_added(self) -> int:
+        """Return the number of added exchanges (see `added`)."""
+        return int(np.count_nonzero(self.added))
+
+    def n_changed(self, scenarios: List[str]) -> int:
+        """Return the number of exchanges that change in any of `scenarios`."""
+        if not scenarios:
+            return 0
+        return int(np.count_nonzero(np.abs(self.deltas(scenarios)).max(axis=1)))
+
+    def aggregate(self, scenarios: List[str], by: str) -> pd.DataFrame:
+        """Return the number of changed exchanges and mean relative change per group of column `by`."""
+        if not scenarios:
+            return pd.DataFrame(columns=[by])
+        deltas = self.deltas(scenarios)
+        groups = self.flows[by].cat.codes.to_numpy()
+        groups = np.where(groups < 0, len(self.flows[by].cat.categories), groups)  # missing values group
+        n_groups = len(self.flows[by].cat.categories) + 1
+
+        changed = np.abs(deltas).max(axis=1) != 0
+        dataframe = pd.DataFrame({
+            by: list(self.flows[by].cat.categories) + ["(none)"],
+            "changed exchanges": np.bincount(groups, weights=changed, minlength=n_groups).astype(int),
+        })
+        counts = np.bincount(groups, minlength=n_groups)
+        for i, scenario in enumerate(scenarios):
+            sums = np.bincount(groups, weights=deltas[:, i], minlength=n_groups)
+            dataframe[f"{scenario} (mean %)"] = np.round(
+                np.divide(sums, counts, out=np.zeros(n_groups), where=counts > 0) * 100, 2)
+        dataframe = dataframe[dataframe["changed exchanges"] > 0]
+        return dataframe.sort_values("changed exchanges", ascending=False).reset_index(drop=True)
+
+
+def _added_datasets(path: str) -> Set[Tuple[str, str, str]]:
+    """Return the (name, reference product, location) of the datasets in the `inventories` resource at `path`.
+
+    The resource is a brightway CSV export: an 'Activity' row with the name, followed by rows
+    with one field each, among them 'reference product' and 'location'.
+    """
+    datasets, current = set(), None
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.reader(f):
+            if len(row) >= 2 and row[0] == "Activity":
+                current = {"name": row[1]}
+            elif current is not None and len(row) >= 2 and row[0] in ("reference product", "location"):
+                current[row[0]] = row[1]
+            elif current is not None and not any(row):
+                datasets.add((current["name"], current.get("reference product"), current.get("location")))
+                current = None
+    if current is not None:
+        datasets.add((current["name"], current.get("reference product"), current.get("location")))
+    return datasets
@@ -0,0 +1,205 @@
+"""
+Compact scenario storage for the ScenarioLink plugin.
+This module stores the scenario exchange values of a superstructure database as sparse arrays,
+so that additional scenarios do not require a full copy of the database.
+"""
+
+from ast import literal_eval
+import os
+import tempfile
+from typing import List, Optional
+from logging import getLogger
+
+import numpy as np
+import pandas as pd
+
+from .bulk_write import BulkWriteUnfold
+
+log = getLogger(__name__)
+
+# bumped when the layout of a saved store changes
+STORE_FORMAT = 2
+
+# columns of a scenario difference file (SDF) that describe the exchange, in the order Activity Browser expects
+FLOW_COLUMNS = [
+    "from activity name",
+    "from reference product",
+    "from location",
+    "from categories",
+    "from database",
+    "from key",
+    "to activity name",
+    "to reference product",
+    "to location",
+    "to categories",
+    "to database",
+    "to key",
+    "flow type",
+]
+
+
+def _flow_text(value) -> str:
+    """Return the text stored for a flow description, empty for a missing value (None, NaN or pd.NA)."""
+    if isinstance(value, (tuple, list)):
+        return str(tuple(value))
+    return "" if pd.isna(value) else str(value)
+
+
+class ScenarioDeltaStore:
+    """
+    Sparse, array-backed store of the scenario values of a superstructure database.
+
+    Every exchange that changes in any scenario is a 'flow'. The values of the first scenario are kept as a
+    dense `base` vector and every scenario is stored as a CSR matrix of its values that differ from `base`, so
+    scenarios that only change a few exchanges cost a few bytes per changed exchange. A flow is missing (NaN)
+    in the scenarios that don't have it, a missing value and a number always differ.
+    The flow descriptions are stored as categorical codes.
+    """
+
+    def __init__(self, flows: pd.DataFrame, scenarios: List[str], base: np.ndarray,
+                 data: np.ndarray, indices: np.ndarray, indptr: np.ndarray):
+        self.flows = flows
+        self.scenarios = list(scenarios)
+        self.base = base
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    @classmethod
+    def from_dataframe(cls, dataframe: pd.DataFrame, scenarios: List[str]) -> "ScenarioDeltaStore":
+        """Build a store from a scenario difference dataframe with one column per scenario in `scenarios`."""
+        flows = dataframe[FLOW_COLUMNS].reset_index(drop=True)
+        values = dataframe[scenarios].to_numpy(dtype=np.float64, na_value=np.nan)
+        base = values[:, 0].copy()
+
+        data, indices, indptr = [], [], [0]
+        for column in range(values.shape[1]):
+            # the values themselves, not their difference to `base`: NaN - number would lose the number
+            changed = np.flatnonzero((values[:, column] != base) & ~(np.isnan(values[:, column]) & np.isnan(base)))
+            indices.append(changed)
+            data.append(values[changed, column])
+            indptr.append(indptr[-1] + len(changed))
+
+        return cls(
+            flows=flows,
+            scenarios=scenarios,
+            base=base,
+            data=np.concatenate(data) if data else np.empty(0),
+            indices=np.concatenate(indices).astype(np.int32) if indices else np.empty(0, dtype=np.int32),
+            indptr=np.array(indptr, dtype=np.int64),
+        )
+
+    def scenario_values(self, scenario: [int, str]) -> np.ndarray:
+        """Return the dense vector of flow values for one scenario (by index or name)."""
+        if isinstance(scenario, str):
+            scenario = self.scenarios.index(scenario)
+        start, end = self.indptr[scenario], self.indptr[scenario + 1]
+        values = self.base.copy()
+        values[self.indices[start:end]] = self.data[start:end]
+        return values
+
+    def scenario_changes(self, scenario: [int, str]) -> tuple:
+        """Return the (flow indices, values) of the flows of one scenario (by index or name) that differ from base."""
+        if isinstance(scenario, str):
+            scenario = self.scenarios.index(scenario)
+        start, end = self.indptr[scenario], self.indptr[scenario + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def to_dataframe(self, scenarios: Optional[list] = None) -> pd.DataFrame:
+        """Return the scenario difference dataframe (SDF) for `scenarios` (default: all).
+
+        The result can be exported and loaded as a scenario file in the Activity Browser calculation setup.
+        """
+        scenarios = scenarios if scenarios is not None else self.scenarios
+        dataframe = self.flows.copy()
+        for scenario in scenarios:
+            dataframe[scenario] = self.scenario_values(scenario)
+        return dataframe
+
+    def export_sdf(self, path: str, scenarios: Optional[list] = None) -> None:
+        """Write the scenario difference file for `scenarios` (default: all) to `path`."""
+        self.to_dataframe(scenarios).to_csv(path, index=False, encoding="utf-8-sig")
+        log.info(f"Scenario difference file exported to {path}")
+
+    def save(self, path: str) -> None:
+        """Save the store as a compressed `.npz` file."""
+        arrays = {
+            "format": np.array(STORE_FORMAT),
+            "scenarios": np.array(self.scenarios, dtype=str),
+            "base": self.base,
+            "data": self.data,
+            "indices": self.indices,
+            "indptr": self.indptr,
+        }
+        for i, column in enumerate(FLOW_COLUMNS):
+            # keys and categories are tuples, store their text representation
+            values = self.flows[column].map(_flow_text)
+            codes, categories = pd.factorize(values)
+            arrays[f"flow_{i}_codes"] = codes.astype(np.int32)
+            arrays[f"flow_{i}_categories"] = np.array(categories, dtype=str)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "ScenarioDeltaStore":
+        """Load a store saved with `save`."""
+        with np.load(path) as arrays:
+            flows = {}
+            for i, column in enumerate(FLOW_COLUMNS):
+                categories = arrays[f"flow_{i}_categories"]
+                values = pd.Series(categories[arrays[f"flow_{i}_codes"]], dtype=object)
+                if column in ("from key", "to key", "from categories", "to categories"):
+                    values = values.map(lambda x: literal_eval(x) if x else None)
+                else:
+                    values = values.map(lambda x: x if x else None)
+                flows[column] = values
+            base, data, indices = arrays["base"], arrays["data"], arrays["indices"]
+            if "format" not in arrays:
+                # the first stores held the differences to base
+                data = data + base[indices]
+            return cls(
+                flows=pd.DataFrame(flows),
+                scenarios=arrays["scenarios"].tolist(),
+                base=base,
+                data=data,
+                indices=indices,
+                indptr=arrays["indptr"],
+            )
+
+
+class DeltaStoreUnfold(BulkWriteUnfold):
+    """
+    `Unfold` that keeps the scenario values of a superstructure in a `ScenarioDeltaStore`
+    instead of exporting a scenario difference file.
+    """
+
+    delta_store = None
+
+    def write(self, superstructure: bool = False, export_dir: str = None):
+        if not superstructure:
+            return super().write(superstructure=superstructure, export_dir=export_dir)
+
+        self.delta_store = ScenarioDeltaStore.from_dataframe(
+            self.scenario_df, [s["name"] for s in self.scenarios]
+        )
+        # write the superstructure database, the (now empty) SDF goes to a throwaway folder
+        self.scenario_df = self.scenario_df.iloc[:0]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            super().write(superstructure=True, export_dir=tmp_dir)
+
+
+def delta_store_path(database: str) -> str:
+    """Return the path of the scenario store of `database` in the current brightway project."""
+    import bw2data as bd
+    folder = bd.projects.request_directory("scenariolink")
+    return os.path.join(folder, f"{database}.npz")
+
+
+def load_delta_store(database: str) -> [ScenarioDeltaStore, None]:
+    """Return the scenario store of `database` in the current project, None if there is none."""
+    path = delta_store_path(database)
+    if not os.path.exists(path):
+        return
+    return ScenarioDeltaStore.load(path)
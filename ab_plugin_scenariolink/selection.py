@@ -0,0 +1,161 @@
+"""
+Rule-based scenario selection for the ScenarioLink plugin.
+This module selects scenarios of a datapackage by their parsed attributes (see `descriptor`),
+e.g. `pathway=SSP2* year=2030-2050`, and stores named selections as presets for later or headless imports.
+
+A rule is a space separated list of `column=values` conditions that must all match. Values are separated
+by commas and may use `*` and `?` wildcards (case insensitive), years also accept ranges like `2030-2050`.
+A rule starting with `-` deselects the scenarios it matches instead.
+"""
+
+from fnmatch import fnmatch
+import json
+import os
+from typing import Dict, List, Optional
+from logging import getLogger
+
+import appdirs
+import numpy as np
+import pandas as pd
+
+from .descriptor import parse_scenarios
+
+log = getLogger(__name__)
+
+
+def parse_rule(text: str) -> dict:
+    """Parse a rule into {"exclude": bool, "conditions": {column: [value, ...]}}."""
+    text = text.strip()
+    exclude = text.startswith("-")
+    if exclude:
+        text = text[1:].strip()
+    conditions = {}
+    for token in text.split():
+        column, sep, values = token.partition("=")
+        if not sep or not column or not values:
+            raise ValueError(f"Invalid condition '{token}', expected 'column=value'")
+        conditions.setdefault(column.lower(), []).extend(v for v in values.split(",") if v)
+    if not conditions:
+        raise ValueError(f"Rule '{text}' has no conditions")
+    return {"exclude": exclude, "conditions": conditions}
+
+
+def _year_mask(years: pd.Series, values: List[str]) -> np.ndarray:
+    years = years.to_numpy(dtype=float, na_value=np.nan)
+    mask = np.zeros(len(years), dtype=bool)
+    for value in values:
+        start, sep, end = value.partition("-")
+        try:
+            start = float(start) if start else -np.inf
+            end = (float(end) if end else np.inf) if sep else start
+        except ValueError:
+            raise ValueError(f"Invalid year '{value}', expected a year or a range like 2030-2050")
+        # comparisons with missing years are False
+        mask |= (years >= start) & (years <= end)
+    return mask
+
+
+def _pattern_mask(column: pd.Series, values: List[str]) -> np.ndarray:
+    # match the patterns against the distinct values only, then map back to the rows
+    categories = column.astype("category")
+    matching = [i for i, category in enumerate(categories.cat.categories)
+                if any(fnmatch(str(category).lower(), value.lower()) for value in values)]
+    return np.isin(categories.cat.codes.to_numpy(), matching)
+
+
+def rule_mask(scenarios: pd.DataFrame, rule: dict) -> np.ndarray:
+    """Return the boolean mask of the rows of `scenarios` (see `descriptor.parse_scenarios`) matching `rule`."""
+    mask = np.ones(len(scenarios), dtype=bool)
+    for column, values in rule["conditions"].items():
+        if column not in scenarios:
+            raise ValueError(f"Unknown column '{column}', use one of {', '.join(scenarios.columns)}")
+        if column == "year":
+            mask &= _year_mask(scenarios[column], values)
+        else:
+            mask &= _pattern_mask(scenarios[column], values)
+    return mask
+
+
+def apply_rules(scenarios: pd.DataFrame, rules: List[str], include: Optional[list] = None) -> List[bool]:
+    """Apply `rules` in order on top of the selection `include` (default nothing selected).
+
+    Returns the new selection, with a bool per scenario.
+    """
+    selected = np.zeros(len(scenarios), dtype=bool) if include is None else np.array(include, dtype=bool)
+    for text in rules:
+        rule = parse_rule(text)
+        mask = rule_mask(scenarios, rule)
+        selected = selected & ~mask if rule["exclude"] else selected | mask
+    return selected.tolist()
+
+
+def presets_path() -> str:
+    return os.path.join(appdirs.user_data_dir("ActivityBrowser", "ActivityBrowser"), "scenariolink_presets.json")
+
+
+def load_presets() -> Dict[str, List[str]]:
+    """Return the saved presets as {name: [rule, ...]}."""
+    try:
+        with open(presets_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        log.warning(f"Could not read selection presets {presets_path()}: {e}")
+        return {}
+
+
+def _write_presets(presets: Dict[str, List[str]]) -> None:
+    os.makedirs(os.path.dirname(presets_path()), exist_ok=True)
+    with open(presets_path() + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(presets, f, indent=1)
+    os.replace(presets_path() + ".tmp", presets_path())
+
+
+def save_preset(name: str, rules: List[str]) -> None:
+    """Save `rules` as preset `name`, replacing a preset with the same name."""
+    for rule in rules:
+        parse_rule(rule)  # refuse invalid rules before they are stored
+    presets = load_presets()
+    presets[name] = list(rules)
+    _write_presets(presets)
+
+
+def delete_preset(name: str) -> None:
+    presets = load_presets()
+    if presets.pop(name, None) is not None:
+        _write_presets(presets)
+
+
+def preset_scenarios(package, preset: str) -> List[int]:
+    """Return the indices of the scenarios of `package` selected by the saved `preset`."""
+    presets = load_presets()
+    if preset not in presets:
+        raise KeyError(f"No selection preset named '{preset}'")
+    selected = apply_rules(parse_scenarios(package.descriptor["scenarios"]), presets[preset])
+    return [i for i, state in enumerate(selected) if state]
+
+
+def batch_unfold(file: str, preset: str, dependencies: dict, superstructure: bool = False,
+                 superstructure_db_name: Optional[str] = None, superstructure_sdf_location: Optional[str] = None,
+                 **kwargs) -> None:
+    """
+    Unfold the scenarios selected by a saved preset, without the user interface.
+
+    Parameters:
+        file (str): Either a path or a recordID of a cached record.
+        preset (str): The name of a saved selection preset.
+        dependencies (dict): {datapackage dependency name: database in the current project}.
+        superstructure, superstructure_db_name, superstructure_sdf_location, kwargs: As for `unfold_databases`.
+    """
+    from datapackage import Package
+    from .utils import package_filepath, unfold_databases
+
+    filepath = package_filepath(file)
+    scenarios = preset_scenarios(Package(filepath), preset)
+    if not scenarios:
+        log.warning(f"Preset '{preset}' selects no scenarios of {filepath}")
+        return
+    log.info(f"Preset '{preset}' selects {len(scenarios)} scenario(s)")
+    unfold_databases(filepath, scenarios, dependencies, superstructure, superstructure_db_name,
+                     superstructure_sdf_location, **kwargs)
@@ -5,9 +5,12 @@ class Signals(QObject):
     get_datapackage_from_disk = Signal(str)  # Get a datapackage from disk (sends path)
     record_ready = Signal(bool)  # datapackage extraction is complete and scenarios table should be shown
 
-    generate_db = Signal(list, dict, bool, object, object)  # Generate database from selected scenario data
+    generate_db = Signal(list, dict, bool, object, object, bool, dict, int, bool)  # Generate database from selected scenario data
 
     no_or_1_scenario_selected = Signal(bool)  # True when no or one scenarios are selected
     no_scenario_selected = Signal(bool)  # True when no scenario is selected
 
+    progress_updated = Signal(object)  # dict with the stage, done, total, rate and eta of the running job
+    progress_finished = Signal()  # the running job finished, was cancelled or failed
+
 signals = Signals()
@@ -0,0 +1,282 @@
+"""
+Database snapshots for the ScenarioLink plugin.
+This module exports unfolded databases into a compressed snapshot file and imports them into another project,
+so the same scenario databases don't have to be unfolded again.
+"""
+
+from datetime import datetime
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import zipfile
+from typing import List, Optional
+from logging import getLogger
+
+import appdirs
+import bw2data
+
+from .bulk_write import bulk_write_mode, ACTIVITY_SQL, EXCHANGE_SQL, BATCH_SIZE
+from .mirrors import package_checksum
+from .progress import progress
+from .scenario_store import delta_store_path
+
+log = getLogger(__name__)
+
+# version of the snapshot layout, snapshots of other versions are not imported
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXTENSION = ".slsnap"
+MANIFEST = "manifest.json"
+
+ACTIVITY_COLUMNS = '"data", "code", "database", "location", "name", "product", "type"'
+EXCHANGE_COLUMNS = '"data", "input_code", "input_database", "output_code", "output_database", "type"'
+
+
+def snapshot_folder() -> str:
+    """Return the folder in which snapshots are looked up before unfolding."""
+    folder = os.path.join(appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser"), "snapshots")
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+
+class DependencyMismatch(ValueError):
+    """The dependency databases of a snapshot are missing or differ in the current project."""
+
+    def __init__(self, message: str, dependencies: List[str]):
+        super().__init__(message)
+        self.dependencies = dependencies  # the names of the databases in the snapshot
+
+
+def unfold_fingerprint(filepath: str, package, scenarios: Optional[list], dependencies: dict,
+                       superstructure: bool) -> dict:
+    """Return what determines the result of unfolding `package` in the current project.
+
+    Two unfolds with the same fingerprint produce the same databases: the same datapackage and scenarios,
+    dependency databases with the same activities and the same version of unfold.
+    """
+    from unfold import __version__ as unfold_version
+    from .fanout import dependencies_fingerprint
+
+    names = [s["name"] for s in package.descriptor["scenarios"]]
+    scenarios = list(range(len(names))) if not scenarios else scenarios
+    fingerprint = {
+        "source": package_checksum(filepath),
+        "scenarios": [names[i] for i in scenarios],
+        "superstructure": superstructure,
+        "dependencies": dependencies_fingerprint(dependencies),
+        "unfold": ".".join(map(str, unfold_version)),
+    }
+    # normalize tuples to lists, so fingerprints compare equal to those read from a manifest
+    return json.loads(json.dumps(fingerprint))
+
+
+def fingerprint_id(fingerprint: dict) -> str:
+    return hashlib.md5(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def read_manifest(path: str) -> Optional[dict]:
+    """Return the manifest of the snapshot at `path`, None if it is not a readable snapshot."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            manifest = json.loads(archive.read(MANIFEST).decode("utf-8"))
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+        log.debug(f"Could not read snapshot {path}: {e}")
+        return
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        log.debug(f"Snapshot {path} has version {manifest.get('version')}, expected {SNAPSHOT_VERSION}")
+        return
+    return manifest
+
+
+def linked_databases(databases: List[str]) -> List[str]:
+    """Return the databases outside `databases` that the exchanges of `databases` link to."""
+    from bw2data.backends.peewee import ExchangeDataset
+
+    query = (ExchangeDataset.select(ExchangeDataset.input_database).distinct()
+             .where(ExchangeDataset.output_database << list(databases)))
+    return sorted({database for (database,) in query.tuples()} - set(databases))
+
+
+def find_snapshot(fingerprint: dict, folder: Optional[str] = None) -> Optional[str]:
+    """Return the path of a snapshot in `folder` (default `snapshot_folder`) that matches `fingerprint`."""
+    folder = folder or snapshot_folder()
+    for file in sorted(os.listdir(folder)):
+        if not file.endswith(SNAPSHOT_EXTENSION):
+            continue
+        path = os.path.join(folder, file)
+        manifest = read_manifest(path)
+        if manifest is not None and manifest["fingerprint"] == fingerprint:
+            return path
+
+
+def export_snapshot(databases: List[str], path: str, fingerprint: Optional[dict] = None) -> str:
+    """
+    Export `databases` of the current project into a compressed snapshot file.
+
+    The activity and exchange rows are copied as stored by brightway, the processed arrays are not,
+    as they refer to the integer ids of the project and are rebuilt on import.
+
+    Parameters:
+        databases (list): The databases to export.
+        path (str): The snapshot file to write.
+        fingerprint (dict, optional): The `unfold_fingerprint` of the unfold that created the databases.
+            Without it, the fingerprint records the databases the exported databases link to, and
+            the snapshot is only imported explicitly (see `import_snapshot`).
+
+    Returns:
+        str: The path of the snapshot.
+    """
+    from .fanout import dependencies_fingerprint
+
+    missing = [db for db in databases if db not in bw2data.databases]
+    if missing:
+        raise ValueError(f"Databases {missing} are not in project {bw2data.projects.current}")
+    if fingerprint is None:
+        linked = linked_databases(databases)
+        fingerprint = json.loads(json.dumps({"dependencies": dependencies_fingerprint({db: db for db in linked})}))
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created": datetime.now().isoformat(),
+        "project": bw2data.projects.current,
+        "fingerprint": fingerprint,
+        "databases": {},
+    }
+    # write next to the target and rename, so an interrupted export never leaves a valid looking snapshot
+    partial = path + ".partial"
+    progress.start(f"Exporting {len(databases)} database(s)", len(databases), "databases")
+    try:
+        _write_snapshot(partial, databases, manifest)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, path)
+    return path
+
+
+def _write_snapshot(partial: str, databases: List[str], manifest: dict) -> None:
+    from bw2data.backends.peewee import sqlite3_lci_db
+
+    cursor = sqlite3_lci_db.db.cursor()
+    with zipfile.ZipFile(partial, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for i, database in enumerate(databases):
+            activities = cursor.execute(f"SELECT {ACTIVITY_COLUMNS} FROM activitydataset WHERE database = ?",
+                                        (database,)).fetchall()
+            exchanges = cursor.execute(f"SELECT {EXCHANGE_COLUMNS} FROM exchangedataset WHERE output_database = ?",
+                                       (database,)).fetchall()
+            archive.writestr(f"{i}/activities.pickle", pickle.dumps(activities, protocol=pickle.HIGHEST_PROTOCOL))
+            archive.writestr(f"{i}/exchanges.pickle", pickle.dumps(exchanges, protocol=pickle.HIGHEST_PROTOCOL))
+            store = delta_store_path(database)
+            if os.path.exists(store):
+                archive.write(store, f"{i}/scenarios.npz")
+            metadata = {k: v for k, v in bw2data.databases[database].items() if k not in ("processed", "modified")}
+            manifest["databases"][database] = {"folder": str(i), "metadata": metadata,
+                                               "activities": len(activities), "exchanges": len(exchanges)}
+            log.info(f"Exported {len(activities)} activities of {database}")
+            progress.advance()
+        archive.writestr(MANIFEST, json.dumps(manifest, indent=1, default=str))
+
+
+def _insert_rows(cursor, sql: str, rows: list) -> None:
+    for start in range(0, len(rows), BATCH_SIZE):
+        cursor.executemany(sql, rows[start:start + BATCH_SIZE])
+
+
+def check_dependencies_of(path: str, fingerprint: Optional[dict], remap: dict) -> None:
+    """Raise `DependencyMismatch` if the dependency databases of the snapshot at `path` are not in the
+    current project with the same activities, after replacing the databases in `remap`."""
+    from .fanout import dependencies_fingerprint
+
+    if not fingerprint or "dependencies" not in fingerprint:
+        raise DependencyMismatch(f"Snapshot {path} does not record its dependency databases, export it again", [])
+    differ = []
+    for name, source, checksum in fingerprint["dependencies"]:
+        target = remap.get(source, source)
+        if target not in bw2data.databases or dependencies_fingerprint({name: target})[0][2] != checksum:
+            differ.append(source)
+    if differ:
+        raise DependencyMismatch(f"The dependency databases {differ} of snapshot {path} are missing or differ "
+                                 f"in project {bw2data.projects.current}", differ)
+
+
+def _remap_exchange(row: tuple, database: str) -> tuple:
+    """Return the exchange `row` with its input in `database`."""
+    exchange = pickle.loads(bytes(row[0]))
+    exchange["input"] = (database, exchange["input"][1])
+    return (pickle.dumps(exchange, protocol=pickle.HIGHEST_PROTOCOL), row[1], database) + tuple(row[3:])
+
+
+def import_snapshot(path: str, check_dependencies: bool = True, remap: Optional[dict] = None) -> List[str]:
+    """
+    Import the databases of the snapshot at `path` into the current project, replacing databases with
+    the same name.
+
+    Parameters:
+        path (str): The snapshot file.
+        check_dependencies (bool): Refuse the import with `DependencyMismatch` if the dependency databases
+            of the snapshot are not in the current project with the same activities.
+        remap (dict, optional): {database in the snapshot: database in the project} to link the imported
+            databases to other dependency databases, with the same activities.
+
+    Returns:
+        list: The imported databases.
+    """
+    from bw2data.backends.peewee import sqlite3_lci_db
+
+    remap = {source: target for source, target in (remap or {}).items() if source != target}
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise ValueError(f"{path} is not a ScenarioLink snapshot of version {SNAPSHOT_VERSION}")
+    if check_dependencies:
+        check_dependencies_of(path, manifest.get("fingerprint"), remap)
+
+    imported = []
+    progress.start(f"Importing {len(manifest['databases'])} database(s)", len(manifest["databases"]), "databases")
+    with zipfile.ZipFile(path) as archive, bulk_write_mode(list(manifest["databases"])):
+        for database, info in manifest["databases"].items():
+            activities = pickle.loads(archive.read(f"{info['folder']}/activities.pickle"))
+            exchanges = pickle.loads(archive.read(f"{info['folder']}/exchanges.pickle"))
+            metadata = info["metadata"]
+            if remap:
+                exchanges = [_remap_exchange(row, remap[row[2]]) if row[2] in remap else row for row in exchanges]
+                metadata = dict(metadata, depends=[remap.get(db, db) for db in metadata.get("depends", [])])
+            if database in bw2data.databases:
+                del bw2data.databases[database]
+            bw2data.Database(database).register(**metadata)
+            bw2data.databases[database]["number"] = len(activities)
+            bw2data.databases.set_modified(database)
+            bw2data.mapping.add([(row[2], row[1]) for row in activities])
+            # the location column holds tuple locations as text, take them from the activity data
+            locations = (pickle.loads(bytes(row[0])).get("location") for row in activities)
+            bw2data.geomapping.add({location for location in locations if location})
+            with sqlite3_lci_db.db.atomic():
+                cursor = sqlite3_lci_db.db.cursor()
+                _insert_rows(cursor, ACTIVITY_SQL, activities)
+                _insert_rows(cursor, EXCHANGE_SQL, exchanges)
+
+            store = f"{info['folder']}/scenarios.npz"
+            if store in archive.namelist():
+                with archive.open(store) as source, open(delta_store_path(database), "wb") as target:
+                    shutil.copyfileobj(source, target)
+            # deferred by the bulk write mode, runs when all databases are in
+            bw2data.Database(database).process()
+            imported.append(database)
+            log.info(f"Imported {len(activities)} activities of {database} from snapshot")
+            # between databases, so cancelling keeps the databases imported so far
+            progress.advance()
+    return imported
+
+
+def save_unfold_snapshot(databases: List[str], filepath: str, fingerprint: dict) -> Optional[str]:
+    """Export the databases of an unfold into `snapshot_folder`, returns None if that fails."""
+    path = os.path.join(snapshot_folder(), f"{os.path.splitext(os.path.basename(filepath))[0]}-{fingerprint_id(fingerprint)}"
+                                           f"{SNAPSHOT_EXTENSION}")
+    try:
+        return export_snapshot(databases, path, fingerprint)
+    except Exception as e:
+        log.error(f"Failed to export snapshot: {e}")
+        if os.path.exists(path + ".partial"):
+            os.remove(path + ".partial")
@@ -3,11 +3,13 @@ This module contains the models for the tables used in the ScenarioLink plugin.
 """
 
 from logging import getLogger
-from urllib.error import HTTPError, URLError
 import pandas as pd
 
 from activity_browser.ui.tables.models import PandasModel
-from ..utils import download_files_from_zenodo, package_from_path, record_cached
+from ..utils import download_files_from_zenodo, package_from_path, cached_records
+from ..catalogue import fetch_catalogue, DATE_COLUMN, RECORD_COLUMN
+from ..scenario_diff import ScenarioDiff
+from ..descriptor import parse_scenarios, scenarios_name
 from ..signals import signals
 
 log = getLogger(__name__)
@@ -26,6 +28,8 @@ class FoldsModel(PandasModel):
         super().__init__(parent=parent)
         self.selected_record = None
         self.df_columns = {}  # a dict with all column names as keys and indices as values
+        self.catalogue = None  # the typed catalogue, see `catalogue.parse_catalogue`
+        self.version = None  # the content version of the catalogue
 
         # once a datapackage is extracted, update this table too so the 'cached' column is updated if needed
         signals.record_ready.connect(self.record_ready)
@@ -34,28 +38,22 @@ class FoldsModel(PandasModel):
         """
         Fetch and synchronize the scenarios list from a remote URL.
 
-        The scenarios list is fetched from a CSV file hosted online.
-        The fetched data is then stored in a Pandas DataFrame.
+        The catalogue is updated with the rows added since it was last fetched (see `catalogue`) and
+        kept typed in `self.catalogue`, the table shows it formatted as text.
         """
-        # URL to fetch scenarios list from
-        url = "https://raw.githubusercontent.com/polca/ScenarioLink/main/ab_plugin_scenariolink/scenarios%20list/list.csv"
-
-        try:
-            # Prevent fetching a cached file
-            # Specify that all columns should be of string type
-            dataframe = pd.read_csv(url + "?nocache", header=0, sep=";", dtype=str)
-
-            cached = []
-            rec_col = dataframe.columns.tolist().index("Zenodo record ID")
-            for idx, row in dataframe.iterrows():
-                record_id = row.values.tolist()[rec_col]
-                cached.append(record_cached(record_id))
-            dataframe["downloaded"] = cached
-
-            self._dataframe = dataframe
-        except (HTTPError, URLError) as exception:
-            log.error(f"Failed to import data: {exception}")
+        catalogue, version = fetch_catalogue()
+        if self.version is not None and version > self.version:
+            log.info(f"{version - self.version} datapackage(s) added to the catalogue")
+        self.catalogue, self.version = catalogue, version
+
+        dataframe = catalogue.astype(object)
+        if DATE_COLUMN in catalogue:
+            dataframe[DATE_COLUMN] = catalogue[DATE_COLUMN].dt.strftime("%Y-%m-%d")
+        dataframe = dataframe.fillna("")
+        # one listing of the cache instead of a lookup per row
+        dataframe["downloaded"] = catalogue[RECORD_COLUMN].isin(cached_records())
 
+        self._dataframe = dataframe
         self.df_columns = {n: i for i, n in enumerate(dataframe.columns.tolist())}
         self.updated.emit()
 
@@ -85,7 +83,7 @@ class DataPackageModel(PandasModel):
         super().__init__(parent=parent)
         self.data_package = None
         self.include = None
-        self.scenario_name = None
+        self.scenarios = None  # the parsed scenarios of the datapackage, see `descriptor.parse_scenarios`
 
         self._connect_signals()
 
@@ -125,24 +123,36 @@ class DataPackageModel(PandasModel):
             if len(self.include) <= 1:
                 signals.no_or_1_scenario_selected.emit(True)
 
-        data = {"include": self.include}
-
-        for dict_ in descr:
-            for key, value in dict_.items():
-                if data.get(key, False):
-                    data[key].append(value)
-                else:
-                    data[key] = [value]
+        self.scenarios = parse_scenarios(descr)
+        dataframe = self.scenarios.astype(object).fillna("")
+        dataframe.insert(0, "include", self.include)
 
-        name = data.get("name", [False])[0]
-        if name:
-            # this only works because we know a scenario name ends in ' - YYYY', if that changes, this fails
-            self.scenario_name = name[:-7]
+        self.last_include = self.include
+        return dataframe
+
+    def set_include(self, include: list) -> None:
+        """Set which scenarios are included and update the import button and SDF checkbox states."""
+        include_count = sum(bool(state) for state in include)
+        if include_count == 0:
+            signals.no_or_1_scenario_selected.emit(True)
+            signals.no_scenario_selected.emit(True)
+        elif include_count == 1:
+            signals.no_or_1_scenario_selected.emit(True)
+            signals.no_scenario_selected.emit(False)
         else:
-            self.scenario_name = None
+            signals.no_or_1_scenario_selected.emit(False)
+            signals.no_scenario_selected.emit(False)
 
-        self.last_include = self.include
-        return pd.DataFrame(data)
+        self.include = include
+        self.sync()
+
+    @property
+    def scenario_name(self) -> [str, None]:
+        """A name for the included scenarios, e.g. 'remind - SSP2-Base', for naming a superstructure."""
+        if self.scenarios is None:
+            return
+        selected = [i for i, state in enumerate(self.include or []) if state]
+        return scenarios_name(self.scenarios, selected or None)
 
     def get_datapackage_from_record(self, dp_name: str) -> None:
         """
@@ -164,3 +174,66 @@ class DataPackageModel(PandasModel):
     def sync_with_package(self, dp):
         self.data_package = dp
         self.sync()
+
+
+class ScenarioDiffModel(PandasModel):
+    """
+    A model for the scenario difference preview table that inherits from PandasModel.
+
+    This model shows one page of the largest changes of the selected scenarios, the amounts of the
+    exchanges the package adds, or the changes aggregated by a column of the scenario data.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent=parent)
+        self.diff = None
+        self.scenarios = []
+        self.grouping = None  # None shows the largest changes, otherwise the column to aggregate by
+        self.show_added = False  # show the added exchanges instead, see `ScenarioDiff.added`
+        self.page = 0
+        self.page_size = 50
+        self.n_rows = 0  # the number of rows over all pages
+
+    def set_package(self, package) -> None:
+        """Preview the scenarios of `package`, its scenario data is only read once it is needed."""
+        self.diff = ScenarioDiff(package) if package else None
+        self.scenarios = []
+        self.page = 0
+
+    def sync(self) -> None:
+        if self.diff is None:
+            return
+        if self.show_added:
+            self.n_rows = self.diff.n_added() if self.scenarios else 0
+            dataframe = self.diff.added_exchanges(self.scenarios, self.page, self.page_size)
+        elif self.grouping is None:
+            self.n_rows = self.diff.n_changed(self.scenarios)
+            dataframe = self.diff.top_changes(self.scenarios, self.page, self.page_size)
+        else:
+            aggregated = self.diff.aggregate(self.scenarios, self.grouping)
+            self.n_rows = len(aggregated)
+            dataframe = aggregated.iloc[self.page * self.page_size:(self.page + 1) * self.page_size]
+        self._dataframe = dataframe.reset_index(drop=True)
+        self.updated.emit()
+
+    @property
+    def n_pages(self) -> int:
+        return max(1, -(-self.n_rows // self.page_size))
+
+
+class ComparisonModel(PandasModel):
+    """
+    A model for the scenario comparison table that inherits from PandasModel.
+
+    This model shows LCA scores with a row per functional unit and scenario and a column per method.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent=parent)
+        self.results = None
+
+    def sync(self) -> None:
+        if self.results is None:
+            return
+        self._dataframe = self.results.reset_index()
+        self.updated.emit()
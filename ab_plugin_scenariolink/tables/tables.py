@@ -10,7 +10,7 @@ from PySide2.QtGui import QContextMenuEvent
 from activity_browser.ui.tables.views import ABDataFrameView
 from activity_browser.ui.tables.delegates import CheckboxDelegate
 
-from .models import FoldsModel, DataPackageModel
+from .models import FoldsModel, DataPackageModel, ScenarioDiffModel, ComparisonModel
 from ..signals import signals
 
 class FoldsTable(ABDataFrameView):
@@ -144,12 +144,7 @@ class DataPackageTable(ABDataFrameView):
 
         State True represents check all scenarios
         State False represents uncheck all scenarios"""
-        self.model.include = [state for _ in self.model.include]
-        self.model.sync()
-
-        # manage the state of the import button and SDF checkbox
-        signals.no_or_1_scenario_selected.emit(not state)
-        signals.no_scenario_selected.emit(not state)
+        self.model.set_include([state for _ in self.model.include])
 
     def mousePressEvent(self, e):
         """
@@ -165,20 +160,43 @@ class DataPackageTable(ABDataFrameView):
 
                 new_includes = self.model.include[:]
                 new_includes[proxy.row()] = new_value
-                include_count = 0
-                for truthy in new_includes:
-                    if truthy:
-                        include_count += 1
-                if include_count == 0:
-                    signals.no_scenario_selected.emit(True)
-                elif include_count == 1:
-                    signals.no_or_1_scenario_selected.emit(True)
-                    signals.no_scenario_selected.emit(False)
-                else:
-                    signals.no_or_1_scenario_selected.emit(False)
-                    signals.no_scenario_selected.emit(False)
-
-                self.model.include = new_includes
-                self.model.sync()
+                self.model.set_include(new_includes)
 
         super().mousePressEvent(e)
+
+
+class ScenarioDiffTable(ABDataFrameView):
+    """
+    A table view class for previewing the changes of the selected scenarios.
+
+    Values are relative changes in % compared to the source database.
+    """
+
+    def __init__(self, parent=None):
+        """Initialize the ScenarioDiffTable."""
+        super().__init__(parent)
+
+        self.verticalHeader().setVisible(False)
+        self.setSelectionMode(QtWidgets.QTableView.SingleSelection)
+        self.setMaximumHeight(400)
+
+        self.model = ScenarioDiffModel(parent=self)
+        self.model.updated.connect(self.update_proxy_model)
+        self.model.updated.connect(self.resizeColumnsToContents)
+
+
+class ComparisonTable(ABDataFrameView):
+    """
+    A table view class for displaying the scenario comparison results.
+    """
+
+    def __init__(self, parent=None):
+        """Initialize the ComparisonTable."""
+        super().__init__(parent)
+
+        self.verticalHeader().setVisible(False)
+        self.setSelectionMode(QtWidgets.QTableView.SingleSelection)
+
+        self.model = ComparisonModel(parent=self)
+        self.model.updated.connect(self.update_proxy_model)
+        self.model.updated.connect(self.resizeColumnsToContents)
@@ -8,7 +8,7 @@ import zipfile
 import os
 import tempfile
 import requests
-from unfold import Unfold
+import bw2data
 from datapackage import Package
 import appdirs
 import pandas as pd
@@ -17,23 +17,51 @@ from importlib.metadata import version, PackageNotFoundError
 from typing import Tuple
 from tqdm import tqdm
 import hashlib
+import time
 from logging import getLogger
 
 from PySide2 import QtWidgets
 from PySide2.QtWidgets import QApplication
 from PySide2.QtCore import Qt
 
+from .bulk_write import BulkWriteUnfold
+from .scenario_store import DeltaStoreUnfold, delta_store_path
+from .journal import ImportJournal, work_folder, rollback_databases, clean_orphaned_temp_data
+from .preflight import estimate_download, measure_run, record_run, free_disk
+from .progress import progress, Cancelled
+from .cache_lock import cache_lock, record_of
+from .mirrors import zenodo_files_url, fetch_from_mirrors, publish_to_mirrors, write_checksum_file, file_checksum
+from .cache_audit import check_archive
+from .snapshot import unfold_fingerprint, find_snapshot, import_snapshot, save_unfold_snapshot, snapshot_folder
 
 log = getLogger(__name__)
 
 
+def package_filepath(file: str) -> str:
+    """Return the path of a datapackage from either a path or a recordID of a cached record."""
+    if not os.path.exists(file):
+        # we only received a recordID (not a valid path), convert to path
+        cache_folder = appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser")
+        filename = f"{file}.zip"
+        filepath = os.path.join(cache_folder, os.path.basename(filename))
+    else:
+        # we received a valid path
+        filepath = file
+
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"File {filepath} does not exist.")
+    return filepath
+
 def unfold_databases(
         file: str,
         scenarios: list,
         dependencies: dict,
         superstructure: bool,
         superstructure_db_name: Optional[str],
-        superstructure_sdf_location: Optional[str]) -> None:
+        superstructure_sdf_location: Optional[str],
+        bulk_write: bool = True,
+        compact_scenarios: bool = False,
+        keep_snapshot: bool = False) -> None:
     """
     Unfold databases based on a given filepath and scenarios list.
 
@@ -44,6 +72,11 @@ def unfold_databases(
         superstructure (bool): Flag to indicate if a superstructure should be unfolded.
         superstructure_db_name Optional[str]: name of the database.
         superstructure_sdf_location Optional[str]: folder path to export the SDF file to.
+        bulk_write (bool): Write the databases with batched inserts and rebuild indices once at the end.
+        compact_scenarios (bool): With superstructure, store the scenarios as sparse deltas in the
+            project instead of exporting an SDF file (see `scenario_store`).
+        keep_snapshot (bool): Export the unfolded databases into the snapshot folder, so a later unfold
+            of the same package, scenarios and dependencies imports them instead (see `snapshot`).
 
     Last two arguments are required if superstructure is True
 
@@ -51,36 +84,85 @@ def unfold_databases(
         None: This function performs the unfolding operation but does not return anything.
     """
 
-    if not os.path.exists(file):
-        # we only received a recordID (not a valid path), convert to path
-        cache_folder = appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser")
-        filename = f"{file}.zip"
-        filepath = os.path.join(cache_folder, os.path.basename(filename))
-    else:
-        # we received a valid path
-        filepath = file
-
-    if not os.path.exists(filepath):
-        raise FileNotFoundError(f"File {filepath} does not exist.")
+    filepath = package_filepath(file)
 
+    compact_scenarios = compact_scenarios and superstructure
+    # the journal lets an interrupted import skip finished databases and remove half-written ones
+    journal = ImportJournal(os.path.splitext(os.path.basename(filepath))[0])
+    finished = rollback_databases(journal)
     try:
-        Unfold(filepath).unfold(
-            dependencies=dependencies,
-            scenarios=scenarios,
-            superstructure=superstructure,
-            name=superstructure_db_name,
-            export_dir=superstructure_sdf_location
-        )
+        # the package is extracted when it is opened, it can't be removed or replaced meanwhile
+        with cache_lock(record_of(filepath), shared=True, poll=wait_for_record(record_of(filepath))):
+            unfold = DeltaStoreUnfold(filepath) if compact_scenarios else BulkWriteUnfold(filepath)
+            unfold.bulk_write = bulk_write
+            unfold.journal = journal
+
+            # a snapshot holds everything the unfold writes in the project, but not an exported SDF file
+            fingerprint = None
+            if (keep_snapshot or os.listdir(snapshot_folder())) and (compact_scenarios or not superstructure):
+                fingerprint = unfold_fingerprint(filepath, unfold.package, scenarios, dependencies, superstructure)
+                fingerprint["name"] = superstructure_db_name if superstructure else None
+        if fingerprint:
+            snapshot = find_snapshot(fingerprint)
+            if snapshot and not finished:
+                log.info(f"Importing the databases from snapshot {snapshot} instead of unfolding")
+                import_snapshot(snapshot, check_dependencies=False)
+                journal.remove()
+                return
+
+        if superstructure:
+            planned = [superstructure_db_name or unfold.package.descriptor["name"]]
+            # a superstructure is one database, its cost grows with the number of scenarios
+            kind, measures = "superstructure", {"scenarios": len(scenarios or unfold.package.descriptor["scenarios"])}
+        else:
+            names = [s["name"] for s in unfold.package.descriptor["scenarios"]]
+            scenarios = scenarios or list(range(len(names)))
+            skipped = [i for i in scenarios if names[i] in finished]
+            if skipped:
+                log.info(f"Skipping {len(skipped)} database(s) finished by an earlier, interrupted import")
+            scenarios = [i for i in scenarios if i not in skipped]
+            if not scenarios:
+                journal.remove()
+                return
+            planned = [names[i] for i in scenarios]
+            kind, measures = "unfold", {"databases": len(planned)}
+
+        progress.start(f"Unfolding {len(planned)} database(s)")
+        with measure_run(kind, bw2data.projects.dir, **measures):
+            unfold.unfold(
+                dependencies=dependencies,
+                scenarios=scenarios,
+                superstructure=superstructure,
+                name=superstructure_db_name,
+                export_dir=superstructure_sdf_location
+            )
+    except Cancelled:
+        log.info("Unfolding cancelled, removing the unfinished databases")
+        rollback_databases(journal)
+        return
     except Exception as e:
         log.error(f"Failed to unfold database: {e}")
+        rollback_databases(journal)
         return
 
+    if compact_scenarios:
+        db_name = superstructure_db_name or unfold.package.descriptor["name"]
+        store_path = delta_store_path(db_name)
+        unfold.delta_store.save(store_path)
+        log.info(f"Stored {len(unfold.delta_store.scenarios)} scenarios of {db_name} in {store_path}")
+    if keep_snapshot and fingerprint and not finished:
+        snapshot = save_unfold_snapshot(planned, filepath, fingerprint)
+        if snapshot:
+            log.info(f"Stored a snapshot of {len(planned)} database(s) in {snapshot}")
+    journal.remove()
+
 def download_file_with_progress(file_url, output_path):
     # Function to download a file with a progress bar
     with requests.get(file_url, stream=True, timeout=100, allow_redirects=True) as response:
         response.raise_for_status()
         total_size = int(response.headers.get("content-length", 0))
         block_size = 1024  # Adjust the block size as needed
+        chunk_size = 64 * block_size
 
         with tqdm(
                 total=total_size,
@@ -91,9 +173,10 @@ def download_file_with_progress(file_url, output_path):
                 desc=os.path.basename(output_path),
         ) as progress_bar:
             with open(output_path, "wb") as file:
-                for data in response.iter_content(block_size):
+                for data in response.iter_content(chunk_size):
                     progress_bar.update(len(data))
                     file.write(data)
+                    progress.advance(len(data))
 
 def verify_file_integrity(file_path, expected_hash):
     # Calculate the hash of the file and compare it to the expected hash
@@ -105,16 +188,40 @@ def verify_file_integrity(file_path, expected_hash):
             chunk = f.read(8192)
             while chunk:
                 file_hash.update(chunk)
+                progress.advance(len(chunk))
                 chunk = f.read(8192)
 
         return file_hash.hexdigest() == expected_hash
+    except Cancelled:
+        raise
     except Exception as e:
         log.error(f"Error verifying file integrity: {e}")
         return False
 
+class DownloadFailed(Exception):
+    """A download from Zenodo failed, the user can retry it."""
+
+
+def wait_for_record(record: str):
+    """Return a `poll` callable for `cache_lock` that keeps the GUI responsive and lets the user cancel
+    while another Activity Browser instance uses `record`."""
+    stage = f"Waiting for another Activity Browser using {record}"
+
+    def poll():
+        if progress.stage != stage:
+            progress.start(stage)
+        progress.check()
+    return poll
+
+
 def download_files_from_zenodo(record_id: str) -> [Package, None]:
     """
-    Download datapackages from Zenodo based on a given record ID.
+    Download datapackages from Zenodo based on a given record ID, or fetch them from a mirror
+    if one is configured (see `mirrors`).
+
+    The record is locked while it is fetched and repacked, so other Activity Browser instances asking for
+    the same record wait for this download and then open the cached file (see `cache_lock`).
+    Dialogs are only shown while the lock is not held.
 
     Parameters:
         record_id (str): The Zenodo record ID.
@@ -123,19 +230,53 @@ def download_files_from_zenodo(record_id: str) -> [Package, None]:
         Package: A datapackage object containing the downloaded files.
         None: Returns None if the download fails.
     """
-    def retry_dialog():
-        choice = QtWidgets.QMessageBox.warning(QtWidgets.QWidget(),
-                                               "Connection failure",
-                                               "Something went wrong with your connection, retry?",
-                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
-                                               QtWidgets.QMessageBox.No)
-        if choice == QtWidgets.QMessageBox.Yes:
-            return download_files_from_zenodo(record_id)
-        else:
+    with progress.job():
+        try:
+            with cache_lock(record_id, poll=wait_for_record(record_id)):
+                package = _cached_package(record_id)
+            if package is not None:
+                return package
+            if not preflight_dialog(record_id):
+                return
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                with cache_lock(record_id, poll=wait_for_record(record_id)):
+                    # another instance may have downloaded the record while the dialog was open
+                    return _cached_package(record_id) or _download_files_from_zenodo(record_id)
+            finally:
+                QApplication.restoreOverrideCursor()
+        except Cancelled:
+            log.info(f"Download of record {record_id} cancelled, it resumes when the record is opened again")
             return
+        except DownloadFailed as e:
+            log.error(str(e))
+
+    choice = QtWidgets.QMessageBox.warning(QtWidgets.QWidget(),
+                                           "Connection failure",
+                                           "Something went wrong with your connection, retry?",
+                                           QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                           QtWidgets.QMessageBox.No)
+    if choice == QtWidgets.QMessageBox.Yes:
+        return download_files_from_zenodo(record_id)
+
+def _cached_package(record_id: str) -> [Package, None]:
+    """Return the package of `record_id` from the cache or from a mirror, None if neither has it."""
+    folder_name = appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser")
+    zip_path = os.path.join(folder_name, f"{record_id}.zip")
+    if record_cached(record_id):
+        log.info(f"File {record_id}.zip already exists in cache.")
+        return Package(zip_path)
+    # a mirror of the team is closer than Zenodo, try those first
+    if fetch_from_mirrors(record_id, zip_path):
+        return Package(zip_path)
 
+def _download_files_from_zenodo(record_id: str) -> Package:
+    """Download the files of `record_id` from Zenodo and repack them into the cache, with the record locked.
+
+    Raises `DownloadFailed` if the files can't be downloaded or verified.
+    """
     # Zenodo API endpoint to fetch datapackages
-    url = f"https://zenodo.org/api/records/{record_id}/files"
+    url = zenodo_files_url(record_id)
 
     # Create a folder to save the downloaded files
     folder_name = appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser")
@@ -147,10 +288,10 @@ def download_files_from_zenodo(record_id: str) -> [Package, None]:
     # Define the ZIP filename based on the Zenodo record ID
     zip_filename = f"{record_id}.zip"
 
-    # Check if the file already exists; if so, return the Package
-    if record_cached(record_id):
-        log.info(f"File {zip_filename} already exists in cache.")
-        return Package(os.path.join(folder_name, zip_filename))
+    # remove temporary files of earlier downloads that can't be resumed anymore
+    clean_orphaned_temp_data()
+    journal = ImportJournal(record_id)
+    download_dirname = work_folder(record_id)
 
     log.info(f"Fetching data from Zenodo: {url}")
 
@@ -158,69 +299,126 @@ def download_files_from_zenodo(record_id: str) -> [Package, None]:
     try:
         response = requests.get(url, timeout=100)
     except Exception as e:
-        log.error(f"Failed to get data from Zenodo. Error: {e}")
-        return retry_dialog()
+        raise DownloadFailed(f"Failed to get data from Zenodo. Error: {e}")
 
     json_data = response.json()
+    download_start, disk_start = time.time(), free_disk(folder_name)
 
-    # Change cursor to indicate ongoing process
-    QApplication.setOverrideCursor(Qt.WaitCursor)
-
-    # Create a final ZIP file to store the downloaded files
-    with zipfile.ZipFile(os.path.join(folder_name, zip_filename), "w") as final_zip:
+    # Write the final ZIP file under a temporary name, it is only renamed once it is complete
+    zip_path = os.path.join(folder_name, zip_filename)
+    partial_zip_path = zip_path + ".partial"
+    with zipfile.ZipFile(partial_zip_path, "w") as final_zip:
         for idx, file_info in enumerate(json_data["entries"]):
-            log.info(f"Downloading file {idx + 1}/{len(json_data['entries'])}")
-            file_url = f"{file_info['links']['content']}"
-            download_tmpdirname = tempfile.TemporaryDirectory().name
-            # Create a temporary directory to store the downloaded ZIP file
-            os.makedirs(download_tmpdirname)
-            downloaded_zip_path = os.path.join(download_tmpdirname, "downloaded.zip")
-
-            try:
-                download_file_with_progress(file_url, downloaded_zip_path)
-            except Exception as e:
-                log.error(f"Download failed {e}")
-                return retry_dialog()
-
-            # Verify the integrity of the downloaded file
+            file_key = file_info.get("key", str(idx))
             # fetch the MD5 hash from the JSON
             expected_hash = file_info["checksum"][4:]
+            downloaded_zip_path = os.path.join(download_dirname, f"{idx}.zip")
 
-            if verify_file_integrity(downloaded_zip_path, expected_hash):
-                log.info(f"File {idx + 1} verified successfully.")
+            verified = journal.info(f"verified:{file_key}")
+            if (verified and journal.is_done(f"verified:{file_key}")
+                    and verified.get("checksum") == expected_hash and os.path.exists(downloaded_zip_path)):
+                log.info(f"File {idx + 1}/{len(json_data['entries'])} already downloaded and verified.")
             else:
-                log.warning(f"File {idx + 1} verification failed. Deleting {downloaded_zip_path}.")
-                # Delete the temporary and final files if the hash doesn't match
-                os.remove(downloaded_zip_path)
-                os.remove(os.path.join(folder_name, zip_filename))
-                log.warning("File verification failed.")
-                return retry_dialog()
+                progress.start(f"Downloading file {idx + 1}/{len(json_data['entries'])}", file_info.get("size"), "B")
+                file_url = f"{file_info['links']['content']}"
+                journal.start(f"downloaded:{file_key}")
+                try:
+                    download_file_with_progress(file_url, downloaded_zip_path)
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    raise DownloadFailed(f"Download failed {e}")
+                journal.done(f"downloaded:{file_key}")
+
+                # Verify the integrity of the downloaded file
+                progress.start(f"Verifying file {idx + 1}/{len(json_data['entries'])}",
+                               os.path.getsize(downloaded_zip_path), "B")
+                if verify_file_integrity(downloaded_zip_path, expected_hash):
+                    log.info(f"File {idx + 1} verified successfully.")
+                    journal.done(f"verified:{file_key}", checksum=expected_hash)
+                else:
+                    log.warning(f"File {idx + 1} verification failed. Deleting {downloaded_zip_path}.")
+                    # Delete the temporary and final files if the hash doesn't match
+                    os.remove(downloaded_zip_path)
+                    final_zip.close()
+                    os.remove(partial_zip_path)
+                    journal.forget(f"downloaded:{file_key}")
+                    raise DownloadFailed("File verification failed.")
 
             # Create another temporary directory for the extracted files
             with tempfile.TemporaryDirectory() as extract_tmpdirname:
                 # Extract the ZIP file's contents
+                progress.start(f"Extracting file {idx + 1}/{len(json_data['entries'])}")
                 with zipfile.ZipFile(downloaded_zip_path, "r") as downloaded_zip:
                     downloaded_zip.extractall(extract_tmpdirname)
 
                 # Add the extracted files to the final ZIP file
-                for root, _, files in os.walk(extract_tmpdirname):
-                    for file in files:
-                        # Calculate the relative path
-                        relative_path = os.path.relpath(os.path.join(root, file), extract_tmpdirname)
-                        # Add the file to the ZIP archive with its relative path
-                        final_zip.write(os.path.join(root, file), relative_path)
+                extracted = [os.path.join(root, file) for root, _, files in os.walk(extract_tmpdirname)
+                             for file in files]
+                progress.start(f"Repacking file {idx + 1}/{len(json_data['entries'])}", len(extracted), "files")
+                for path in extracted:
+                    # Calculate the relative path
+                    relative_path = os.path.relpath(path, extract_tmpdirname)
+                    # Add the file to the ZIP archive with its relative path
+                    final_zip.write(path, relative_path)
+                    progress.advance()
         log.info("Done.")
-    # Restore the original cursor
-    QApplication.restoreOverrideCursor()
-
-    return Package(os.path.join(folder_name, zip_filename))
+    # verify the repacked package before it enters the cache, a checksum of a damaged one would hide it
+    progress.start("Verifying the repacked datapackage")
+    problem = check_archive(partial_zip_path)
+    if problem is not None:
+        os.remove(partial_zip_path)
+        raise DownloadFailed(f"The repacked datapackage is damaged: {problem}")
+    checksum = file_checksum(partial_zip_path)
+    os.replace(partial_zip_path, zip_path)
+    # stored so the cache audit can tell a damaged package from a good one
+    write_checksum_file(zip_path, checksum)
+    journal.done("repacked")
+    # the record is complete, the journal and downloaded files are no longer needed
+    journal.remove()
+    try:
+        publish_to_mirrors(record_id, zip_path)
+    except Cancelled:
+        # the record is complete in the cache, only publishing it stops
+        log.info(f"Publishing {record_id} to the mirrors cancelled")
+    record_run("download", seconds=time.time() - download_start,
+               disk=max(disk_start - free_disk(folder_name), 0),
+               bytes=sum(file_info.get("size", 0) for file_info in json_data["entries"]))
+
+    return Package(zip_path)
+
+def preflight_dialog(record_id: str) -> bool:
+    """Check the resources needed to download `record_id`, return False if the download should not start."""
+    estimate = estimate_download(record_id)
+    if estimate is None:
+        # the sizes could not be fetched, the download itself will report connection problems
+        return True
+    log.info(estimate.summary())
+    if estimate.blocking:
+        QtWidgets.QMessageBox.critical(QtWidgets.QWidget(), "Not enough resources",
+                                       "\n".join(estimate.blocking))
+        return False
+    if estimate.warnings:
+        choice = QtWidgets.QMessageBox.warning(QtWidgets.QWidget(),
+                                               "Resources may be insufficient",
+                                               "\n".join(estimate.warnings + ["Download anyway?"]),
+                                               QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                               QtWidgets.QMessageBox.No)
+        return choice == QtWidgets.QMessageBox.Yes
+    return True
 
 def package_from_path(path: str) -> [Package, None]:
     """Create a package from the selected zip file"""
     if not path.endswith(".zip"):
         log.error("Error, file selected is not a .zip file.")
         return
-    return Package(path)
+    with progress.job():
+        try:
+            with cache_lock(record_of(path), shared=True, poll=wait_for_record(record_of(path))):
+                return Package(path)
+        except Cancelled:
+            log.info(f"Opening {path} cancelled")
+            return
 
 def record_cached(record: str) -> bool:
     """Return if record is cached."""
@@ -231,6 +429,13 @@ def record_cached(record: str) -> bool:
     zip_filename = record + ".zip"
     return os.path.exists(os.path.join(folder_name, zip_filename))
 
+def cached_records() -> set:
+    """Return the IDs of all cached records."""
+    folder_name = appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser")
+    if not os.path.exists(folder_name):
+        return set()
+    return {f[:-len(".zip")] for f in os.listdir(folder_name) if f.endswith(".zip")}
+
 def clear_sl_datapackage_cache() -> None:
     """Clear all datapackages from the ScenarioLink cache"""
     folder_name = appdirs.user_cache_dir("ActivityBrowser", "ActivityBrowser")
@@ -242,9 +447,13 @@ def clear_sl_datapackage_cache() -> None:
     for filename in os.listdir(folder_name):
         file_path = os.path.join(folder_name, filename)
 
-        # Remove each file in the list
+        # Remove each file in the list, unless another process is reading or writing it
         if os.path.isfile(file_path) or os.path.islink(file_path):
-            os.unlink(file_path)
+            try:
+                with cache_lock(record_of(filename), blocking=False):
+                    os.unlink(file_path)
+            except TimeoutError:
+                log.info(f"Not removing {filename}, it is in use")
 
 class UpdateManager():
 
@@ -0,0 +1,19 @@
+"""Measure what enabling ScenarioLink costs at Activity Browser startup and when the tab is first shown.
+
+Run with the Activity Browser environment active, e.g. `python dev/import_time.py`.
+Use `python -X importtime dev/import_time.py` for a per-module breakdown.
+"""
+import importlib
+import time
+
+start = time.perf_counter()
+import activity_browser  # noqa: F401, already imported by the Activity Browser when plugins load
+ab_loaded = time.perf_counter()
+importlib.import_module("ab_plugin_scenariolink")
+plugin_loaded = time.perf_counter()
+importlib.import_module("ab_plugin_scenariolink.layouts.tabs.panel")
+panel_loaded = time.perf_counter()
+
+print(f"activity_browser:              {ab_loaded - start:.3f}s")
+print(f"ab_plugin_scenariolink (startup): {plugin_loaded - ab_loaded:.3f}s")
+print(f"ScenarioLink panel (first show):  {panel_loaded - plugin_loaded:.3f}s")
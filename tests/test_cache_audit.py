@@ -0,0 +1,91 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+from ab_plugin_scenariolink.cache_audit import (check_package, check_archive, audit_cache, repair_cache,
+                                                quarantine_folder, OK, DAMAGED, IN_USE)
+from ab_plugin_scenariolink.cache_lock import cache_lock
+from ab_plugin_scenariolink.mirrors import write_checksum_file
+
+DESCRIPTOR = {"name": "package", "scenarios": [{"name": "remind - SSP2-Base - 2050"}],
+              "resources": [{"name": "scenario_data", "path": "scenario_data/scenario_data.csv"}]}
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    folder = tmp_path / "ActivityBrowser"
+    folder.mkdir()
+    return folder
+
+
+def write_package(path, descriptor: dict = DESCRIPTOR, checksum: bool = True) -> str:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("datapackage.json", json.dumps(descriptor))
+        archive.writestr("scenario_data/scenario_data.csv", "from activity name;remind\n" + "coal;1.5\n" * 2000)
+    if checksum:
+        write_checksum_file(str(path))
+    return str(path)
+
+
+def corrupt(path, offset: int = 200) -> None:
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+
+def test_intact_packages(cache):
+    assert check_package(write_package(cache / "1.zip"))["status"] == OK
+    result = check_package(write_package(cache / "2.zip", checksum=False))
+    assert result["status"] == OK and not result["checksum"]
+
+
+def test_problems_are_found(cache):
+    truncated = write_package(cache / "truncated.zip")
+    with open(truncated, "r+b") as f:
+        f.truncate(os.path.getsize(truncated) // 2)
+    assert "unreadable zip" in check_package(truncated)["problem"]
+
+    mismatch = write_package(cache / "mismatch.zip")
+    corrupt(mismatch)
+    assert check_package(mismatch)["problem"] == "checksum does not match"
+
+    # without a checksum, the CRC of the members finds the same damage
+    crc = write_package(cache / "crc.zip", checksum=False)
+    corrupt(crc)
+    assert "corrupt" in check_archive(crc)
+
+    missing = write_package(cache / "missing.zip", dict(DESCRIPTOR, resources=[{"path": "inventories.csv"}]))
+    assert "missing" in check_package(missing)["problem"]
+
+
+def test_packages_in_use_are_skipped(cache):
+    path = write_package(cache / "1.zip")
+    with cache_lock("1"):
+        # another thread of this process, as the audit runs its checks in a thread pool
+        assert audit_cache([path])[0]["status"] == IN_USE
+
+
+def test_damaged_packages_are_quarantined_and_fetched_again(cache):
+    write_package(cache / "good.zip")
+    truncated = write_package(cache / "truncated.zip")
+    with open(truncated, "r+b") as f:
+        f.truncate(100)
+    mismatch = write_package(cache / "mismatch.zip")
+    corrupt(mismatch)
+
+    results = audit_cache(workers=2)
+    assert [(r["record"], r["status"]) for r in results] == [
+        ("good", OK), ("mismatch", DAMAGED), ("truncated", DAMAGED)]
+
+    refetched = []
+    assert repair_cache(results, refetch=refetched.append) == ["mismatch", "truncated"]
+    assert refetched == ["mismatch", "truncated"]
+    assert sorted(os.listdir(cache)) == ["good.zip", "good.zip.md5", "locks", "quarantine"]
+    quarantined = sorted(os.listdir(quarantine_folder()))
+    assert [name.split(".zip")[0] for name in quarantined] == ["mismatch", "mismatch", "truncated", "truncated"]
+    assert sum(name.endswith(".md5") for name in quarantined) == 2
@@ -0,0 +1,128 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from ab_plugin_scenariolink.cache_lock import cache_lock, record_of
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOLD = """
+import sys
+from ab_plugin_scenariolink.cache_lock import cache_lock
+with cache_lock(sys.argv[1], shared=sys.argv[2] == "shared"):
+    print("locked", flush=True)
+    sys.stdin.readline()
+"""
+TRY = """
+import sys
+from ab_plugin_scenariolink.cache_lock import cache_lock
+try:
+    with cache_lock(sys.argv[1], shared=sys.argv[2] == "shared", blocking=False):
+        print("locked")
+except TimeoutError:
+    print("taken")
+"""
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    return dict(os.environ, PYTHONPATH=ROOT)
+
+
+def try_in_other_process(env: dict, record: str, shared: bool) -> str:
+    result = subprocess.run([sys.executable, "-c", TRY, record, "shared" if shared else "exclusive"],
+                            env=env, capture_output=True, text=True, timeout=60)
+    return result.stdout.strip()
+
+
+@pytest.fixture
+def other_process(cache):
+    """Start a process that holds a lock until the test ends, `other_process(record, shared)`."""
+    processes = []
+
+    def hold(record: str, shared: bool):
+        process = subprocess.Popen([sys.executable, "-c", HOLD, record, "shared" if shared else "exclusive"],
+                                   env=cache, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        processes.append(process)
+        assert process.stdout.readline().strip() == "locked"
+
+    yield hold
+    for process in processes:
+        process.communicate("\n", timeout=60)
+
+
+def test_locks_are_reentrant_within_a_process(cache):
+    with cache_lock("123"):
+        with cache_lock("123", shared=True):
+            with cache_lock("123"):
+                pass
+        assert try_in_other_process(cache, "123", shared=True) == "taken"
+    assert try_in_other_process(cache, "123", shared=False) == "locked"
+
+
+def test_a_shared_lock_is_not_upgraded(cache):
+    with cache_lock("123", shared=True):
+        with pytest.raises(RuntimeError):
+            with cache_lock("123"):
+                pass
+
+
+def test_shared_locks_exclude_writers_only(cache):
+    with cache_lock("123", shared=True):
+        assert try_in_other_process(cache, "123", shared=True) == "locked"
+        assert try_in_other_process(cache, "123", shared=False) == "taken"
+        # other records are independent
+        assert try_in_other_process(cache, "456", shared=False) == "locked"
+
+
+def test_waiting_for_another_process(other_process):
+    other_process("123", shared=False)
+    with pytest.raises(TimeoutError):
+        with cache_lock("123", shared=True, blocking=False):
+            pass
+    with pytest.raises(TimeoutError):
+        with cache_lock("123", timeout=0.2):
+            pass
+
+    polls = []
+
+    def poll():
+        polls.append(1)
+        if len(polls) == 3:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        with cache_lock("123", poll=poll):
+            pass
+    assert len(polls) == 3
+    # the failed attempts released everything they took in this process
+    with pytest.raises(TimeoutError):
+        with cache_lock("123", blocking=False):
+            pass
+
+
+def cache_lock_and_append(record: str, order: list) -> None:
+    with cache_lock(record):
+        order.append("thread")
+
+
+def test_threads_take_turns(cache):
+    order = []
+    with cache_lock("123"):
+        thread = threading.Thread(target=lambda: cache_lock_and_append("123", order))
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        order.append("main")
+    thread.join(10)
+    assert order == ["main", "thread"]
+
+
+def test_record_of():
+    assert record_of("/cache/123.zip") == "123"
+    assert record_of("123.zip.md5") == "123"
+    assert record_of("123.zip.md5.partial") == "123"
+    assert record_of("123.zip.abcd.partial") == "123"
@@ -0,0 +1,100 @@
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+
+from ab_plugin_scenariolink import catalogue
+from ab_plugin_scenariolink.catalogue import fetch_catalogue, load_cached_catalogue, parse_catalogue, RECORD_COLUMN
+
+HEADER = "generator;generator version;scope;model;scenario;source database;creation date;Zenodo record ID\n"
+
+
+def row(record: int, model: str = "remind") -> str:
+    return f"premise;(2, 2, {record % 10});electricity;{model};SSP2-Base;ecoinvent 3.10;2024-0{record % 9 + 1}-01;{record}\n"
+
+
+class StubSession:
+    """Serves `content` like a static file server: ETags, If-None-Match and byte ranges."""
+
+    def __init__(self, content: str, ranges: bool = True):
+        self.content = content.encode("utf-8")
+        self.ranges = ranges
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        headers = headers or {}
+        self.requests.append(headers)
+        etag = '"' + hashlib.md5(self.content).hexdigest() + '"'
+        if headers.get("If-None-Match") == etag:
+            return SimpleNamespace(status_code=304, content=b"", headers={"ETag": etag})
+        if "Range" in headers and self.ranges:
+            start = int(headers["Range"].split("=")[1].rstrip("-"))
+            if start >= len(self.content):
+                return SimpleNamespace(status_code=416, content=b"", headers={})
+            return SimpleNamespace(status_code=206, content=self.content[start:], headers={
+                "ETag": etag, "Content-Range": f"bytes {start}-{len(self.content) - 1}/{len(self.content)}"})
+        return SimpleNamespace(status_code=200, content=self.content, headers={"ETag": etag},
+                               raise_for_status=lambda: None)
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    monkeypatch.delenv(catalogue.CATALOGUE_ENV, raising=False)
+    session = StubSession(HEADER + "".join(row(i) for i in range(40)))
+    fetch_catalogue(session)
+    session.requests.clear()
+    return session
+
+
+def records(session) -> list:
+    return fetch_catalogue(session)[0][RECORD_COLUMN].tolist()
+
+
+def test_unchanged_catalogue_costs_a_304(session):
+    dataframe, version = fetch_catalogue(session)
+    assert version == 40
+    assert len(session.requests) == 1 and "If-None-Match" in session.requests[0]
+    assert session.requests[0]["Cache-Control"] == "no-cache"
+
+
+def test_only_added_rows_are_fetched(session, monkeypatch):
+    session.content += (row(40) + row(41, "image")).encode("utf-8")
+    parsed = []
+    monkeypatch.setattr(catalogue, "parse_catalogue", lambda content, columns=None: parsed.append(content) or
+                        parse_catalogue(content, columns))
+
+    dataframe, version = fetch_catalogue(session)
+    assert version == 42
+    assert dataframe[RECORD_COLUMN].tolist()[-2:] == ["40", "41"]
+    assert "image" in dataframe["model"].cat.categories
+    assert len(session.requests) == 1 and session.requests[0]["Range"].startswith("bytes=")
+    assert parsed == [(row(40) + row(41, "image")).encode("utf-8")]
+    assert load_cached_catalogue()["length"] == len(session.content)
+
+
+def test_edited_catalogue_is_fetched_whole(session):
+    # same length, an early row edited
+    session.content = session.content.replace(b";3\n", b";X\n", 1)
+    assert "X" in records(session)
+    assert "Range" not in session.requests[-1]
+
+    # an edit within the overlap together with new rows
+    session.content = session.content.replace(b";39\n", b";Y\n") + row(40).encode("utf-8")
+    assert records(session)[-2:] == ["Y", "40"]
+    assert "Range" not in session.requests[-1]
+
+
+def test_catalogue_is_fetched_whole_when_the_server_ignores_ranges(session):
+    session.ranges = False
+    session.content += row(40).encode("utf-8")
+    assert len(records(session)) == 41
+    assert len(session.requests) == 1
+
+
+def test_whole_catalogue_is_checked_periodically(session, monkeypatch):
+    later = load_cached_catalogue()["checked"] + catalogue.FULL_CHECK_INTERVAL + 1
+    monkeypatch.setattr(catalogue.time, "time", lambda: later)
+    assert len(records(session)) == 40
+    assert "Range" not in session.requests[-1] and "If-None-Match" in session.requests[-1]
+
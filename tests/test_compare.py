@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+bd = pytest.importorskip("bw2data")
+pytest.importorskip("bw2calc")
+from bw2calc import LCA
+from bw2data.tests import bw2test
+
+from ab_plugin_scenariolink.compare import compare_superstructure
+from ab_plugin_scenariolink.scenario_store import ScenarioDeltaStore, FLOW_COLUMNS, delta_store_path
+
+METHOD = ("test", "climate")
+# (from code, to code, flow type): amount in the source database and in each scenario
+FLOWS = {
+    ("electricity", "electricity", "production"): (1.0, 1.0, 1.0),
+    ("co2", "electricity", "biosphere"): (1.0, 0.5, 0.2),
+    ("electricity", "steel", "technosphere"): (2.0, 2.0, 1.5),
+    ("steel", "steel", "production"): (1.0, 1.0, 1.0),
+    ("co2", "steel", "biosphere"): (3.0, 2.5, 2.5),
+}
+SCENARIOS = ["scenario A", "scenario B"]
+
+
+def write_database(name: str, column: int) -> None:
+    data = {}
+    for code in ("electricity", "steel"):
+        data[(name, code)] = {"name": code, "reference product": code, "location": "GLO", "unit": "kg",
+                              "exchanges": []}
+    for (source, target, flow_type), amounts in FLOWS.items():
+        database = "biosphere" if flow_type == "biosphere" else name
+        data[(name, target)]["exchanges"].append(
+            {"input": (database, source), "amount": amounts[column], "type": flow_type})
+    bd.Database(name).write(data)
+
+
+def scenario_store(database: str) -> ScenarioDeltaStore:
+    rows = []
+    for (source, target, flow_type), amounts in FLOWS.items():
+        row = {column: None for column in FLOW_COLUMNS}
+        row.update({
+            "from key": ("biosphere" if flow_type == "biosphere" else database, source),
+            "to key": (database, target),
+            "flow type": flow_type,
+        })
+        row.update(dict(zip(SCENARIOS, amounts[1:])))
+        rows.append(row)
+    return ScenarioDeltaStore.from_dataframe(pd.DataFrame(rows), SCENARIOS)
+
+
+@bw2test
+def test_compare_superstructure_matches_scenario_databases():
+    bd.Database("biosphere").write({("biosphere", "co2"): {"name": "co2", "unit": "kg", "type": "emission"}})
+    method = bd.Method(METHOD)
+    method.register()
+    method.write([(("biosphere", "co2"), 1.0)])
+    # the superstructure holds the amounts of the source database, not those of a scenario
+    write_database("superstructure", 0)
+    scenario_store("superstructure").save(delta_store_path("superstructure"))
+    for i, scenario in enumerate(SCENARIOS):
+        write_database(scenario, i + 1)
+
+    functional_unit = {("superstructure", "steel"): 1.0}
+    results = compare_superstructure("superstructure", [functional_unit], [METHOD])
+
+    for scenario in SCENARIOS:
+        lca = LCA({(scenario, "steel"): 1.0}, METHOD)
+        lca.lci()
+        lca.lcia()
+        assert np.isclose(results.xs(scenario, level="scenario").iloc[0, 0], lca.score)
@@ -0,0 +1,53 @@
+import pandas as pd
+
+from ab_plugin_scenariolink import descriptor
+from ab_plugin_scenariolink.descriptor import parse_scenarios, scenarios_name, SCENARIO_COLUMNS
+
+SCENARIOS = [
+    {"name": "remind - SSP2-Base - 2030", "description": "Baseline"},
+    {"name": "remind - SSP2-PkBudg1150 - 2050", "description": "1.5 degrees", "source": "premise"},
+    {"name": "image - SSP1 - Base - 2040"},
+    {"name": "custom scenario"},
+]
+
+
+def test_parse_scenarios_splits_model_pathway_and_year():
+    dataframe = parse_scenarios(SCENARIOS)
+
+    assert dataframe.columns.tolist() == SCENARIO_COLUMNS + ["base", "source"]
+    assert dataframe["model"].tolist()[:3] == ["remind", "remind", "image"]
+    # only the first ' - ' separates the model, the pathway keeps the others
+    assert dataframe["pathway"].tolist()[:3] == ["SSP2-Base", "SSP2-PkBudg1150", "SSP1 - Base"]
+    assert dataframe["year"].tolist()[:3] == [2030, 2050, 2040]
+    assert dataframe["base"].tolist()[1] == "remind - SSP2-PkBudg1150"
+    assert isinstance(dataframe["model"].dtype, pd.CategoricalDtype)
+    assert str(dataframe["year"].dtype) == "Int64"
+
+
+def test_names_without_a_year_are_kept_whole():
+    dataframe = parse_scenarios(SCENARIOS)
+    row = dataframe.iloc[3]
+    assert row["model"] == "custom scenario"
+    assert pd.isna(row["pathway"]) and pd.isna(row["year"])
+    assert row["base"] == "custom scenario"
+    assert pd.isna(dataframe.loc[3, "description"])
+
+
+def test_parsed_descriptors_are_cached_and_copied(monkeypatch):
+    calls = []
+    monkeypatch.setattr(descriptor, "_cache", type(descriptor._cache)())
+    original = descriptor._parse
+    monkeypatch.setattr(descriptor, "_parse", lambda scenarios: calls.append(1) or original(scenarios))
+
+    first = parse_scenarios(SCENARIOS)
+    first.loc[0, "name"] = "changed"
+    second = parse_scenarios(SCENARIOS)
+    assert len(calls) == 1
+    assert second.loc[0, "name"] == "remind - SSP2-Base - 2030"
+
+
+def test_scenarios_name():
+    dataframe = parse_scenarios(SCENARIOS)
+    assert scenarios_name(dataframe, [0]) == "remind - SSP2-Base"
+    assert scenarios_name(dataframe, [0, 1]) == "remind - SSP2-Base, SSP2-PkBudg1150"
+    assert scenarios_name(dataframe, []) is None
@@ -0,0 +1,74 @@
+from contextlib import contextmanager
+
+import pytest
+
+bd = pytest.importorskip("bw2data")
+pytest.importorskip("unfold")
+from bw2data.backends.peewee import SQLiteBackend
+from bw2data.tests import bw2test
+from unfold import Unfold
+
+from ab_plugin_scenariolink import bulk_write
+from ab_plugin_scenariolink.bulk_write import BulkWriteUnfold, bulk_write_mode
+from ab_plugin_scenariolink.journal import ImportJournal, database_step, rollback_databases
+
+
+def database_data(name: str) -> dict:
+    return {(name, "a"): {"name": "steel", "unit": "kg", "location": "GLO", "reference product": "steel",
+                          "exchanges": [{"input": (name, "a"), "amount": 1.0, "type": "production"}]}}
+
+
+interrupted = []
+
+
+@contextmanager
+def interrupted_bulk_write_mode(databases):
+    """`bulk_write_mode` of which the exit never runs, as when the Activity Browser is killed in the block."""
+    methods = {attr: getattr(SQLiteBackend, attr) for attr in
+               ("_efficient_write_many_data", "make_searchable", "process")}
+    mode = bulk_write_mode(databases)
+    mode.__enter__()
+    # closing the generator of a collected block would run its exit after all
+    interrupted.append(mode)
+    try:
+        yield
+    finally:
+        # only undo the patches, so the rest of the test uses the normal write path
+        for attr, method in methods.items():
+            setattr(SQLiteBackend, attr, method)
+
+
+def write_databases(self, superstructure=False, export_dir=None):
+    for name in self.databases_to_export:
+        bd.Database(name).write(database_data(name))
+        if name == "broken":
+            raise RuntimeError("killed")
+
+
+@bw2test
+def test_rollback_keeps_databases_written_in_an_interrupted_bulk_write(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(bulk_write, "bulk_write_mode", interrupted_bulk_write_mode)
+    monkeypatch.setattr(Unfold, "write", write_databases)
+
+    try:
+        unfold = BulkWriteUnfold.__new__(BulkWriteUnfold)
+        unfold.journal = ImportJournal("job")
+        unfold.databases_to_export = {"finished": {}, "broken": {}}
+        with pytest.raises(RuntimeError, match="killed"):
+            unfold.write()
+        assert "processed" not in bd.databases["finished"]
+
+        journal = ImportJournal("job")
+        assert journal.info(database_step("finished"))["processed"] is False
+        assert rollback_databases(journal) == ["finished"]
+        assert "finished" in bd.databases
+        assert "broken" not in bd.databases
+        # the deferred processing was done on resume
+        assert "processed" in bd.databases["finished"]
+        assert journal.info(database_step("finished"))["processed"] is True
+        assert len(bd.Database("finished").search("steel")) == 1
+    finally:
+        # run the exit the interrupted block skipped, so later tests start from a normal state
+        while interrupted:
+            interrupted.pop().__exit__(None, None, None)
@@ -0,0 +1,112 @@
+import functools
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+
+from ab_plugin_scenariolink import mirrors
+from ab_plugin_scenariolink.mirrors import DirectoryMirror, HttpMirror, fetch_from_mirrors, publish_to_mirrors
+
+PACKAGE = b"a repacked datapackage" * 1000
+
+
+def put_package(folder, record_id: str, content: bytes = PACKAGE, checksum: str = None) -> None:
+    folder.mkdir(exist_ok=True)
+    (folder / f"{record_id}.zip").write_bytes(content)
+    checksum = checksum or hashlib.md5(content).hexdigest()
+    (folder / f"{record_id}.zip.md5").write_text(f"{checksum}  {record_id}.zip\n")
+
+
+@pytest.fixture
+def http_folder(tmp_path):
+    """A folder served by a local HTTP server, yields (folder, url)."""
+    folder = tmp_path / "served"
+    folder.mkdir()
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(folder))
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield folder, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def configure(monkeypatch, *mirror_list, publish=False) -> None:
+    monkeypatch.setattr(mirrors, "load_config", lambda: {"mirrors": list(mirror_list), "publish": publish,
+                                                         "zenodo": mirrors.ZENODO_URL})
+
+
+def test_directory_mirror_fetches_a_package_with_a_matching_checksum(tmp_path):
+    put_package(tmp_path / "mirror", "123")
+    target = tmp_path / "cache" / "123.zip"
+    target.parent.mkdir()
+
+    assert DirectoryMirror(str(tmp_path / "mirror")).fetch("123", str(target))
+    assert target.read_bytes() == PACKAGE
+    assert (tmp_path / "cache" / "123.zip.md5").read_text().split()[0] == hashlib.md5(PACKAGE).hexdigest()
+
+
+def test_directory_mirror_rejects_a_checksum_mismatch(tmp_path):
+    put_package(tmp_path / "mirror", "123", checksum="0" * 32)
+    (tmp_path / "cache").mkdir()
+
+    assert not DirectoryMirror(str(tmp_path / "mirror")).fetch("123", str(tmp_path / "cache" / "123.zip"))
+    assert os.listdir(tmp_path / "cache") == []
+
+
+def test_http_mirror_fetches_a_package_with_a_matching_checksum(tmp_path, http_folder):
+    folder, url = http_folder
+    put_package(folder, "123")
+    (tmp_path / "cache").mkdir()
+
+    assert HttpMirror(url).fetch("123", str(tmp_path / "cache" / "123.zip"))
+    assert (tmp_path / "cache" / "123.zip").read_bytes() == PACKAGE
+    assert sorted(os.listdir(tmp_path / "cache")) == ["123.zip", "123.zip.md5"]
+
+
+def test_http_mirror_rejects_a_checksum_mismatch(tmp_path, http_folder):
+    folder, url = http_folder
+    put_package(folder, "123", checksum="0" * 32)
+    (tmp_path / "cache").mkdir()
+
+    assert not HttpMirror(url).fetch("123", str(tmp_path / "cache" / "123.zip"))
+    assert os.listdir(tmp_path / "cache") == []
+
+
+def test_fetch_falls_through_to_the_next_mirror(tmp_path, http_folder, monkeypatch):
+    folder, url = http_folder
+    put_package(tmp_path / "damaged", "123", content=b"damaged", checksum=hashlib.md5(PACKAGE).hexdigest())
+    (tmp_path / "empty").mkdir()
+    put_package(folder, "123")
+    configure(monkeypatch, str(tmp_path / "damaged"), str(tmp_path / "empty"), url)
+    (tmp_path / "cache").mkdir()
+
+    assert fetch_from_mirrors("123", str(tmp_path / "cache" / "123.zip")) == url
+    assert (tmp_path / "cache" / "123.zip").read_bytes() == PACKAGE
+    assert fetch_from_mirrors("456", str(tmp_path / "cache" / "456.zip")) is None
+
+
+def test_publish_writes_the_package_and_its_checksum(tmp_path, http_folder, monkeypatch):
+    _, url = http_folder
+    package = tmp_path / "123.zip"
+    package.write_bytes(PACKAGE)
+    (tmp_path / "mirror").mkdir()
+    configure(monkeypatch, url, str(tmp_path / "mirror"), publish=True)
+
+    publish_to_mirrors("123", str(package))
+    assert (tmp_path / "mirror" / "123.zip").read_bytes() == PACKAGE
+    assert (tmp_path / "mirror" / "123.zip.md5").read_text().split()[0] == hashlib.md5(PACKAGE).hexdigest()
+    assert sorted(os.listdir(tmp_path / "mirror")) == ["123.zip", "123.zip.md5"]
+
+
+def test_publish_is_off_unless_configured(tmp_path, monkeypatch):
+    package = tmp_path / "123.zip"
+    package.write_bytes(PACKAGE)
+    (tmp_path / "mirror").mkdir()
+    configure(monkeypatch, str(tmp_path / "mirror"))
+
+    publish_to_mirrors("123", str(package))
+    assert os.listdir(tmp_path / "mirror") == []
@@ -0,0 +1,58 @@
+import csv
+from types import SimpleNamespace
+
+import numpy as np
+
+from ab_plugin_scenariolink.scenario_diff import ScenarioDiff, FLOW_COLUMNS
+
+
+class Package:
+    """The parts of a `datapackage.Package` that `ScenarioDiff` reads."""
+
+    def __init__(self, resources: dict, scenarios: list):
+        self.resources = resources
+        self.descriptor = {"scenarios": [{"name": s} for s in scenarios]}
+
+    def get_resource(self, name):
+        return SimpleNamespace(source=self.resources[name]) if name in self.resources else None
+
+
+def write_package(tmp_path) -> Package:
+    flows = [
+        # supplier, consumer, values in A and B
+        (("coal", "electricity", "DE"), ("steel", "steel", "DE"), ["0.5", "2"]),
+        (("hydrogen", "hydrogen", "DE"), ("steel", "steel", "DE"), ["3.2", "4.1"]),
+        (("gas", "electricity", "DE"), ("steel", "steel", "DE"), ["1", "n/a"]),
+    ]
+    with open(tmp_path / "scenario_data.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(FLOW_COLUMNS + ["A", "B"])
+        for supplier, consumer, values in flows:
+            writer.writerow(list(supplier) + list(consumer) + ["technosphere"] + values)
+    with open(tmp_path / "inventories.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        for row in (["Database", "package"], [], ["Activity", "hydrogen"], ["reference product", "hydrogen"],
+                    ["unit", "kilogram"], ["location", "DE"], [""], ["Exchanges"], []):
+            writer.writerow(row)
+    return Package({"scenario_data": str(tmp_path / "scenario_data.csv"),
+                    "inventories": str(tmp_path / "inventories.csv")}, ["A", "B"])
+
+
+def test_added_exchanges_are_amounts_not_changes(tmp_path):
+    diff = ScenarioDiff(write_package(tmp_path))
+    assert diff.added.tolist() == [False, True, False]
+    assert diff.n_added() == 1
+    assert diff.n_changed(["A", "B"]) == 1
+
+    top = diff.top_changes(["A", "B"])
+    assert top["from activity name"].tolist()[0] == "coal"
+    assert top["B (%)"].tolist()[0] == 100.0
+    added = diff.added_exchanges(["A", "B"])
+    assert added["from activity name"].tolist() == ["hydrogen"]
+    np.testing.assert_allclose(added[["A (amount)", "B (amount)"]].to_numpy(), [[3.2, 4.1]], rtol=1e-6)
+
+
+def test_values_that_are_not_numbers_are_missing(tmp_path):
+    diff = ScenarioDiff(write_package(tmp_path))
+    assert np.isnan(diff.values(["B"])[2, 0])
+    assert diff.deltas(["B"])[2, 0] == 0.0
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from ab_plugin_scenariolink.scenario_store import ScenarioDeltaStore, FLOW_COLUMNS
+
+SCENARIOS = ["A", "B", "C"]
+VALUES = {
+    "A": [np.nan, 1.0, 2.0, np.nan],
+    "B": [5.0, np.nan, 2.0, np.nan],
+    "C": [np.nan, 1.0, 3.0, 4.0],
+}
+
+
+def scenario_dataframe() -> pd.DataFrame:
+    rows = []
+    for i in range(len(VALUES["A"])):
+        row = {column: None for column in FLOW_COLUMNS}
+        row.update({"from key": ("db", f"from {i}"), "to key": ("db", f"to {i}"), "flow type": "technosphere"})
+        rows.append(row)
+    dataframe = pd.DataFrame(rows)
+    for scenario in SCENARIOS:
+        dataframe[scenario] = VALUES[scenario]
+    return dataframe
+
+
+def test_round_trip_keeps_values_missing_in_the_first_scenario(tmp_path):
+    store = ScenarioDeltaStore.from_dataframe(scenario_dataframe(), SCENARIOS)
+    store.save(str(tmp_path / "store.npz"))
+    loaded = ScenarioDeltaStore.load(str(tmp_path / "store.npz"))
+
+    for current in (store, loaded):
+        for scenario in SCENARIOS:
+            np.testing.assert_array_equal(current.scenario_values(scenario), VALUES[scenario])
+    assert loaded.flows["from key"].tolist() == [("db", f"from {i}") for i in range(4)]
+
+
+def test_only_changed_flows_are_stored():
+    store = ScenarioDeltaStore.from_dataframe(scenario_dataframe(), SCENARIOS)
+    indices, values = store.scenario_changes("B")
+    assert indices.tolist() == [0, 1]
+    np.testing.assert_array_equal(values, [5.0, np.nan])
+    assert len(store.scenario_changes("A")[0]) == 0
@@ -0,0 +1,77 @@
+import pytest
+
+from ab_plugin_scenariolink.descriptor import parse_scenarios
+from ab_plugin_scenariolink.selection import (parse_rule, apply_rules, save_preset, load_presets, delete_preset,
+                                              preset_scenarios)
+
+SCENARIOS = parse_scenarios([
+    {"name": f"{model} - {pathway} - {year}"}
+    for model in ("remind", "image")
+    for pathway in ("SSP2-Base", "SSP2-PkBudg1150", "SSP1-Base")
+    for year in (2020, 2030, 2040, 2050)
+])
+
+
+def selected_names(selection: list) -> list:
+    return [name for name, state in zip(SCENARIOS["name"], selection) if state]
+
+
+def test_parse_rule():
+    assert parse_rule("pathway=SSP2*,SSP1* year=2030") == {
+        "exclude": False, "conditions": {"pathway": ["SSP2*", "SSP1*"], "year": ["2030"]}}
+    assert parse_rule(" - Model=image")["exclude"]
+    assert parse_rule(" - Model=image")["conditions"] == {"model": ["image"]}
+    for invalid in ("pathway", "=SSP2", "-", "year="):
+        with pytest.raises(ValueError):
+            parse_rule(invalid)
+
+
+def test_rules_match_wildcards_case_insensitively():
+    selection = apply_rules(SCENARIOS, ["model=REMIND pathway=ssp2-*"])
+    assert len(selected_names(selection)) == 8
+    assert all(name.startswith("remind - SSP2") for name in selected_names(selection))
+
+
+def test_year_ranges():
+    assert selected_names(apply_rules(SCENARIOS, ["model=image pathway=SSP1-Base year=2030-2040"])) == [
+        "image - SSP1-Base - 2030", "image - SSP1-Base - 2040"]
+    assert len(selected_names(apply_rules(SCENARIOS, ["model=image pathway=SSP1-Base year=2040-"]))) == 2
+    assert len(selected_names(apply_rules(SCENARIOS, ["model=image pathway=SSP1-Base year=-2030,2050"]))) == 3
+    with pytest.raises(ValueError):
+        apply_rules(SCENARIOS, ["year=soon"])
+
+
+def test_exclusion_applies_on_top_of_the_selection():
+    selection = apply_rules(SCENARIOS, ["model=remind", "-pathway=SSP2-* year=2020-2030"])
+    assert len(selected_names(selection)) == 12 - 4
+    assert "remind - SSP2-Base - 2020" not in selected_names(selection)
+    assert "remind - SSP1-Base - 2020" in selected_names(selection)
+
+    # rules add to an existing selection
+    kept = apply_rules(SCENARIOS, ["year=2050"], include=selection)
+    assert len(selected_names(kept)) == 8 + 3
+
+
+def test_unknown_column():
+    with pytest.raises(ValueError, match="Unknown column"):
+        apply_rules(SCENARIOS, ["region=EU"])
+
+
+def test_presets(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path))
+    assert load_presets() == {}
+    save_preset("SSP2 mid-century", ["pathway=SSP2*", "-year=2020"])
+    assert load_presets() == {"SSP2 mid-century": ["pathway=SSP2*", "-year=2020"]}
+    with pytest.raises(ValueError):
+        save_preset("broken", ["pathway"])
+    assert "broken" not in load_presets()
+
+    package = type("Package", (), {"descriptor": {"scenarios": [{"name": n} for n in SCENARIOS["name"]]}})
+    selected = preset_scenarios(package, "SSP2 mid-century")
+    assert len(selected) == 2 * 2 * 3
+    assert all("SSP2" in SCENARIOS["name"][i] and not SCENARIOS["name"][i].endswith("2020") for i in selected)
+    with pytest.raises(KeyError):
+        preset_scenarios(package, "missing")
+
+    delete_preset("SSP2 mid-century")
+    assert load_presets() == {}